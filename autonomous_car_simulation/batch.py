@@ -0,0 +1,94 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Iterable, Iterator
+
+from carsimulation import parse_scenario
+from simulation import CarResult, Simulation
+
+
+def run_scenario(scenario: Simulation | str, engine: str = "loop") -> list[CarResult]:
+    """
+    Runs one scenario and returns its results instead of printing them
+
+    Args:
+            scenario: Simulation, or scenario text in the format read by parse_scenario
+            engine: Stepping engine to use, one of Simulation.ENGINES
+    """
+    simulation = parse_scenario(scenario) if isinstance(scenario, str) else scenario
+    simulation.simulate(engine)
+    return simulation.results()
+
+
+def _run_chunk(
+    chunk: list[tuple[int, Simulation | str]], engine: str
+) -> list[tuple[int, list[CarResult]]]:
+    """
+    Runs a chunk of numbered scenarios in a worker process
+
+    Args:
+            chunk: (index, scenario) pairs
+            engine: Stepping engine to use
+    """
+    return [(index, run_scenario(scenario, engine)) for index, scenario in chunk]
+
+
+def run_batch(
+    scenarios: Iterable[Simulation | str],
+    workers: int | None = None,
+    chunk_size: int = 16,
+    ordered: bool = True,
+    engine: str = "loop",
+) -> Iterator[tuple[int, list[CarResult]]]:
+    """
+    Runs many independent scenarios on a process pool and streams back their results.
+    Scenarios are read lazily and only a few chunks per worker are in flight at a time.
+
+    Args:
+            scenarios: Simulations or scenario texts
+            workers: Number of worker processes, defaults to the number of CPUs
+            chunk_size: Number of scenarios sent to a worker at a time
+            ordered: Yield results in input order, otherwise as soon as each chunk completes
+            engine: Stepping engine each scenario is run with
+
+    Returns:
+            (index of the scenario in the input, results of its cars) pairs
+    """
+    if engine not in Simulation.ENGINES:
+        raise ValueError(
+            f"Unknown engine {engine!r}. Please choose from {Simulation.ENGINES}"
+        )
+
+    workers = workers or os.cpu_count() or 1
+    numbered = enumerate(scenarios)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # keep every worker busy without reading the whole input up front
+        limit = 4 * workers
+        pending = set()
+        finished = {}
+        next_index = 0
+        exhausted = False
+
+        while pending or not exhausted:
+            while not exhausted and len(pending) < limit:
+                chunk = list(islice(numbered, chunk_size))
+                if not chunk:
+                    exhausted = True
+                    break
+                pending.add(executor.submit(_run_chunk, chunk, engine))
+
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for index, results in future.result():
+                    if ordered:
+                        finished[index] = results
+                    else:
+                        yield index, results
+
+            while next_index in finished:
+                yield next_index, finished.pop(next_index)
+                next_index += 1
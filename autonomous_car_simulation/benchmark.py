@@ -0,0 +1,295 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable
+
+from simulation import Simulation
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+
+def random_commands(rng: random.Random, length: int, alphabet: str) -> str:
+    """
+    Random commands drawn from some letters, repeat a letter to make it more likely
+
+    Args:
+            rng: Random generator
+            length: Number of commands
+            alphabet: Letters to draw from
+    """
+    return "".join(rng.choices(alphabet, k=length))
+
+
+def random_fleet(
+    rng: random.Random,
+    width: int,
+    height: int,
+    count: int,
+    commands: Callable[[], str],
+) -> list[tuple[str, int, int, str, str]]:
+    """
+    Cars on distinct random cells with random commands
+
+    Args:
+            rng: Random generator
+            width: Width of Simulation Grid
+            height: Height of Simulation Grid
+            count: Number of cars
+            commands: Returns the commands of the next car
+
+    Returns:
+            (name, x, y, direction, commands) of each car
+    """
+    cells = rng.sample(range(width * height), min(count, width * height))
+    return [
+        (
+            f"C{index}",
+            cell % width,
+            cell // width,
+            rng.choice("NESW"),
+            commands(),
+        )
+        for index, cell in enumerate(cells)
+    ]
+
+
+def sparse_grid(rng: random.Random, scale: float) -> tuple[int, int, list]:
+    """
+    Few cars spread over a huge grid, they almost never meet
+
+    Args:
+            rng: Random generator
+            scale: Multiplies the number of cars
+    """
+    size = 100_000
+    return size, size, random_fleet(
+        rng, size, size, int(10_000 * scale), lambda: random_commands(rng, 50, "FFFFLR")
+    )
+
+
+def dense_grid(rng: random.Random, scale: float) -> tuple[int, int, list]:
+    """
+    Small grid with most cells taken, most cars end up in pile-ups
+
+    Args:
+            rng: Random generator
+            scale: Multiplies the number of cars
+    """
+    cars = int(2_000 * scale)
+    size = max(2, int((cars / 0.8) ** 0.5) + 1)
+    return size, size, random_fleet(
+        rng, size, size, cars, lambda: random_commands(rng, 50, "FFFLR")
+    )
+
+
+def straight_runs(rng: random.Random, scale: float, size: int = 2_000) -> tuple[int, int, list]:
+    """
+    Long runs of F on a big grid, with a turn now and then
+
+    Args:
+            rng: Random generator
+            scale: Multiplies the length of the commands
+            size: Width and height of the grid
+    """
+    length = int(5_000 * scale)
+
+    def commands():
+        runs = [
+            "F" * rng.randint(100, 1_000) + rng.choice("LR") for _ in range(length // 500 + 1)
+        ]
+        return "".join(runs)[:length]
+
+    return size, size, random_fleet(rng, size, size, 200, commands)
+
+
+def moving_fleet(rng: random.Random, scale: float) -> tuple[int, int, list]:
+    """
+    The straight runs on a grid so big that few cars meet, nearly the whole fleet moves every step
+
+    Args:
+            rng: Random generator
+            scale: Multiplies the length of the commands
+    """
+    return straight_runs(rng, scale, 5_000)
+
+
+def rotation_heavy(rng: random.Random, scale: float) -> tuple[int, int, list]:
+    """
+    Commands that mostly turn on the spot
+
+    Args:
+            rng: Random generator
+            scale: Multiplies the number of cars
+    """
+    return 1_000, 1_000, random_fleet(
+        rng, 1_000, 1_000, int(5_000 * scale), lambda: random_commands(rng, 200, "LRLRLRF")
+    )
+
+
+def skewed_lengths(rng: random.Random, scale: float) -> tuple[int, int, list]:
+    """
+    Most cars have a few commands and a handful have thousands
+
+    Args:
+            rng: Random generator
+            scale: Multiplies the number of cars
+    """
+    return 1_000, 1_000, random_fleet(
+        rng,
+        1_000,
+        1_000,
+        int(5_000 * scale),
+        lambda: random_commands(rng, min(int(5 * rng.paretovariate(1.2)), 20_000), "FFFLR"),
+    )
+
+
+WORKLOADS = {
+    "sparse": sparse_grid,
+    "dense": dense_grid,
+    "straight": straight_runs,
+    "moving": moving_fleet,
+    "rotations": rotation_heavy,
+    "skewed": skewed_lengths,
+}
+
+
+def build(width: int, height: int, specs: list) -> Simulation:
+    """
+    Adds every car through the same checks as the prompts
+
+    Args:
+            width: Width of Simulation Grid
+            height: Height of Simulation Grid
+            specs: (name, x, y, direction, commands) of each car
+    """
+    simulation = Simulation(width, height)
+    for spec in specs:
+        simulation.insert_car(*spec)
+    return simulation
+
+
+def run_workload(
+    name: str, engine: str = "loop", scale: float = 1.0, repeat: int = 3, seed: int = 0
+) -> dict:
+    """
+    Times setting up and running one workload, keeping the best of a few tries
+
+    Args:
+            name: Workload name, a key of WORKLOADS
+            engine: Stepping engine to use, one of Simulation.ENGINES
+            scale: Size of the workload, 1 being the default
+            repeat: Number of timed tries
+            seed: Seed of the random fleet
+
+    Returns:
+            Timings, counts and peak memory of the workload
+    """
+    width, height, specs = WORKLOADS[name](random.Random(seed), scale)
+    setup = run = float("inf")
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        simulation = build(width, height, specs)
+        built = time.perf_counter()
+        # the report is written to a buffer so the terminal is not timed
+        with contextlib.redirect_stdout(io.StringIO()):
+            simulation.run_simulation(engine=engine)
+        done = time.perf_counter()
+        setup = min(setup, built - start)
+        run = min(run, done - built)
+
+    # tracemalloc slows everything down, so memory is measured on a separate run
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        build(width, height, specs).run_simulation(engine=engine)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    commands = sum(len(spec[4]) for spec in specs)
+    steps = max((len(spec[4]) for spec in specs), default=0)
+    return {
+        "cars": len(specs),
+        "commands": commands,
+        "setup_s": setup,
+        "run_s": run,
+        "steps_per_s": steps / run if run else 0.0,
+        "commands_per_s": commands / run if run else 0.0,
+        "peak_mb": peak / 2**20,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Lists the timings that got slower than the baseline by more than the tolerance
+
+    Args:
+            results: Workload name -> results of run_workload
+            baseline: Results saved from an earlier run
+            tolerance: Allowed slowdown, 0.25 is 25% slower
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for key in ("setup_s", "run_s", "peak_mb"):
+            before, after = baseline[name][key], result[key]
+            if before and after > before * (1 + tolerance):
+                regressions.append(f"{name} {key}: {before:.3f} -> {after:.3f}")
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+
+    parser = argparse.ArgumentParser(description="Benchmark the car simulation")
+    parser.add_argument(
+        "workloads", nargs="*", help=f"workloads to run, from {', '.join(WORKLOADS)} (default all)"
+    )
+    parser.add_argument("--engine", choices=Simulation.ENGINES, default="loop")
+    parser.add_argument("--scale", type=float, default=1.0, help="size of every workload")
+    parser.add_argument("--repeat", type=int, default=3, help="timed tries per workload")
+    parser.add_argument("--baseline", default=BASELINE, help="results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown")
+    args = parser.parse_args(argv)
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+
+    results = {}
+    for name in args.workloads or WORKLOADS:
+        result = results[name] = run_workload(name, args.engine, args.scale, args.repeat)
+        print(
+            f"{name:10} {result['cars']:>7} cars {result['commands']:>10} commands  "
+            f"setup {result['setup_s']:8.3f}s  run {result['run_s']:8.3f}s  "
+            f"{result['steps_per_s']:>10,.0f} steps/s  {result['commands_per_s']:>12,.0f} commands/s  "
+            f"peak {result['peak_mb']:8.1f} MB"
+        )
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(
+            f"No baseline at {args.baseline} to compare against, --save-baseline stores one",
+            file=sys.stderr,
+        )
+        return 0
+
+    with open(args.baseline) as file:
+        regressions = compare(results, json.load(file), args.tolerance)
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,24 @@
+from program import CommandProgram
+
+# Directions are stored as an index into HEADINGS, clockwise so that R is +1 and L is +3 (mod 4)
+HEADINGS = "NESW"
+DELTAS = ((0, 1), (1, 0), (0, -1), (-1, 0))
+# the non-zero part of each delta
+STEPS = (1, 1, -1, -1)
+
+# Quarter turns to the right for each command, given as a letter or its byte value.
+# Anything that is not F or R rotates left.
+TURNS = {"F": 0, ord("F"): 0, "R": 1, ord("R"): 1}
+
+
 class Car:
 
     VALID_DIRECTIONS = ["N", "S", "E", "W"]
     VALID_COMMANDS = ["F", "L", "R"]
 
+    # No per-instance __dict__, a million cars should fit in well under a GB
+    __slots__ = ("x", "y", "heading", "name", "command_codes", "_program", "_collision")
+
     def __init__(self, x: int, y: int, direction: str, name: str, commands: str):
         """
         Initialize a car with position, direction, name and movement commands.
@@ -19,73 +35,158 @@ class Car:
         self.direction = direction
         self.name = name
         self.commands = commands
-        self.collided = False
-        self.collided_with = []
-        # to keep track for later prints
-        self.collision_position = None
-        self.collision_step = None
+        # collision details are only allocated once the car collides
+        self._collision = None
+
+    @property
+    def direction(self) -> str:
+        """
+        Direction the car is facing (N, S, E, W)
+
+        """
+        return HEADINGS[self.heading]
+
+    @direction.setter
+    def direction(self, direction: str) -> None:
+        if direction not in Car.VALID_DIRECTIONS:
+            raise ValueError(
+                "Invalid car direction. Only N, S, W, E (representing North, South, West, East) are allowed."
+            )
+        self.heading = HEADINGS.index(direction)
+
+    @property
+    def commands(self) -> str:
+        """
+        String of commands (F, L, R) to be executed
+
+        """
+        return self.command_codes.decode("ascii")
+
+    @commands.setter
+    def commands(self, commands: str) -> None:
+        if not all(cmd in Car.VALID_COMMANDS for cmd in commands):
+            raise ValueError(
+                f"Invalid Commands, Please only supply commands from {Car.VALID_COMMANDS}."
+            )
+        self.command_codes = commands.encode("ascii")
+        self._program = None
+
+    @property
+    def program(self) -> CommandProgram:
+        """
+        Run-length compiled form of the commands, compiled on first use
+
+        """
+        if self._program is None:
+            self._program = CommandProgram(self.command_codes)
+        return self._program
+
+    @property
+    def collision(self) -> "CollisionEvent | None":
+        """
+        Collision the car was involved in, shared with the other cars on the cell
+
+        """
+        return self._collision
+
+    @property
+    def collided(self) -> bool:
+        return self._collision is not None
+
+    @property
+    def collided_with(self) -> list[str]:
+        return self._collision.others(self) if self._collision else []
+
+    @property
+    def collision_position(self) -> tuple[int, int] | None:
+        return self._collision.position if self._collision else None
+
+    @property
+    def collision_step(self) -> int | None:
+        return self._collision.step if self._collision else None
+
+    def collide(self, event: "CollisionEvent | None") -> None:
+        """
+        Records that the car collided, it will not move again
 
-    def move(self, command: str, width: int, height: int) -> None:
+        Args:
+                event: Collision shared by every car on the cell, None to clear it
+        """
+        self._collision = event
+
+    def move(self, command: str | int, width: int, height: int) -> None:
         """
         Takes a command and the width and height of the grid then executes the move on the car if possible.
 
         Args:
                 width: Width of Simulation Grid
                 height: Height of Simulation Grid
-                command: (F, L, R) to be executed
+                command: (F, L, R) to be executed, as a letter or its byte value
         """
 
         # Do not move if collided
-        if self.collided:
+        if self._collision is not None:
             return
 
-        new_x = self.x
-        new_y = self.y
-        new_direction = self.direction
+        turn = TURNS.get(command, 3)
+        if turn:
+            self.heading = (self.heading + turn) & 3
+            return
 
-        if command == "F":
+        # E and W move along x, N and S along y
+        heading = self.heading
+        if heading & 1:
+            x = self.x + STEPS[heading]
+            if 0 <= x < width:
+                self.x = x
+        else:
+            y = self.y + STEPS[heading]
+            if 0 <= y < height:
+                self.y = y
 
-            if self.direction == "N":
-                new_y = self.y + 1
-            elif self.direction == "S":
-                new_y = self.y - 1
-            elif self.direction == "E":
-                new_x = self.x + 1
-            else:
-                new_x = self.x - 1
+    def __str__(self) -> str:
+        """
+        string output for car
 
-        elif command == "R":
+        """
+        return f"- {self.name}, ({self.x},{self.y}), {self.direction} , {self.commands}"
 
-            if self.direction == "N":
-                new_direction = "E"
 
-            elif self.direction == "S":
-                new_direction = "W"
-            elif self.direction == "E":
-                new_direction = "S"
-            else:
-                new_direction = "N"
+class CollisionEvent:
 
-        else:
-            if self.direction == "N":
-                new_direction = "W"
-
-            elif self.direction == "S":
-                new_direction = "E"
-            elif self.direction == "E":
-                new_direction = "N"
-            else:
-                new_direction = "S"
-
-        if 0 <= new_x < width:
-            self.x = new_x
-        if 0 <= new_y < height:
-            self.y = new_y
-        self.direction = new_direction
+    __slots__ = ("position", "step", "cars")
 
-    def __str__(self) -> str:
+    def __init__(self, position: tuple[int, int], step: int, cars: list[Car]) -> None:
         """
-        string output for car
+        A collision on one cell at one step. Every car that collides there refers to the same event,
+        so a pile-up of k cars takes O(k) memory instead of a list of k-1 names per car.
 
+        Args:
+                position: (x, y) of the cell
+                step: Step at which the collision happened
+                cars: Every car on the cell, in the order they were added to the simulation
         """
-        return f"- {self.name}, ({self.x},{self.y}), {self.direction} , {self.commands}"
+        self.position = position
+        self.step = step
+        self.cars = cars
+
+    def others(self, car: Car) -> list[str]:
+        """
+        Returns the names of the other cars on the cell
+
+        Args:
+                car: Car to leave out
+        """
+        return [other.name for other in self.cars if other is not car]
+
+    def describe(self, car: Car) -> str:
+        """
+        Result text of a car involved in the collision
+
+        Args:
+                car: Car the text is for
+        """
+        return (
+            f"collides with {' and '.join(self.others(car))} "
+            f"at ({self.position[0]},{self.position[1]}) at step {self.step}"
+        )
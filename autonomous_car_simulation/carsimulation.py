@@ -1,5 +1,15 @@
+import argparse
+import contextlib
+import sys
+
 from simulation import Simulation
 from car import Car
+from checkpoint import Checkpointer
+from profiling import Profiler
+from recorder import TrajectoryRecorder
+from renderer import ViewportRenderer
+from report import FORMATS
+from sharedstate import SharedFleetState
 
 
 def create_simulation() -> Simulation:
@@ -15,28 +25,173 @@ def create_simulation() -> Simulation:
 
         # enter the try to get the input
         try:
-            input_string: list[str] = input().strip().split()
+            width, height = parse_field(input().strip().split())
 
-            if len(input_string) != 2:
-                print(
-                    "Please provide exactly 2 numbers for the width and the height of the grid"
-                )
-                continue
+        except ValueError as error:
+            print(error)
+            continue
+
+        # Initialize the simulation
+        print(f"You have created a field of {width} x {height}.")
+        return Simulation(width, height)
+
+
+def parse_field(input_string: list[str]) -> tuple[int, int]:
+    """
+    Checks the width and height of the field given as [width, height]
+
+    Args:
+            input_string: The two values entered by the user
+
+    Returns:
+            width and height, or raises ValueError with the message for the user
+    """
+    if len(input_string) != 2:
+        raise ValueError(
+            "Please provide exactly 2 numbers for the width and the height of the grid"
+        )
+
+    try:
+        width, height = map(int, input_string)
+    except ValueError:
+        raise ValueError(
+            "Invalid input. Please enter two positive integers separated by a space."
+        ) from None
+
+    if width <= 0 or height <= 0:
+        raise ValueError("Width and height must be positive integers.")
+
+    return width, height
+
+
+def insert_car_line(simulation: Simulation, values: list[str]) -> Car:
+    """
+    Adds the car of one line in "name x y direction commands" format (commands may be left out)
 
-            width, height = map(int, input_string)
+    Args:
+            simulation: Simulation to add the car to
+            values: The line split on whitespace
+    """
+    if len(values) not in (4, 5):
+        raise ValueError("Please provide the name, x, y, direction and commands of the car")
+
+    x, y, direction = Simulation.parse_position(values[1:4])
+    return simulation.insert_car(values[0], x, y, direction, values[4] if len(values) == 5 else "")
+
+
+def parse_scenario(text: str) -> Simulation:
+    """
+    Builds a simulation from a whole scenario without prompting.
+
+    The first non-blank line is the field size in "width height" format, every other non-blank
+    line is one car in "name x y direction commands" format (commands may be left out).
+    Cars are checked with the same rules as Simulation.add_car.
+
+    Args:
+            text: Scenario file contents
+
+    Returns:
+            The simulation, or raises ValueError naming the first invalid line
+    """
+    simulation = None
 
-            if width <= 0 or height <= 0:
-                print("Width and height must be positive integers.")
+    for number, line in enumerate(text.splitlines(), start=1):
+        values = line.split()
+        if not values:
+            continue
+
+        try:
+            if simulation is None:
+                simulation = Simulation(*parse_field(values))
                 continue
 
-            # Initialize the simulation
-            print(f"You have created a field of {width} x {height}.")
-            return Simulation(width, height)
+            insert_car_line(simulation, values)
 
-        except:
-            print(
-                "Invalid input. Please enter two positive integers separated by a space."
-            )
+        except ValueError as error:
+            raise ValueError(f"Line {number}: {error}") from None
+
+    if simulation is None:
+        raise ValueError("The scenario is empty, expected the width and height of the field")
+
+    return simulation
+
+
+def load_scenario(path: str) -> Simulation:
+    """
+    Reads a scenario file in one go and builds the simulation, see parse_scenario for the format
+
+    Args:
+            path: Path of the scenario file
+    """
+    with open(path, encoding="utf-8") as scenario:
+        return parse_scenario(scenario.read())
+
+
+def parse_view(text: str) -> tuple[int, int]:
+    """
+    Parses the bottom left cell of the viewport from X,Y
+
+    Args:
+            text: Command line value
+    """
+    try:
+        x, y = (int(value) for value in text.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected X,Y") from None
+    return x, y
+
+
+def add_many_cars(simulation: Simulation) -> int:
+    """
+    Adds a pasted block of cars, one per line in "name x y direction commands" format.
+    The block ends at the first empty line, invalid lines are reported and skipped.
+
+    Args:
+            simulation: Simulation to add the cars to
+
+    Returns:
+            Number of cars added
+    """
+    print(
+        "Please paste the cars, one per line in name x y Direction Commands format, "
+        "followed by an empty line:"
+    )
+    added = 0
+    number = 0
+    while True:
+        try:
+            values = input().split()
+        except EOFError:
+            break
+        if not values:
+            break
+
+        number += 1
+        try:
+            insert_car_line(simulation, values)
+        except ValueError as error:
+            print(f"Line {number} skipped: {error}")
+            continue
+        added += 1
+
+    print(f"Added {added} car{'s' if added != 1 else ''}.")
+    return added
+
+
+def list_cars(simulation: Simulation, page_size: int = 20) -> None:
+    """
+    Prints the cars a page at a time until the user stops or the list ends
+
+    Args:
+            simulation: Simulation whose cars are listed
+            page_size: Number of cars per page
+    """
+    page = 0
+    while simulation.display_cars_page(page, page_size):
+        print("Press Enter for the next page, or q to go back to the menu:")
+        if input().strip().lower() == "q":
+            return
+        page += 1
 
 
 def main_menu_selection() -> str:
@@ -47,11 +202,111 @@ def main_menu_selection() -> str:
     print("Please choose from the following options:")
     print("[1] Add a car to field")
     print("[2] Run simulation")
+    print("[3] Add many cars at once")
+    print("[4] List all cars")
 
     return input().strip()
 
 
-def main():
+def main(argv: list[str] | None = None):
+
+    parser = argparse.ArgumentParser(description="Auto Driving Car Simulation")
+    parser.add_argument(
+        "scenario",
+        nargs="?",
+        help="run a scenario file without prompting instead of the interactive menu",
+    )
+    parser.add_argument("--engine", choices=Simulation.ENGINES, default="loop")
+    parser.add_argument(
+        "--record",
+        metavar="PATH",
+        help="write the position of every car after every step to a binary log (loop engine)",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        metavar="PATH",
+        help="save the state of the run to PATH every --checkpoint-every steps (loop engine)",
+    )
+    parser.add_argument("--checkpoint-every", type=int, default=100_000, metavar="STEPS")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="carry on from the --checkpoint file instead of starting at step 1",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="PATH",
+        help="time each phase and count what every step does, written as JSON "
+        "or as a pstats profile if PATH ends in .prof",
+    )
+    parser.add_argument(
+        "--share",
+        metavar="NAME",
+        help="publish the fleet state to the shared memory block NAME while running, "
+        "for FleetObserver readers in other processes",
+    )
+    parser.add_argument(
+        "--render",
+        action="store_true",
+        help="show the field in the terminal while the simulation runs",
+    )
+    parser.add_argument(
+        "--view",
+        type=parse_view,
+        default=(0, 0),
+        metavar="X,Y",
+        help="bottom left cell of the rendered viewport (default 0,0)",
+    )
+    parser.add_argument("--fps", type=float, default=20.0, help="most frames rendered per second")
+    parser.add_argument("--format", choices=FORMATS, default="text", help="format of the results")
+    parser.add_argument("--output", metavar="PATH", help="write the results to PATH instead")
+    args = parser.parse_args(argv)
+    if args.resume and not args.checkpoint:
+        parser.error("--resume needs --checkpoint")
+    if args.resume and args.record:
+        parser.error("--record needs a run from step 1, not --resume")
+
+    if args.scenario:
+        try:
+            simulation = load_scenario(args.scenario)
+        except (OSError, ValueError) as error:
+            print(error, file=sys.stderr)
+            return 1
+
+        recorder = TrajectoryRecorder(args.record) if args.record else None
+        try:
+            checkpointer = (
+                Checkpointer(args.checkpoint, args.checkpoint_every) if args.checkpoint else None
+            )
+            if args.profile:
+                simulation.profiler = Profiler()
+            if args.render:
+                simulation.renderer = ViewportRenderer(x=args.view[0], y=args.view[1], fps=args.fps)
+            if args.share:
+                simulation.shared_state = SharedFleetState(
+                    simulation.cars, simulation.width, simulation.height, args.share
+                )
+            # results go straight to the file through its own buffer
+            with open(args.output, "w") if args.output else contextlib.nullcontext() as output:
+                simulation.run_simulation(
+                    engine=args.engine,
+                    recorder=recorder,
+                    checkpointer=checkpointer,
+                    resume=args.checkpoint if args.resume else None,
+                    output=output,
+                    report_format=args.format,
+                )
+            if args.profile and args.profile.endswith(".prof"):
+                simulation.profiler.write_pstats(args.profile)
+            elif args.profile:
+                simulation.profiler.write_json(args.profile)
+        except (OSError, ValueError) as error:
+            print(error, file=sys.stderr)
+            return 1
+        finally:
+            if simulation.shared_state is not None:
+                simulation.shared_state.close()
+        return 0
 
     print("""Welcome to Auto Driving Car Simulation!""")
 
@@ -62,7 +317,7 @@ def main():
         # Simulation Menu Loop
         while True:
             if simulation.cars:
-                simulation.display_current_cars()
+                simulation.display_summary()
 
             program_selection = main_menu_selection()
 
@@ -85,6 +340,12 @@ def main():
 
                 return
 
+            elif program_selection == "3":
+                add_many_cars(simulation)
+
+            elif program_selection == "4":
+                list_cars(simulation)
+
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import os
+import pickle
+from array import array
+from typing import NamedTuple
+
+VERSION = 1
+# x, y, heading and collision number of each car, stored one array per field
+TYPECODES = "iiBi"
+
+
+class Checkpoint(NamedTuple):
+    """
+    State of a simulation after a step, as returned by Simulation.get_state
+    """
+
+    step: int
+    state: tuple[list, list]
+
+
+def save_checkpoint(path: str, step: int, state: tuple[list, list]) -> None:
+    """
+    Writes a checkpoint. The file is replaced in one go, so a run killed while writing
+    leaves the previous checkpoint in place.
+
+    Args:
+            path: File to write
+            step: Last step that was run
+            state: State returned by Simulation.get_state
+    """
+    cars, collisions = state
+    # one array per field pickles as a few flat buffers instead of a tuple per car
+    columns = (
+        [array(typecode, column) for typecode, column in zip(TYPECODES, zip(*cars))]
+        if cars
+        else []
+    )
+
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as file:
+        pickle.dump(
+            (VERSION, step, len(cars), columns, collisions),
+            file,
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+    os.replace(temporary, path)
+
+
+def load_checkpoint(path: str) -> Checkpoint:
+    """
+    Reads a checkpoint written by save_checkpoint
+
+    Args:
+            path: File to read
+    """
+    with open(path, "rb") as file:
+        try:
+            version, step, count, columns, collisions = pickle.load(file)
+        except (pickle.UnpicklingError, EOFError, ValueError, TypeError) as error:
+            raise ValueError(f"{path} is not a simulation checkpoint") from error
+
+    if version != VERSION:
+        raise ValueError(f"{path} is a checkpoint of version {version}, expected {VERSION}")
+
+    cars = list(zip(*columns)) if count else []
+    return Checkpoint(step, (cars, collisions))
+
+
+class Checkpointer:
+    def __init__(self, path: str, every: int) -> None:
+        """
+        Saves the state of a running simulation every few steps
+
+        Args:
+                path: File the latest checkpoint is kept in
+                every: Number of steps between checkpoints
+        """
+        if every < 1:
+            raise ValueError("Checkpoints must be at least 1 step apart")
+        self.path = path
+        self.every = every
+
+    def step_done(self, simulation, step: int) -> None:
+        """
+        Called by the simulation after every step, saves a checkpoint every few steps
+
+        Args:
+                simulation: Simulation being run
+                step: Step that was just run
+        """
+        if step % self.every == 0:
+            save_checkpoint(self.path, step, simulation.get_state())
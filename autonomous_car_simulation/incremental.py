@@ -0,0 +1,284 @@
+from car import Car
+from simulation import CarResult, MoveEvent, Simulation
+from trajectory import NEVER, car_trajectory
+
+
+class SnapshotCache:
+    def __init__(self, every: int) -> None:
+        """
+        Keeps the state of a running simulation in memory every few steps.
+        Passed to the loop engine in place of a Checkpointer.
+
+        Args:
+                every: Number of steps between snapshots
+        """
+        if every < 1:
+            raise ValueError("Snapshots must be at least 1 step apart")
+        self.every = every
+        # step -> state from Simulation.get_state after that step
+        self.states = {}
+
+    def step_done(self, simulation: Simulation, step: int) -> None:
+        """
+        Called by the simulation after every step, keeps a snapshot every few steps
+
+        Args:
+                simulation: Simulation being run
+                step: Step that was just run
+        """
+        if step % self.every == 0:
+            self.states[step] = simulation.get_state()
+
+    def latest_before(self, step: int) -> int:
+        """
+        Returns the step of the last snapshot taken before a step
+
+        Args:
+                step: Step the snapshot must come before
+        """
+        return max(taken for taken in self.states if taken < step)
+
+    def drop_from(self, step: int) -> None:
+        """
+        Forgets the snapshots of a step and of every step after it
+
+        Args:
+                step: First step to forget
+        """
+        for taken in [taken for taken in self.states if taken >= step]:
+            del self.states[taken]
+
+
+class OccupancyTimeline:
+    def __init__(self, cars: list[Car]) -> None:
+        """
+        Which cars were on each cell and when, over a whole run.
+
+        Every stay of a car on a cell is an interval [start, end): the car is on the cell after
+        step start up to and including step end - 1. A car that stops, by running out of commands
+        or by colliding, stays on its last cell until NEVER.
+
+        Args:
+                cars: Cars at step 0
+        """
+        # cell -> [start, end, car index] of every stay on the cell
+        self.cells = {}
+        # car index -> (cell, stay) of every stay of the car, in step order
+        self.stays = []
+        for car in cars:
+            self.add_car((car.x, car.y), 0)
+
+    def add_car(self, cell: tuple[int, int], step: int) -> None:
+        """
+        Adds a car that is on a cell from a step onwards
+
+        Args:
+                cell: (x, y) of the cell
+                step: First step the car is there
+        """
+        stay = [step, NEVER, len(self.stays)]
+        self.cells.setdefault(cell, []).append(stay)
+        self.stays.append([(cell, stay)])
+
+    def moved(self, index: int, cell: tuple[int, int], step: int) -> None:
+        """
+        Records where a car is after a step
+
+        Args:
+                index: Index of the car
+                cell: (x, y) of the car after the step
+                step: Step that was run
+        """
+        stays = self.stays[index]
+        if stays[-1][0] == cell:
+            return
+        stays[-1][1][1] = step
+        stay = [step, NEVER, index]
+        self.cells.setdefault(cell, []).append(stay)
+        stays.append((cell, stay))
+
+    def truncate(self, step: int) -> None:
+        """
+        Forgets everything after a step, leaving each car on its cell at that step
+
+        Args:
+                step: Last step to keep
+        """
+        for stays in self.stays:
+            while stays[-1][1][0] > step:
+                cell, stay = stays.pop()
+                self.cells[cell].remove(stay)
+            stays[-1][1][1] = NEVER
+
+    def first_conflict(self, index: int, stays: list[tuple[tuple[int, int], int, int]]) -> int:
+        """
+        Returns the first step at which a car following a path would share a cell with another car
+
+        Args:
+                index: Index of the car, its own stays are ignored
+                stays: (cell, start, end) of every stay of the car along the path
+
+        Returns:
+                The step, NEVER if the path never meets another car
+        """
+        first = NEVER
+        for cell, start, end in stays:
+            if start >= first:
+                break
+            for other_start, other_end, other in self.cells.get(cell, ()):
+                if other != index and other_start < end and start < other_end:
+                    first = min(first, max(start, other_start))
+        return first
+
+
+class IncrementalSimulation:
+    def __init__(self, simulation: Simulation, snapshot_every: int = 1000) -> None:
+        """
+        Runs a simulation and keeps enough of the run to redo only what an edit changes.
+
+        Snapshots of the fleet are kept every few steps, along with when each car was on each cell.
+        After appending commands to a car or adding a car, its new path is checked against the
+        cells of the other cars. Nothing before the first step it meets another car can change,
+        so the run carries on from the last snapshot before that step. A path that meets no car
+        is applied directly without stepping anything else.
+
+        Args:
+                simulation: Simulation to run, its cars must not have been run yet
+                snapshot_every: Number of steps between snapshots, fewer means more memory
+                        and less to redo
+        """
+        self.simulation = simulation
+        self.snapshots = SnapshotCache(snapshot_every)
+        self.timeline = None
+        self._indexes = {car.name: index for index, car in enumerate(simulation.cars)}
+
+    def run(self) -> list[CarResult]:
+        """
+        Runs the whole simulation from step 1
+
+        """
+        self.snapshots.drop_from(0)
+        self.snapshots.states[0] = self.simulation.get_state()
+        self.timeline = OccupancyTimeline(self.simulation.cars)
+        self._run_from(0)
+        return self.simulation.results()
+
+    def append_commands(self, car_name: str, commands: str) -> int:
+        """
+        Appends commands to a car and updates the results
+
+        Args:
+                car_name: Name of the car
+                commands: Commands (F, L, R) to add after the car's last command
+
+        Returns:
+                Step the simulation was run again from, NEVER if no other car was affected
+        """
+        commands = Simulation.validate_commands(commands)
+        if car_name not in self._indexes:
+            raise ValueError(f"There is no car named {car_name}")
+        index = self._indexes[car_name]
+        car = self.simulation.cars[index]
+        start = len(car.command_codes)
+        car.commands += commands
+
+        # a car that collided while still running never gets to its new commands
+        if car.collided and car.collision_step <= start:
+            return NEVER
+        # a car hit while parked leaves before the collision, which changes from that step on
+        changed = car.collision_step if car.collided else NEVER
+        return self._apply_path(index, start, commands, changed)
+
+    def add_car(
+        self, car_name: str, x: int, y: int, direction: str, commands: str
+    ) -> int:
+        """
+        Adds a car, with the same checks as Simulation.insert_car, and updates the results
+
+        Args:
+                car_name: Car Name
+                x: Initial x-coordinate (column)
+                y: Initial y-coordinate (row)
+                direction: Direction the car is facing (N, S, E, W)
+                commands: String of commands (F, L, R) to be executed
+
+        Returns:
+                Step the simulation was run again from, NEVER if no other car was affected
+        """
+        car = self.simulation.insert_car(car_name, x, y, direction, commands)
+        index = len(self.simulation.cars) - 1
+        self._indexes[car_name] = index
+
+        # the car is on its cell at step 0 in every snapshot, until _apply_path moves it
+        for cars_state, _ in self.snapshots.states.values():
+            cars_state.append((car.x, car.y, car.heading, -1))
+        self.timeline.add_car((car.x, car.y), 0)
+        return self._apply_path(index, 0, car.commands)
+
+    def _apply_path(
+        self, index: int, start: int, commands: str, changed: float = NEVER
+    ) -> int:
+        """
+        Moves a car along new commands from a step, running the simulation again only
+        from where it meets another car
+
+        Args:
+                index: Index of the car
+                start: Step after which the car runs the commands
+                commands: Commands the car runs from that step
+                changed: Step from which the run differs anyway, NEVER if only the new path matters
+
+        Returns:
+                Step the simulation was run again from, NEVER if no other car was affected
+        """
+        car = self.simulation.cars[index]
+        width, height = self.simulation.width, self.simulation.height
+        xs, ys, headings = car_trajectory(
+            car.x, car.y, car.heading, commands.encode("ascii"), width, height
+        )
+
+        # stays of the car along the path, as if it were alone
+        stays = []
+        for offset in range(len(headings)):
+            cell = (xs[offset], ys[offset])
+            if not stays or stays[-1][0] != cell:
+                if stays:
+                    stays[-1][2] = start + offset
+                stays.append([cell, start + offset, NEVER])
+        conflict = min(self.timeline.first_conflict(index, stays), changed)
+
+        # up to the conflict the car follows the path and no other car notices
+        for step, (cars_state, _) in self.snapshots.states.items():
+            if start <= step < conflict:
+                offset = min(step - start, len(commands))
+                cars_state[index] = (xs[offset], ys[offset], headings[offset], -1)
+        for cell, stay_start, _ in stays[1:]:
+            if stay_start >= conflict:
+                break
+            self.timeline.moved(index, cell, stay_start)
+
+        if conflict == NEVER:
+            car.x, car.y, car.heading = xs[-1], ys[-1], headings[-1]
+            return NEVER
+
+        self.snapshots.drop_from(conflict)
+        step = self.snapshots.latest_before(conflict)
+        self.simulation.set_state(self.snapshots.states[step], reset=True)
+        self.timeline.truncate(step)
+        self._run_from(step)
+        return step
+
+    def _run_from(self, step: int) -> None:
+        """
+        Runs the loop engine from a step, recording snapshots and stays as it goes
+
+        Args:
+                step: Step the cars are at
+        """
+        events = self.simulation.iter_events(
+            moves=True, checkpointer=self.snapshots, start_step=step
+        )
+        moved = self.timeline.moved
+        for event in events:
+            if isinstance(event, MoveEvent):
+                moved(event.index, (event.x, event.y), event.step)
@@ -0,0 +1,317 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+
+from car import HEADINGS, Car
+from simulation import Simulation
+from vectorized import simulate_arrays
+
+
+class Fleet(NamedTuple):
+    x: np.ndarray
+    y: np.ndarray
+    heading: np.ndarray
+    codes: np.ndarray
+    offsets: np.ndarray
+    lengths: np.ndarray
+    width: int
+    height: int
+
+
+def check_fleet(
+    width: int, height: int, cars: int, min_length: int, max_length: int, alphabet: str
+) -> None:
+    """
+    Raises ValueError if random fleets cannot be made with these arguments
+
+    Args:
+            width: Width of Simulation Grid
+            height: Height of Simulation Grid
+            cars: Number of cars
+            min_length: Fewest commands of a car
+            max_length: Most commands of a car
+            alphabet: Letters to draw commands from
+    """
+    if width <= 0 or height <= 0:
+        raise ValueError("Please provide a positive width and height")
+    if not 0 <= cars <= width * height:
+        raise ValueError(f"{cars} cars do not fit on a {width}x{height} grid")
+    if not 0 <= min_length <= max_length:
+        raise ValueError("Please provide command lengths with 0 <= min_length <= max_length")
+    if not alphabet or set(alphabet) - set("FLR"):
+        raise ValueError("Please only use F, L and R commands")
+
+
+def random_fleet_arrays(
+    seed: int,
+    width: int,
+    height: int,
+    cars: int,
+    min_length: int,
+    max_length: int,
+    alphabet: str = "FFFLR",
+) -> Fleet:
+    """
+    Generates a whole random fleet as arrays, the same fleet for the same seed and arguments.
+
+    Cars start on distinct cells with random headings, and each gets between min_length and
+    max_length commands drawn from the alphabet. Repeat a letter to make it more likely.
+
+    Args:
+            seed: Seed of the fleet
+            width: Width of Simulation Grid
+            height: Height of Simulation Grid
+            cars: Number of cars, at most one per cell
+            min_length: Fewest commands of a car
+            max_length: Most commands of a car
+            alphabet: Letters to draw commands from (F, L, R)
+    """
+    check_fleet(width, height, cars, min_length, max_length, alphabet)
+    rng = np.random.default_rng(seed)
+    cells = rng.choice(width * height, size=cars, replace=False)
+    heading = rng.integers(0, len(HEADINGS), size=cars)
+    lengths = rng.integers(min_length, max_length + 1, size=cars)
+
+    offsets = np.zeros(cars, dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    letters = np.frombuffer(alphabet.encode("ascii"), dtype=np.uint8)
+    codes = letters[rng.integers(0, len(letters), size=int(lengths.sum()))]
+
+    return Fleet(
+        cells % width, cells // width, heading, codes, offsets, lengths, width, height
+    )
+
+
+def fleet_simulation(fleet: Fleet) -> Simulation:
+    """
+    Builds the Simulation of a generated fleet, to look into one seed with the other engines
+
+    Args:
+            fleet: Fleet from random_fleet_arrays, car i is named Ci
+    """
+    simulation = Simulation(fleet.width, fleet.height)
+    codes = fleet.codes.tobytes().decode("ascii")
+    # the cells are distinct, so the checks of add_car are not needed
+    simulation.cars = [
+        Car(x, y, HEADINGS[heading], f"C{index}", codes[offset : offset + length])
+        for index, (x, y, heading, offset, length) in enumerate(
+            zip(
+                fleet.x.tolist(),
+                fleet.y.tolist(),
+                fleet.heading.tolist(),
+                fleet.offsets.tolist(),
+                fleet.lengths.tolist(),
+            )
+        )
+    ]
+    return simulation
+
+
+def fleet_statistics(fleet: Fleet, step_bin: int = 10) -> dict:
+    """
+    Runs a fleet on the NumPy engine and summarises its collisions
+
+    Args:
+            fleet: Fleet from random_fleet_arrays, its arrays are left untouched
+            step_bin: Number of steps per bucket of the step histogram
+
+    Returns:
+            cars, collisions (cells where cars collided), collided (cars that collided),
+            pileups (number of collisions with each number of cars on the cell, by index) and
+            steps (number of collisions in each bucket of step_bin steps, from step 0)
+    """
+    collisions = simulate_arrays(
+        fleet.x.copy(),
+        fleet.y.copy(),
+        fleet.heading.copy(),
+        fleet.codes,
+        fleet.offsets,
+        fleet.lengths,
+        fleet.width,
+        fleet.height,
+    )
+    # a car driving into a pile-up makes a new collision with every car already there
+    sizes = np.array([len(occupants) for _, _, occupants, _ in collisions], dtype=np.int64)
+    steps = np.array([step for step, _, _, _ in collisions], dtype=np.int64)
+    max_length = int(fleet.lengths.max()) if len(fleet.lengths) else 0
+
+    return {
+        "cars": len(fleet.x),
+        "collisions": len(collisions),
+        "collided": int(sum(len(newly) for _, _, _, newly in collisions)),
+        "pileups": np.bincount(sizes, minlength=2).tolist(),
+        "steps": np.bincount(steps // step_bin, minlength=max_length // step_bin + 1).tolist(),
+    }
+
+
+def _run_seeds(seeds: list[int], fleet: dict, step_bin: int) -> list[dict]:
+    """
+    Generates and runs the fleets of some seeds in a worker process
+
+    Args:
+            seeds: Seeds of the fleets
+            fleet: Arguments of random_fleet_arrays other than the seed
+            step_bin: Number of steps per bucket of the step histogram
+    """
+    return [
+        {"seed": seed, **fleet_statistics(random_fleet_arrays(seed, **fleet), step_bin)}
+        for seed in seeds
+    ]
+
+
+def _add_counts(total: list[int], counts: list[int]) -> None:
+    """
+    Adds a histogram into a running total, growing the total if needed
+
+    Args:
+            total: Histogram summed so far
+            counts: Histogram to add
+    """
+    total.extend([0] * (len(counts) - len(total)))
+    for index, count in enumerate(counts):
+        total[index] += count
+
+
+def collision_sweep(
+    seeds: list[int],
+    width: int,
+    height: int,
+    cars: int,
+    min_length: int,
+    max_length: int,
+    alphabet: str = "FFFLR",
+    step_bin: int = 10,
+    workers: int | None = None,
+    chunk_size: int = 16,
+) -> dict:
+    """
+    Runs one random fleet per seed and aggregates their collision statistics.
+    Each fleet only depends on its seed, so the results are the same for any number of workers.
+
+    Args:
+            seeds: Seeds of the fleets
+            width: Width of Simulation Grid
+            height: Height of Simulation Grid
+            cars: Number of cars of every fleet
+            min_length: Fewest commands of a car
+            max_length: Most commands of a car
+            alphabet: Letters to draw commands from (F, L, R)
+            step_bin: Number of steps per bucket of the step histogram
+            workers: Number of worker processes, None uses every CPU and 1 runs them here
+            chunk_size: Number of seeds sent to a worker at a time
+
+    Returns:
+            Totals over every fleet, collisions per fleet, the pile-up size and collision step
+            histograms, and the statistics of each seed in seed order under per_seed
+    """
+    seeds = list(seeds)
+    fleet = {
+        "width": width,
+        "height": height,
+        "cars": cars,
+        "min_length": min_length,
+        "max_length": max_length,
+        "alphabet": alphabet,
+    }
+    # bad arguments fail here rather than in every worker
+    check_fleet(**fleet)
+    if step_bin <= 0:
+        raise ValueError("Please provide a positive step_bin")
+
+    chunks = [seeds[start : start + chunk_size] for start in range(0, len(seeds), chunk_size)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(chunks) <= 1:
+        per_seed = [stats for chunk in chunks for stats in _run_seeds(chunk, fleet, step_bin)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                _run_seeds, chunks, [fleet] * len(chunks), [step_bin] * len(chunks)
+            )
+            per_seed = [stats for chunk in results for stats in chunk]
+
+    pileups = []
+    steps = []
+    for stats in per_seed:
+        _add_counts(pileups, stats["pileups"])
+        _add_counts(steps, stats["steps"])
+    counts = np.array([stats["collisions"] for stats in per_seed], dtype=np.float64)
+    total_cars = sum(stats["cars"] for stats in per_seed)
+    collided = sum(stats["collided"] for stats in per_seed)
+
+    return {
+        "fleets": len(per_seed),
+        "cars": total_cars,
+        "collisions": int(counts.sum()),
+        "collided": collided,
+        "collided_fraction": collided / total_cars if total_cars else 0.0,
+        "collisions_per_fleet": {
+            "mean": float(counts.mean()) if counts.size else 0.0,
+            "std": float(counts.std()) if counts.size else 0.0,
+            "min": int(counts.min()) if counts.size else 0,
+            "max": int(counts.max()) if counts.size else 0,
+        },
+        "pileups": pileups,
+        "step_bin": step_bin,
+        "steps": steps,
+        "per_seed": per_seed,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+
+    parser = argparse.ArgumentParser(description="Collision statistics of random fleets")
+    parser.add_argument("--seeds", type=int, default=1_000, help="number of fleets, seeds 0..N-1")
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--width", type=int, default=100)
+    parser.add_argument("--height", type=int, default=100)
+    parser.add_argument("--cars", type=int, default=500, help="cars per fleet")
+    parser.add_argument("--min-length", type=int, default=50, help="fewest commands of a car")
+    parser.add_argument("--max-length", type=int, default=50, help="most commands of a car")
+    parser.add_argument("--alphabet", default="FFFLR", help="letters commands are drawn from")
+    parser.add_argument("--step-bin", type=int, default=10, help="steps per histogram bucket")
+    parser.add_argument("--workers", type=int, help="worker processes, defaults to the CPUs")
+    parser.add_argument("--json", metavar="PATH", help="write every statistic to PATH")
+    args = parser.parse_args(argv)
+
+    try:
+        result = collision_sweep(
+            range(args.first_seed, args.first_seed + args.seeds),
+            args.width,
+            args.height,
+            args.cars,
+            args.min_length,
+            args.max_length,
+            args.alphabet,
+            args.step_bin,
+            args.workers,
+        )
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+
+    per_fleet = result["collisions_per_fleet"]
+    print(
+        f"{result['fleets']} fleets of {args.cars} cars: {result['collisions']} collisions, "
+        f"{result['collided_fraction']:.1%} of cars collided"
+    )
+    print(
+        f"collisions per fleet: mean {per_fleet['mean']:.2f} std {per_fleet['std']:.2f} "
+        f"min {per_fleet['min']} max {per_fleet['max']}"
+    )
+    for size, count in enumerate(result["pileups"]):
+        if count:
+            print(f"{size:>4} cars on a cell: {count}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(result, file)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+class OccupancyIndex:
+    def __init__(self, cars: list) -> None:
+        """
+        Index of which cars are on each grid cell, kept up to date as cars move.
+
+        Args:
+                cars: Cars to index, each car is referred to by its position in this list
+        """
+        self.cells = {}
+        for index, car in enumerate(cars):
+            self.cells.setdefault((car.x, car.y), []).append(index)
+
+    def move(self, index: int, old: tuple[int, int], new: tuple[int, int]) -> bool:
+        """
+        Moves a car from one cell to another
+
+        Args:
+                index: Index of the car that moved
+                old: Cell the car left
+                new: Cell the car entered
+
+        Returns:
+                Whether another car is on the cell the car entered
+        """
+        cells = self.cells
+        occupants = cells.pop(old)
+        if len(occupants) > 1:
+            occupants.remove(index)
+            cells[old] = occupants
+            occupants = [index]
+        # a car alone on its cell takes its list along
+        there = cells.setdefault(new, occupants)
+        if there is occupants:
+            return False
+        there.append(index)
+        return True
+
+    def occupants(self, cell: tuple[int, int]) -> list[int]:
+        """
+        Returns the indexes of the cars on a cell in the order they were added to the simulation
+
+        Args:
+                cell: (x, y) of the cell
+        """
+        occupants = self.cells.get(cell, [])
+        if len(occupants) > 1:
+            occupants.sort()
+        return occupants
+
+    def crowded(self) -> list[tuple[int, int]]:
+        """
+        Returns every cell holding more than one car
+
+        """
+        return [cell for cell, occupants in self.cells.items() if len(occupants) > 1]
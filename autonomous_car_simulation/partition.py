@@ -0,0 +1,169 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from car import DELTAS, Car, CollisionEvent
+from occupancy import OccupancyIndex
+from program import advance
+from simulation import Simulation
+
+
+def path_box(car: Car, width: int, height: int) -> tuple[int, int, int, int]:
+    """
+    Bounding box of every cell a car can be on, found by running its compiled program alone.
+    A collision only ever stops a car somewhere along this path.
+
+    Args:
+            car: Car to bound
+            width: Width of Simulation Grid
+            height: Height of Simulation Grid
+
+    Returns:
+            (min x, min y, max x, max y)
+    """
+    x, y, heading = car.x, car.y, car.heading
+    min_x = max_x = x
+    min_y = max_y = y
+
+    if car.collided:
+        return min_x, min_y, max_x, max_y
+
+    for forward, length, turn in car.program.ops:
+        if not forward:
+            heading = (heading + turn) & 3
+            continue
+        dx, dy = DELTAS[heading]
+        x = advance(x, dx, length, width)
+        y = advance(y, dy, length, height)
+        min_x, max_x = min(min_x, x), max(max_x, x)
+        min_y, max_y = min(min_y, y), max(max_y, y)
+
+    return min_x, min_y, max_x, max_y
+
+
+def interaction_components(
+    cars: list[Car], width: int, height: int
+) -> list[list[int]]:
+    """
+    Splits the fleet into groups of cars that may meet. Two cars can only meet if their path boxes
+    overlap, so the groups are the connected components of the box overlap graph.
+
+    Args:
+            cars: Cars of the simulation
+            width: Width of Simulation Grid
+            height: Height of Simulation Grid
+
+    Returns:
+            Indexes of the cars of each component, each sorted, components ordered by their first car
+    """
+    boxes = [path_box(car, width, height) for car in cars]
+    parent = list(range(len(cars)))
+
+    def find(index):
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    # Sweep the boxes by min x, comparing each one with the boxes still open at that x
+    open_boxes = []
+    for index in sorted(range(len(cars)), key=lambda i: boxes[i][0]):
+        min_x, min_y, _, max_y = boxes[index]
+        open_boxes = [other for other in open_boxes if boxes[other][2] >= min_x]
+        for other in open_boxes:
+            if boxes[other][1] <= max_y and min_y <= boxes[other][3]:
+                parent[find(other)] = find(index)
+        open_boxes.append(index)
+
+    components = {}
+    for index in range(len(cars)):
+        components.setdefault(find(index), []).append(index)
+    return list(components.values())
+
+
+def _simulate_component(simulation: Simulation, fleet_moves: bool = False) -> tuple[list, list]:
+    """
+    Runs one component in a worker process and returns its state
+
+    Args:
+            simulation: Simulation holding only the cars of the component
+            fleet_moves: Whether another part of the fleet runs step 1, which collides the cars
+                    that start on the same cell even where none of them has a command
+    """
+    simulation.simulate()
+    if fleet_moves and not any(car.command_codes for car in simulation.cars):
+        # the component never stepped on its own
+        occupancy = OccupancyIndex(simulation.cars)
+        for cell in occupancy.crowded():
+            simulation.mark_collision(occupancy.occupants(cell), cell, 1)
+    return simulation.get_state()
+
+
+def component_simulation(
+    simulation: Simulation, component: list[int], start: int = 0, stop: int | None = None
+) -> Simulation:
+    """
+    Copies the cars of one component into a simulation of their own
+
+    Args:
+            simulation: Full simulation
+            component: Indexes of the cars in the component
+            start: Index of the first command to copy, the copy's step 1 is step start + 1
+            stop: Index after the last command to copy, defaults to every command
+    """
+    cars = []
+    for index in component:
+        car = simulation.cars[index]
+        commands = car.command_codes[start:stop].decode("ascii")
+        copy = Car(car.x, car.y, car.direction, car.name, commands)
+        # cars that collided earlier only matter as obstacles
+        if car.collided:
+            copy.collide(CollisionEvent(car.collision_position, car.collision_step, [copy]))
+        cars.append(copy)
+
+    sub_simulation = Simulation(simulation.width, simulation.height)
+    sub_simulation.cars = cars
+    return sub_simulation
+
+
+def run_partitioned(simulation: Simulation, workers: int | None = None) -> None:
+    """
+    Runs every group of cars that can meet as its own simulation, in parallel, and merges the results.
+    Groups never share a cell, so the merged results are the same as one run over the whole fleet.
+
+    Args:
+            simulation: Simulation whose cars are moved
+            workers: Number of worker processes, None uses every CPU and 1 runs everything here
+    """
+    components = interaction_components(
+        simulation.cars, simulation.width, simulation.height
+    )
+    workers = workers or os.cpu_count() or 1
+    fleet_moves = any(car.command_codes for car in simulation.cars)
+
+    # a car alone in its component cannot collide, it is cheapest to run it here
+    alone = [component for component in components if len(component) == 1]
+    shared = [component for component in components if len(component) > 1]
+
+    for component in alone:
+        simulation.set_state(
+            _simulate_component(component_simulation(simulation, component)), component
+        )
+
+    if workers == 1 or len(shared) < 2:
+        states = (
+            _simulate_component(component_simulation(simulation, component), fleet_moves)
+            for component in shared
+        )
+        for component, state in zip(shared, states):
+            simulation.set_state(state, component)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        states = executor.map(
+            _simulate_component,
+            (component_simulation(simulation, component) for component in shared),
+            [fleet_moves] * len(shared),
+            chunksize=max(1, len(shared) // (4 * workers)),
+        )
+        for component, state in zip(shared, states):
+            simulation.set_state(state, component)
@@ -0,0 +1,125 @@
+import json
+import marshal
+from array import array
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Iterator
+
+# per-step counters, in the order Profiler.record_step takes them
+COUNTERS = ("moved", "checked", "collisions", "idle")
+
+
+class Profiler:
+    def __init__(self) -> None:
+        """
+        Wall time per phase and counters per step of a simulation run.
+        Set it as Simulation.profiler to turn it on, runs without one only check that it is None.
+
+        """
+        # phase -> [calls, seconds]
+        self.phases = {}
+        self.steps = array("q")
+        self.counters = {name: array("q") for name in COUNTERS}
+
+    def add_time(self, phase: str, seconds: float, calls: int = 1) -> None:
+        """
+        Adds time spent in a phase
+
+        Args:
+                phase: Name of the phase
+                seconds: Wall time
+                calls: Number of times the phase ran
+        """
+        totals = self.phases.setdefault(phase, [0, 0.0])
+        totals[0] += calls
+        totals[1] += seconds
+
+    @contextmanager
+    def phase(self, phase: str) -> Iterator[None]:
+        """
+        Times the code in a with block as a phase
+
+        Args:
+                phase: Name of the phase
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, perf_counter() - start)
+
+    def record_step(
+        self, step: int, moved: int, checked: int, collisions: int, idle: int
+    ) -> None:
+        """
+        Records the counters of one step
+
+        Args:
+                step: Step number
+                moved: Cars that ran a command, counting those in the middle of a skipped run
+                checked: Cells checked for collisions
+                collisions: Collisions found
+                idle: Cars skipped because they had finished or collided
+        """
+        self.steps.append(step)
+        for name, value in zip(COUNTERS, (moved, checked, collisions, idle)):
+            self.counters[name].append(value)
+
+    def totals(self) -> dict[str, int]:
+        """
+        Returns each counter summed over every step
+
+        """
+        return {name: sum(values) for name, values in self.counters.items()}
+
+    def to_dict(self) -> dict:
+        """
+        Returns the phases, the counter totals and the counters of every step
+
+        """
+        return {
+            "phases": {
+                phase: {"calls": calls, "seconds": seconds}
+                for phase, (calls, seconds) in self.phases.items()
+            },
+            "totals": self.totals(),
+            "steps": list(self.steps),
+            "counters": {name: list(values) for name, values in self.counters.items()},
+        }
+
+    def write_json(self, path: str) -> None:
+        """
+        Writes to_dict as JSON
+
+        Args:
+                path: File to write
+        """
+        with open(path, "w") as file:
+            json.dump(self.to_dict(), file)
+
+    def write_pstats(self, path: str) -> None:
+        """
+        Writes the phases as a profile that pstats.Stats and profile viewers can read,
+        each phase being a function of the simulation
+
+        Args:
+                path: File to write
+        """
+        stats = {
+            ("simulation.py", 0, phase): (calls, calls, seconds, seconds, {})
+            for phase, (calls, seconds) in self.phases.items()
+        }
+        with open(path, "wb") as file:
+            marshal.dump(stats, file)
+
+    def summary(self) -> str:
+        """
+        Returns the phases and counter totals as text
+
+        """
+        lines = [
+            f"{phase:14} {calls:>8} calls {seconds:10.4f}s"
+            for phase, (calls, seconds) in self.phases.items()
+        ]
+        lines += [f"{name:14} {total:>8}" for name, total in self.totals().items()]
+        return "\n".join(lines)
@@ -0,0 +1,107 @@
+import re
+from bisect import bisect_left, bisect_right
+from typing import Iterator
+
+RUNS = re.compile(rb"F+|[^F]+")
+
+
+def run_op(run: bytes) -> tuple[bool, int, int]:
+    """
+    Compiles a run of commands into one (forward, length, turn) op
+
+    Args:
+            run: Either only F commands or only rotations
+
+    Returns:
+            Whether the run moves forward, how many commands it covers and its net rotation (mod 4)
+    """
+    if run[0] == ord("F"):
+        return True, len(run), 0
+    # R turns +1, anything else turns left (-1) like Car.move
+    return False, len(run), (2 * run.count(b"R") - len(run)) % 4
+
+
+def long_runs(commands: bytes, min_length: int) -> list[tuple[int, int]]:
+    """
+    Returns the (start, end) indexes of the runs of at least min_length commands
+
+    Args:
+            commands: Commands (F, L, R) as bytes
+            min_length: Fewest commands of a run
+    """
+    pattern = rb"F{%d,}|[^F]{%d,}" % (min_length, min_length)
+    return [match.span() for match in re.finditer(pattern, commands)]
+
+
+def advance(coord: int, delta: int, count: int, size: int) -> int:
+    """
+    Returns a coordinate after count steps of delta, ignoring steps that would leave the grid
+
+    Args:
+            coord: Current coordinate
+            delta: -1, 0 or 1 per step
+            count: Number of steps
+            size: Width or height of the grid
+    """
+    if not delta or not count:
+        return coord
+    if 0 <= coord < size:
+        return min(max(coord + delta * count, 0), size - 1)
+    # a car placed outside the grid only moves if the next step brings it in
+    if 0 <= coord + delta < size:
+        return advance(coord + delta, delta, count - 1, size)
+    return coord
+
+
+def first_between(cells: list[int], start: int, end: int) -> int | None:
+    """
+    Returns the first of a sorted list of coordinates met going from start (excluded) to end (included)
+
+    Args:
+            cells: Sorted coordinates of occupied cells along one row or column
+            start: Coordinate the car leaves
+            end: Coordinate the car stops at
+    """
+    if end > start:
+        index = bisect_right(cells, start)
+        if index < len(cells) and cells[index] <= end:
+            return cells[index]
+    else:
+        index = bisect_left(cells, start) - 1
+        if index >= 0 and cells[index] >= end:
+            return cells[index]
+    return None
+
+
+class CommandProgram:
+    def __init__(self, commands: bytes) -> None:
+        """
+        Run-length compiled form of a command string.
+        Each run of F becomes one forward op and each run of rotations one net rotation.
+
+        Args:
+                commands: Commands (F, L, R) as bytes
+        """
+        self.commands = commands
+        self.starts = []
+        self.ops = []
+        for match in RUNS.finditer(commands):
+            self.starts.append(match.start())
+            self.ops.append(run_op(match.group()))
+
+    def ops_from(self, index: int) -> Iterator[tuple[bool, int, int]]:
+        """
+        Yields the ops covering the commands from index onwards, the first one cut to start at index
+
+        Args:
+                index: Index of the first command to run
+        """
+        if index >= len(self.commands):
+            return
+        op = bisect_right(self.starts, index) - 1
+        end = self.starts[op + 1] if op + 1 < len(self.starts) else len(self.commands)
+        yield run_op(self.commands[index:end])
+        yield from self.ops[op + 1 :]
+
+    def __len__(self) -> int:
+        return len(self.ops)
@@ -0,0 +1,145 @@
+import mmap
+import struct
+from typing import Iterable, Iterator
+
+from car import HEADINGS, CollisionEvent
+from simulation import MoveEvent, Simulation
+
+MAGIC = b"CARLOG01"
+# magic, number of cars, width and height of the grid
+HEADER = struct.Struct("<8sIii")
+# x, y and heading of one car
+RECORD = struct.Struct("<iiB")
+
+
+class TrajectoryRecorder:
+    def __init__(self, path: str) -> None:
+        """
+        Writes the position and direction of every car after every step to a binary file.
+
+        The file is a header followed by one frame per step, frame 0 being the starting positions.
+        It ends at the last step any car ran a command, every car stays where it is after that.
+        A frame holds one fixed-width record per car, in the order the cars were added, so the
+        record of any car at any step is at a known offset.
+
+        Args:
+                path: File to write, replaced if it exists
+        """
+        self.path = path
+
+    def record(
+        self, simulation: Simulation, events: Iterable[CollisionEvent | MoveEvent]
+    ) -> Iterator[CollisionEvent | MoveEvent]:
+        """
+        Passes events through while writing the frames they describe
+
+        Args:
+                simulation: Simulation the events come from, read for the starting positions
+                events: Event stream from Simulation.iter_events with moves=True
+        """
+        cars = simulation.cars
+        frame = bytearray(RECORD.size * len(cars))
+        for index, car in enumerate(cars):
+            RECORD.pack_into(frame, index * RECORD.size, car.x, car.y, car.heading)
+
+        with open(self.path, "wb") as file:
+            file.write(HEADER.pack(MAGIC, len(cars), simulation.width, simulation.height))
+            step = 0
+            for event in events:
+                if isinstance(event, MoveEvent):
+                    # a frame is complete once the next step starts
+                    if event.step != step:
+                        file.write(frame)
+                        step = event.step
+                    RECORD.pack_into(
+                        frame, event.index * RECORD.size, event.x, event.y, event.heading
+                    )
+                yield event
+            file.write(frame)
+
+
+class TrajectoryLog:
+    def __init__(self, path: str) -> None:
+        """
+        Memory-mapped reader of a file written by TrajectoryRecorder. Any frame or record is read
+        straight from the mapping at a computed offset, without reading the frames before it.
+
+        Args:
+                path: File to read
+        """
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+        magic, self.car_count, self.width, self.height = HEADER.unpack_from(self._view)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a trajectory log")
+
+        self.frame_size = RECORD.size * self.car_count
+        frames = (len(self._view) - HEADER.size) // self.frame_size if self.car_count else 1
+        # frame 0 is the start, so the last frame is the last step
+        self.steps = frames - 1
+
+    def _offset(self, step: int) -> int:
+        """
+        Offset of the first record of a step
+
+        Args:
+                step: Step number, 0 being the starting positions
+        """
+        if not 0 <= step <= self.steps:
+            raise IndexError(f"Step {step} is not in the log, which has steps 0 to {self.steps}")
+        return HEADER.size + step * self.frame_size
+
+    def position(self, car: int, step: int) -> tuple[int, int, str]:
+        """
+        Returns where a car was after a step
+
+        Args:
+                car: Index of the car, in the order the cars were added
+                step: Step number, 0 being the starting positions
+
+        Returns:
+                (x, y, direction)
+        """
+        if not 0 <= car < self.car_count:
+            raise IndexError(f"Car {car} is not in the log, which has {self.car_count} cars")
+        x, y, heading = RECORD.unpack_from(self._view, self._offset(step) + car * RECORD.size)
+        return x, y, HEADINGS[heading]
+
+    def frame_bytes(self, step: int) -> memoryview:
+        """
+        Returns the raw records of every car after a step, as a view into the file
+
+        Args:
+                step: Step number, 0 being the starting positions
+        """
+        offset = self._offset(step)
+        return self._view[offset : offset + self.frame_size]
+
+    def frame(self, step: int) -> list[tuple[int, int, str]]:
+        """
+        Returns (x, y, direction) of every car after a step
+
+        Args:
+                step: Step number, 0 being the starting positions
+        """
+        return [
+            (x, y, HEADINGS[heading])
+            for x, y, heading in RECORD.iter_unpack(self.frame_bytes(step))
+        ]
+
+    def close(self) -> None:
+        """
+        Releases the mapping, views returned by frame_bytes must be released first
+
+        """
+        self._view.release()
+        self._map.close()
+
+    def __enter__(self) -> "TrajectoryLog":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
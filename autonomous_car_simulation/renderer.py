@@ -0,0 +1,171 @@
+import shutil
+import sys
+from time import perf_counter
+from typing import Callable, TextIO
+
+# a lone car by heading, N E S W
+GLYPHS = "^>v<"
+# several cars on one cell, which means they collided
+PILE = "X"
+EMPTY = "."
+# outside the grid
+OFF_GRID = " "
+
+
+class ViewportRenderer:
+    def __init__(
+        self,
+        output: TextIO | None = None,
+        x: int = 0,
+        y: int = 0,
+        columns: int | None = None,
+        rows: int | None = None,
+        fps: float = 20.0,
+        clock: Callable[[], float] = perf_counter,
+    ) -> None:
+        """
+        Live view of a window of the field in an ANSI terminal while a simulation runs.
+
+        Set it as Simulation.renderer before a run. The loop engine offers it every step, but a frame
+        is only drawn once the last one is 1/fps seconds old, so steps in between cost one clock
+        read. A frame looks up only the cells inside the viewport and rewrites only the characters
+        that changed since the last frame. The other engines draw the final frame once they are done.
+
+        Args:
+                output: Terminal to draw on, defaults to standard output
+                x: x-coordinate of the left column of the viewport
+                y: y-coordinate of the bottom row of the viewport
+                columns: Width of the viewport in cells, defaults to the terminal width
+                rows: Height of the viewport in cells, defaults to the terminal height less two lines
+                fps: Most frames drawn per second, 0 draws every step
+                clock: Time source in seconds
+        """
+        size = shutil.get_terminal_size()
+        self.output = sys.stdout if output is None else output
+        self.x = x
+        self.y = y
+        self.columns = columns or size.columns
+        self.rows = rows or max(1, size.lines - 2)
+        self.interval = 1 / fps if fps else 0.0
+        self.clock = clock
+        self.next_frame = float("-inf")
+        # rows of characters on the terminal, top row first, None before the first frame
+        self.screen = None
+        self.frames = 0
+
+    def scroll(self, dx: int, dy: int) -> None:
+        """
+        Moves the viewport, the next frame redraws what changed on screen
+
+        Args:
+                dx: Cells to move right
+                dy: Cells to move up
+        """
+        self.x += dx
+        self.y += dy
+
+    def step_done(self, simulation, step: int, cells: dict) -> None:
+        """
+        Draws a frame if one is due
+
+        Args:
+                simulation: Simulation being run
+                step: Number of steps done
+                cells: (x, y) -> indexes of the cars on the cell
+        """
+        now = self.clock()
+        if now < self.next_frame:
+            return
+        self.next_frame = now + self.interval
+        self.draw(simulation, step, cells)
+
+    def finish(self, simulation, step: int, cells: dict) -> None:
+        """
+        Draws the final frame and leaves the cursor below the viewport
+
+        Args:
+                simulation: Simulation that was run
+                step: Number of steps done
+                cells: (x, y) -> indexes of the cars on the cell
+        """
+        self.draw(simulation, step, cells)
+        self.output.write(f"\x1b[{self.rows + 2};1H")
+        self.output.flush()
+
+    def frame(self, simulation, cells: dict) -> list[list[str]]:
+        """
+        Returns the characters of the viewport, top row first
+
+        Args:
+                simulation: Simulation being run
+                cells: (x, y) -> indexes of the cars on the cell
+        """
+        left, right = self.x, self.x + self.columns
+        bottom, top = self.y, self.y + self.rows
+        # the part of each row that lies on the grid
+        start = min(max(0, -left), self.columns)
+        stop = max(start, min(self.columns, simulation.width - left))
+        on_grid = [OFF_GRID] * start + [EMPTY] * (stop - start) + [OFF_GRID] * (self.columns - stop)
+        rows = [
+            on_grid[:] if 0 <= row_y < simulation.height else [OFF_GRID] * self.columns
+            for row_y in range(top - 1, bottom - 1, -1)
+        ]
+
+        cars = simulation.cars
+        if len(cells) < self.columns * self.rows:
+            occupied = (
+                (cell, occupants)
+                for cell, occupants in cells.items()
+                if left <= cell[0] < right and bottom <= cell[1] < top
+            )
+        else:
+            occupied = (
+                ((cell_x, cell_y), cells[cell_x, cell_y])
+                for cell_y in range(max(bottom, 0), min(top, simulation.height))
+                for cell_x in range(max(left, 0), min(right, simulation.width))
+                if (cell_x, cell_y) in cells
+            )
+        for (cell_x, cell_y), occupants in occupied:
+            glyph = GLYPHS[cars[occupants[0]].heading] if len(occupants) == 1 else PILE
+            rows[top - 1 - cell_y][cell_x - left] = glyph
+        return rows
+
+    def draw(self, simulation, step: int, cells: dict) -> None:
+        """
+        Writes the changes since the last frame in one write
+
+        Args:
+                simulation: Simulation being run
+                step: Number of steps done
+                cells: (x, y) -> indexes of the cars on the cell
+        """
+        rows = self.frame(simulation, cells)
+        previous = self.screen
+        parts = []
+        if previous is None:
+            parts.append("\x1b[2J")
+
+        for number, row in enumerate(rows):
+            old = previous[number] if previous is not None else None
+            if row == old:
+                continue
+            column = 0
+            while column < self.columns:
+                if old is not None and row[column] == old[column]:
+                    column += 1
+                    continue
+                # one cursor move for each run of changed characters
+                first = column
+                while column < self.columns and (old is None or row[column] != old[column]):
+                    column += 1
+                parts.append(f"\x1b[{number + 2};{first + 1}H{''.join(row[first:column])}")
+
+        status = (
+            f"step {step}  cells ({self.x},{self.y})-"
+            f"({self.x + self.columns - 1},{self.y + self.rows - 1})  {len(simulation.cars)} cars"
+        )
+        parts.append(f"\x1b[1;1H{status}\x1b[K")
+        self.output.write("".join(parts))
+        self.output.flush()
+        self.screen = rows
+        self.frames += 1
@@ -0,0 +1,113 @@
+import csv
+import io
+import json
+import sys
+from typing import TextIO
+
+from car import Car
+
+FORMATS = ("text", "csv", "jsonl")
+CSV_FIELDS = ("name", "x", "y", "direction", "collided_with", "collision_step")
+
+
+def _text_lines(cars: list[Car], buffer: io.StringIO) -> None:
+    """
+    Writes the report the CLI has always printed
+
+    Args:
+            cars: Cars to write
+            buffer: Buffer the lines are written to
+    """
+    write = buffer.write
+    for car in cars:
+        if car.collided:
+            write(f"- {car.name}, {car.collision.describe(car)}\n")
+        else:
+            write(f"- {car.name}, ({car.x},{car.y}) {car.direction}\n")
+
+
+def _csv_lines(cars: list[Car], buffer: io.StringIO) -> None:
+    """
+    Writes one CSV row per car, the other cars of a collision separated by ;
+
+    Args:
+            cars: Cars to write
+            buffer: Buffer the rows are written to
+    """
+    writer = csv.writer(buffer, lineterminator="\n")
+    for car in cars:
+        writer.writerow(
+            (
+                car.name,
+                car.x,
+                car.y,
+                car.direction,
+                ";".join(car.collided_with),
+                car.collision_step or "",
+            )
+        )
+
+
+def _jsonl_lines(cars: list[Car], buffer: io.StringIO) -> None:
+    """
+    Writes one JSON object per car, with the fields of CarResult
+
+    Args:
+            cars: Cars to write
+            buffer: Buffer the objects are written to
+    """
+    write = buffer.write
+    dumps = json.dumps
+    for car in cars:
+        record = {
+            "name": car.name,
+            "x": car.x,
+            "y": car.y,
+            "direction": car.direction,
+            "collided_with": car.collided_with,
+            "collision_step": car.collision_step,
+        }
+        write(dumps(record))
+        write("\n")
+
+
+WRITERS = {"text": _text_lines, "csv": _csv_lines, "jsonl": _jsonl_lines}
+
+
+def write_report(
+    cars: list[Car],
+    output: TextIO | None = None,
+    report_format: str = "text",
+    chunk_size: int = 10_000,
+) -> None:
+    """
+    Writes the result of every car, formatting a chunk of cars in memory at a time
+    so the output gets a few large writes instead of one per car.
+
+    Args:
+            cars: Cars of a finished simulation
+            output: File to write to, defaults to standard output
+            report_format: One of FORMATS, text is the report the CLI prints
+            chunk_size: Number of cars formatted per write
+    """
+    if report_format not in WRITERS:
+        raise ValueError(f"Unknown report format {report_format!r}. Please choose from {FORMATS}")
+    output = sys.stdout if output is None else output
+    write_lines = WRITERS[report_format]
+
+    buffer = io.StringIO()
+    if report_format == "text":
+        buffer.write("After simulation, the result is:\n")
+    elif report_format == "csv":
+        buffer.write(",".join(CSV_FIELDS) + "\n")
+
+    for start in range(0, len(cars), chunk_size):
+        write_lines(cars[start : start + chunk_size], buffer)
+        output.write(buffer.getvalue())
+        buffer.seek(0)
+        buffer.truncate()
+
+    # the header of a report without cars
+    if buffer.tell():
+        output.write(buffer.getvalue())
+    output.flush()
@@ -0,0 +1,383 @@
+import argparse
+import asyncio
+import ipaddress
+import json
+import os
+import socket
+import statistics
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from batch import run_scenario
+from simulation import Simulation
+
+# longest request line, a scenario is sent as one line
+LINE_LIMIT = 64 * 2**20
+
+
+def _run_request(scenario: str, engine: str) -> list[dict]:
+    """
+    Runs one scenario in a worker process
+
+    Args:
+            scenario: Scenario text in the format read by parse_scenario
+            engine: Stepping engine to use
+
+    Returns:
+            Results of every car, as dicts ready for JSON
+    """
+    return [result._asdict() for result in run_scenario(scenario, engine)]
+
+
+def _warm_up() -> None:
+    """
+    Runs a tiny scenario so a worker has imported everything before the first request
+
+    """
+    run_scenario("1 1\nA 0 0 N F")
+
+
+def check_local(host: str) -> None:
+    """
+    Raises ValueError unless host is a loopback address, the service is not meant to be reachable
+
+    Args:
+            host: Host name or address to listen on
+    """
+    if host == "localhost":
+        return
+    try:
+        if ipaddress.ip_address(host).is_loopback:
+            return
+    except ValueError:
+        pass
+    raise ValueError(f"The service only listens on localhost, not {host}")
+
+
+class SimulationService:
+    def __init__(
+        self, workers: int | None = None, max_pending: int = 64, latency_window: int = 10_000
+    ) -> None:
+        """
+        Long-lived simulation server for local clients.
+
+        Clients send one JSON request per line and get one JSON response per line back:
+        {"id": any, "scenario": text, "engine": "loop"} answers {"id", "results"} or {"id", "error"},
+        {"id": any, "stats": true} answers {"id", "stats"}. A client may send many requests without
+        waiting, responses come back as soon as each is done and carry the id of their request.
+        At most max_pending scenarios are queued or running at a time, after that the service stops
+        reading requests until one finishes, which pushes back on clients through the socket.
+
+        Args:
+                workers: Number of worker processes, defaults to the number of CPUs
+                max_pending: Number of scenarios accepted before reading more requests waits
+                latency_window: Number of recent requests the latency percentiles are taken over
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.pending = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.pool_restarts = 0
+        self.latencies = deque(maxlen=latency_window)
+        self.executor = None
+        self.server = None
+        self._slots = None
+        # tasks serving the open connections
+        self._connections = set()
+
+    async def start(
+        self, host: str = "127.0.0.1", port: int = 0, path: str | None = None
+    ) -> asyncio.AbstractServer:
+        """
+        Starts the worker pool and listens on a local TCP port or a Unix socket
+
+        Args:
+                host: Loopback address to listen on
+                port: TCP port, 0 picks a free one
+                path: Unix socket path, used instead of host and port
+        """
+        if path is None:
+            check_local(host)
+        self._slots = asyncio.Semaphore(self.max_pending)
+        await self._start_pool()
+
+        if path is None:
+            self.server = await asyncio.start_server(self._handle, host, port, limit=LINE_LIMIT)
+        else:
+            self.server = await asyncio.start_unix_server(self._handle, path, limit=LINE_LIMIT)
+        return self.server
+
+    async def _start_pool(self) -> None:
+        """
+        Starts a new worker pool and waits until every worker has warmed up
+
+        """
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        # start every worker now so the first requests do not pay for it
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(loop.run_in_executor(self.executor, _warm_up) for _ in range(self.workers))
+        )
+
+    @property
+    def address(self):
+        """
+        Address the service listens on, (host, port) or the Unix socket path
+
+        """
+        return self.server.sockets[0].getsockname()
+
+    async def close(self) -> None:
+        """
+        Stops listening and shuts the worker pool down
+
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        # connections outlive the server, the ones still open are dropped
+        for connection in self._connections:
+            connection.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def stats(self) -> dict:
+        """
+        Returns the queue depth (scenarios queued or running), request counts and latencies in ms
+
+        """
+        stats = {
+            "pending": self.pending,
+            "peak_pending": self.peak_pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "workers": self.workers,
+            "pool_restarts": self.pool_restarts,
+        }
+        latencies = sorted(self.latencies)
+        if len(latencies) > 1:
+            cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+            for percentile in (50, 90, 99):
+                stats[f"p{percentile}_ms"] = cuts[percentile - 1] * 1000
+        elif latencies:
+            for percentile in (50, 90, 99):
+                stats[f"p{percentile}_ms"] = latencies[0] * 1000
+        return stats
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Serves one connection, reading its requests as slots free up
+
+        Args:
+                reader: Incoming requests
+                writer: Outgoing responses
+        """
+        lock = asyncio.Lock()
+        tasks = set()
+        self._connections.add(asyncio.current_task())
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    line = b""
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+
+                # an idle connection holds no slot, a request waits for one before the next is read,
+                # so with no free slot the client's writes back up
+                await self._slots.acquire()
+                task = asyncio.create_task(self._serve(line, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            self._connections.discard(asyncio.current_task())
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _serve(self, line: bytes, writer: asyncio.StreamWriter, lock: asyncio.Lock) -> None:
+        """
+        Answers one request, the slot it holds is released once the response is written
+
+        Args:
+                line: Request as a JSON line
+                writer: Outgoing responses of the connection
+                lock: Keeps the responses of the connection from interleaving
+        """
+        started = time.perf_counter()
+        request_id = None
+        try:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("A request must be a JSON object")
+                request_id = request.get("id")
+                if request.get("stats"):
+                    response = {"id": request_id, "stats": self.stats()}
+                else:
+                    response = {"id": request_id, "results": await self._run(request)}
+                    self.completed += 1
+                    self.latencies.append(time.perf_counter() - started)
+            except Exception as error:
+                # a bad request or a worker that failed, either way the client gets an answer
+                self.failed += 1
+                response = {"id": request_id, "error": str(error)}
+
+            async with lock:
+                writer.write(json.dumps(response).encode() + b"\n")
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    pass
+        finally:
+            self._slots.release()
+
+    async def _run(self, request: dict) -> list[dict]:
+        """
+        Runs the scenario of a request on the worker pool
+
+        Args:
+                request: Decoded request with a scenario and an optional engine
+        """
+        scenario = request.get("scenario")
+        if not isinstance(scenario, str):
+            raise ValueError(
+                'Please send the scenario text as "scenario", or "stats": true for the statistics'
+            )
+        engine = request.get("engine", "loop")
+        if engine not in Simulation.ENGINES:
+            raise ValueError(f"Unknown engine {engine!r}. Please choose from {Simulation.ENGINES}")
+
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        loop = asyncio.get_running_loop()
+        try:
+            executor = self.executor
+            try:
+                return await loop.run_in_executor(executor, _run_request, scenario, engine)
+            except BrokenProcessPool:
+                # a worker died and took the pool with it, the first request to notice replaces it
+                if self.executor is executor:
+                    self.pool_restarts += 1
+                    executor.shutdown(wait=False)
+                    await self._start_pool()
+                return await loop.run_in_executor(self.executor, _run_request, scenario, engine)
+        finally:
+            self.pending -= 1
+
+
+class ServiceClient:
+    def __init__(
+        self, host: str = "127.0.0.1", port: int | None = None, path: str | None = None
+    ) -> None:
+        """
+        Blocking client for a SimulationService, one request at a time
+
+        Args:
+                host: Address of the service
+                port: TCP port of the service
+                path: Unix socket path of the service, used instead of host and port
+        """
+        if path is not None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(path)
+        else:
+            self.socket = socket.create_connection((host, port))
+        self.file = self.socket.makefile("rwb")
+        self._next_id = 0
+
+    def _request(self, request: dict) -> dict:
+        """
+        Sends one request and waits for its response
+
+        Args:
+                request: Request without its id
+        """
+        self._next_id += 1
+        self.file.write(json.dumps({"id": self._next_id, **request}).encode() + b"\n")
+        self.file.flush()
+        response = json.loads(self.file.readline())
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response
+
+    def run(self, scenario: str, engine: str = "loop") -> list[dict]:
+        """
+        Runs a scenario on the service and returns the result of every car
+
+        Args:
+                scenario: Scenario text in the format read by parse_scenario
+                engine: Stepping engine to use, one of Simulation.ENGINES
+        """
+        return self._request({"scenario": scenario, "engine": engine})["results"]
+
+    def stats(self) -> dict:
+        """
+        Returns the queue depth, request counts and latency percentiles of the service
+
+        """
+        return self._request({"stats": True})["stats"]
+
+    def close(self) -> None:
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self) -> "ServiceClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+async def serve(args: argparse.Namespace) -> None:
+    """
+    Runs the service until it is interrupted
+
+    Args:
+            args: Parsed command line
+    """
+    service = SimulationService(args.workers, args.max_pending)
+    await service.start(args.host, args.port, args.unix)
+    print(f"Serving on {service.address}", flush=True)
+    try:
+        await service.server.serve_forever()
+    finally:
+        await service.close()
+
+
+def main(argv: list[str] | None = None) -> int:
+
+    parser = argparse.ArgumentParser(description="Local car simulation service")
+    parser.add_argument("--host", default="127.0.0.1", help="loopback address to listen on")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead")
+    parser.add_argument("--workers", type=int, help="worker processes, defaults to the CPUs")
+    parser.add_argument("--max-pending", type=int, default=64, help="scenarios accepted at a time")
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args))
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
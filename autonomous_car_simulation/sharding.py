@@ -0,0 +1,119 @@
+import math
+import os
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+from occupancy import OccupancyIndex
+from partition import _simulate_component, component_simulation
+from simulation import Simulation
+
+
+def tile_edges(size: int, tiles: int) -> list[int]:
+    """
+    First coordinate of each tile along one axis, followed by size
+
+    Args:
+            size: Width or height of the grid
+            tiles: Number of tiles along the axis
+    """
+    tiles = max(1, min(tiles, size))
+    return [size * tile // tiles for tile in range(tiles + 1)]
+
+
+def default_tiles(workers: int) -> tuple[int, int]:
+    """
+    Splits a number of workers into a near-square grid of tiles
+
+    Args:
+            workers: Number of worker processes
+    """
+    columns = max(1, math.isqrt(workers))
+    return columns, max(1, workers // columns)
+
+
+def run_sharded(
+    simulation: Simulation,
+    workers: int | None = None,
+    tiles: tuple[int, int] | None = None,
+    halo: int = 32,
+) -> None:
+    """
+    Runs the simulation with the field cut into rectangular tiles, each stepped by a worker process.
+
+    The run goes in windows of halo steps. A car can only affect cells within halo cells of where it
+    starts a window, so each worker gets the cars on its tile plus the cars within halo cells of it
+    (the halo) and steps all of them for the window. Only the cars that end the window on the
+    worker's own tile are taken back, which hands off every car that crossed a tile edge. Cars that
+    collide stay on their cell, so a collision on a tile edge is always resolved by one worker and
+    matches the single-process step loop.
+
+    Args:
+            simulation: Simulation whose cars are moved
+            workers: Number of worker processes, None uses every CPU
+            tiles: Number of tiles across and up, defaults to about one tile per worker
+            halo: Width of the halo in cells, which is also the number of steps per window
+    """
+    workers = workers or os.cpu_count() or 1
+    columns, rows = tiles or default_tiles(workers)
+    x_edges = tile_edges(simulation.width, columns)
+    y_edges = tile_edges(simulation.height, rows)
+    columns, rows = len(x_edges) - 1, len(y_edges) - 1
+
+    cars = simulation.cars
+    lengths = [len(car.command_codes) for car in cars]
+    max_moves = max(lengths)
+
+    def tile_of(x, y):
+        # cars placed outside the grid belong to the nearest tile
+        column = min(max(bisect_right(x_edges, x) - 1, 0), columns - 1)
+        row = min(max(bisect_right(y_edges, y) - 1, 0), rows - 1)
+        return column, row
+
+    def tiles_within(low, high, edges, count):
+        # tiles along one axis that have a cell between low and high
+        first = min(max(bisect_right(edges, low) - 1, 0), count - 1)
+        last = min(max(bisect_left(edges, high + 1) - 1, 0), count - 1)
+        return range(first, last + 1)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        step = 0
+        while step < max_moves:
+            stop = min(step + halo, max_moves)
+
+            # every tile gets its own cars and the cars within halo cells of it
+            members = {}
+            busy = set()
+            for index, car in enumerate(cars):
+                active = not car.collided and lengths[index] > step
+                for column in tiles_within(car.x - halo, car.x + halo, x_edges, columns):
+                    for row in tiles_within(car.y - halo, car.y + halo, y_edges, rows):
+                        members.setdefault((column, row), []).append(index)
+                        if active:
+                            busy.add((column, row))
+
+            if step == 0:
+                # cars that start on the same cell collide at step 1, even where nothing moves
+                busy.update(tile_of(*cell) for cell in OccupancyIndex(cars).crowded())
+
+            if not busy:
+                break
+
+            # nothing changes on a tile that no moving car can reach
+            jobs = [(tile, members[tile]) for tile in sorted(busy)]
+            states = executor.map(
+                _simulate_component,
+                (
+                    component_simulation(simulation, indexes, step, stop)
+                    for _, indexes in jobs
+                ),
+                [step == 0] * len(jobs),
+            )
+
+            for (tile, indexes), state in zip(jobs, states):
+                owned = [
+                    index if tile_of(x, y) == tile else None
+                    for index, (x, y, _, _) in zip(indexes, state[0])
+                ]
+                simulation.set_state(state, owned, step_offset=step)
+
+            step = stop
@@ -0,0 +1,264 @@
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Iterable, NamedTuple
+
+from car import Car
+
+# Layout of the block:
+#   header     magic, sequence, step, number of cars n, width, height, done, little-endian
+#   x          int32 * n at X_OFFSET
+#   y          int32 * n after x
+#   heading    uint8 * n after y, index into car.HEADINGS
+#   collided   uint8 * n after heading, 1 once the car has collided
+# x and y are in the machine's own byte order, memoryview casts only take native formats and only
+# processes on the same machine can map the block.
+# The sequence is odd while the writer is changing the block and even once it is consistent.
+MAGIC = b"CARSHM01"
+HEADER = struct.Struct("<8sQqIiiI")
+SEQUENCE = struct.Struct("<Q")
+STEP = struct.Struct("<q")
+SEQUENCE_OFFSET = 8
+STEP_OFFSET = 16
+DONE_OFFSET = 36
+X_OFFSET = HEADER.size
+# one attach at a time may stand in for the resource tracker's register
+_attach_lock = threading.Lock()
+
+
+def block_size(car_count: int) -> int:
+    """
+    Returns the size of the shared block of a fleet
+
+    Args:
+            car_count: Number of cars
+    """
+    return X_OFFSET + 10 * car_count
+
+
+def _views(buffer: memoryview, car_count: int) -> tuple[memoryview, ...]:
+    """
+    Splits the arrays of a block into typed views of the same memory
+
+    Args:
+            buffer: Whole block
+            car_count: Number of cars
+    """
+    y_offset = X_OFFSET + 4 * car_count
+    heading_offset = y_offset + 4 * car_count
+    collided_offset = heading_offset + car_count
+    return (
+        buffer[X_OFFSET:y_offset].cast("i"),
+        buffer[y_offset:heading_offset].cast("i"),
+        buffer[heading_offset:collided_offset],
+        buffer[collided_offset : collided_offset + car_count],
+    )
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """
+    Maps an existing block without tracking it, the writer owns it and decides when it goes
+
+    Args:
+            name: Name of the block
+    """
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+    # Before Python 3.13 an attached block is tracked, and removed once this process exits.
+    # Only the registration of this block is dropped, everything else is passed on.
+    with _attach_lock:
+        register = resource_tracker.register
+
+        def register_others(resource: str, rtype: str) -> None:
+            if resource.lstrip("/") != name.lstrip("/"):
+                register(resource, rtype)
+
+        resource_tracker.register = register_others
+        try:
+            return shared_memory.SharedMemory(name)
+        finally:
+            resource_tracker.register = register
+
+
+class FleetSnapshot(NamedTuple):
+    step: int
+    done: bool
+    x: list[int]
+    y: list[int]
+    heading: bytes
+    collided: bytes
+
+
+class SharedFleetState:
+    def __init__(self, cars: list[Car], width: int, height: int, name: str | None = None) -> None:
+        """
+        Fleet state of a running simulation in a shared memory block that other processes can map.
+
+        Set it as Simulation.shared_state before a run. The loop engine then publishes the cars that
+        changed after every step, the other engines publish the whole fleet once they are done.
+        Publishing never waits for readers: it bumps the sequence to odd, writes, and bumps it back
+        to even, and a FleetObserver retries any read that saw the sequence move.
+
+        Args:
+                cars: Cars of the simulation, their count fixes the size of the block
+                width: Width of Simulation Grid
+                height: Height of Simulation Grid
+                name: Name of the block, a random one by default
+        """
+        self.car_count = len(cars)
+        self.memory = shared_memory.SharedMemory(name, create=True, size=block_size(len(cars)))
+        self.buffer = self.memory.buf
+        HEADER.pack_into(self.buffer, 0, MAGIC, 0, 0, len(cars), width, height, 0)
+        self.x, self.y, self.heading, self.collided = _views(self.buffer, len(cars))
+        self.sequence = 0
+        self.publish(cars, range(len(cars)), 0)
+
+    @property
+    def name(self) -> str:
+        """
+        Name observers attach to
+
+        """
+        return self.memory.name
+
+    def publish(self, cars: list[Car], indices: Iterable[int], step: int) -> None:
+        """
+        Writes the state of some cars and the current step
+
+        Args:
+                cars: Cars of the simulation
+                indices: Cars that may have changed since the last publish
+                step: Number of steps done
+        """
+        buffer = self.buffer
+        self.sequence += 1
+        SEQUENCE.pack_into(buffer, SEQUENCE_OFFSET, self.sequence)
+
+        x, y, heading, collided = self.x, self.y, self.heading, self.collided
+        for index in indices:
+            car = cars[index]
+            x[index] = car.x
+            y[index] = car.y
+            heading[index] = car.heading
+            collided[index] = car.collision is not None
+        STEP.pack_into(buffer, STEP_OFFSET, step)
+
+        self.sequence += 1
+        SEQUENCE.pack_into(buffer, SEQUENCE_OFFSET, self.sequence)
+
+    def finish(self) -> None:
+        """
+        Marks the run as done, the state does not change after this
+
+        """
+        self.sequence += 1
+        SEQUENCE.pack_into(self.buffer, SEQUENCE_OFFSET, self.sequence)
+        self.buffer[DONE_OFFSET] = 1
+        self.sequence += 1
+        SEQUENCE.pack_into(self.buffer, SEQUENCE_OFFSET, self.sequence)
+
+    def close(self, unlink: bool = True) -> None:
+        """
+        Releases the block, removing it unless unlink is False
+
+        Args:
+                unlink: Remove the block, attached observers keep their mapping until they close
+        """
+        # the views must go before the mapping can be closed
+        self.x = self.y = self.heading = self.collided = self.buffer = None
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+    def __enter__(self) -> "SharedFleetState":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class FleetObserver:
+    def __init__(self, name: str) -> None:
+        """
+        Read-only view of a SharedFleetState from any process, without copying the block.
+
+        The x, y, heading and collided arrays read straight from shared memory and may be mid-update,
+        snapshot() returns a consistent copy.
+
+        Args:
+                name: Name of the block, SharedFleetState.name
+        """
+        self.memory = _attach(name)
+        self.buffer = self.memory.buf.toreadonly()
+
+        magic, _, _, self.car_count, self.width, self.height, _ = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{name} is not a shared fleet state")
+        self.x, self.y, self.heading, self.collided = _views(self.buffer, self.car_count)
+
+    @property
+    def sequence(self) -> int:
+        """
+        Number of changes started so far, odd while one is being written
+
+        """
+        return SEQUENCE.unpack_from(self.buffer, SEQUENCE_OFFSET)[0]
+
+    @property
+    def step(self) -> int:
+        """
+        Number of steps done, as of the last publish
+
+        """
+        return STEP.unpack_from(self.buffer, STEP_OFFSET)[0]
+
+    @property
+    def done(self) -> bool:
+        """
+        Whether the run has finished
+
+        """
+        return bool(self.buffer[DONE_OFFSET])
+
+    def snapshot(self, retries: int = 10_000) -> FleetSnapshot:
+        """
+        Copies the whole fleet state as of one publish
+
+        Args:
+                retries: Reads to try before giving up on a writer that never stops changing it
+        """
+        for _ in range(retries):
+            before = self.sequence
+            if before & 1:
+                # the writer is in the middle of a publish
+                time.sleep(0)
+                continue
+            snapshot = FleetSnapshot(
+                self.step,
+                self.done,
+                self.x.tolist(),
+                self.y.tolist(),
+                self.heading.tobytes(),
+                self.collided.tobytes(),
+            )
+            if self.sequence == before:
+                return snapshot
+        raise RuntimeError(f"The fleet state changed during {retries} reads in a row")
+
+    def close(self) -> None:
+        """
+        Unmaps the block, it stays available to the writer and other observers
+
+        """
+        self.x = self.y = self.heading = self.collided = self.buffer = None
+        self.memory.close()
+
+    def __enter__(self) -> "FleetObserver":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -1,7 +1,67 @@
-from car import Car
+from bisect import bisect_right
+from heapq import heappop, heappush
+from time import perf_counter
+from typing import TYPE_CHECKING, Iterator, NamedTuple, TextIO
+
+from car import DELTAS, HEADINGS, Car, CollisionEvent
+from checkpoint import load_checkpoint
+from occupancy import OccupancyIndex
+from program import advance, first_between, long_runs
+from report import FORMATS, write_report
+from trajectory import run_trajectories
+
+if TYPE_CHECKING:
+    # only named in annotations, recorder imports this module
+    from checkpoint import Checkpointer
+    from profiling import Profiler
+    from recorder import TrajectoryRecorder
+    from renderer import ViewportRenderer
+    from sharedstate import SharedFleetState
+
+# shortest run of one command worth checking whether the other cars can reach it
+MIN_SKIPPED_RUN = 32
+
+
+class CarResult(NamedTuple):
+    """
+    Final state of a car after a simulation. A collided car stays on the cell it collided at.
+    """
+
+    name: str
+    x: int
+    y: int
+    direction: str
+    collided_with: tuple[str, ...]
+    collision_step: int | None
+
+    @property
+    def collided(self) -> bool:
+        return self.collision_step is not None
+
+
+class MoveEvent(NamedTuple):
+    """
+    State of a car after it ran one of its commands
+    """
+
+    step: int
+    index: int
+    x: int
+    y: int
+    heading: int
+
+    @property
+    def direction(self) -> str:
+        return HEADINGS[self.heading]
 
 
 class Simulation:
+
+    ENGINES = ("loop", "numpy", "trajectory", "partitioned", "sharded")
+
+    NAME_TAKEN = "A car with that name already exists"
+    CELL_TAKEN = "The location ({x},{y}) is already occupied by another car."
+
     def __init__(self, width: int, height: int) -> None:
         """
         Simulation will have a grid object, and contain one or more cars
@@ -9,6 +69,57 @@ class Simulation:
         self.width = width
         self.height = height
         self.cars = []
+        # set to a Profiler to time the phases of each run and count what every step does
+        self.profiler: "Profiler | None" = None
+        # set to a SharedFleetState to publish the fleet to other processes while it runs
+        self.shared_state: "SharedFleetState | None" = None
+        # set to a ViewportRenderer to watch the run in the terminal
+        self.renderer: "ViewportRenderer | None" = None
+
+    @property
+    def cars(self) -> list[Car]:
+        """
+        Cars in the order they were added
+
+        """
+        return self._cars
+
+    @cars.setter
+    def cars(self, cars: list[Car]) -> None:
+        self._cars = cars
+        # names and starting cells of the cars, for O(1) checks when adding cars
+        self._names = set()
+        self._cells = set()
+        self._indexed = 0
+        # box around the cars up to _bounded, extended when asked for
+        self._bounds = None
+        self._bounded = 0
+
+    def _sync_indexes(self) -> None:
+        """
+        Indexes cars appended to self.cars directly since the last check
+
+        """
+        if self._indexed > len(self._cars):
+            self.cars = self._cars
+
+        for car in self._cars[self._indexed :]:
+            self._names.add(car.name)
+            self._cells.add((car.x, car.y))
+        self._indexed = len(self._cars)
+
+    def _append(self, car: Car) -> None:
+        """
+        Adds a checked car to the simulation and its indexes
+
+        Args:
+                car: Car to add
+        """
+        self._sync_indexes()
+        self._cars.append(car)
+        self._names.add(car.name)
+        self._cells.add((car.x, car.y))
+        self._indexed += 1
 
     def add_car(self) -> None:
         """
@@ -21,14 +132,10 @@ class Simulation:
             print("Please enter the name of the car:")
             car_name = input().strip()
 
-            # check for duplicates
-            if any(car.name == car_name for car in self.cars):
-                print("A car with that name already exists")
-                continue
-
-            # check for empty name
-            if not car_name:
-                print("Car name cannot be empty.")
+            try:
+                self.validate_name(car_name)
+            except ValueError as error:
+                print(error)
                 continue
 
             break
@@ -40,34 +147,10 @@ class Simulation:
             )
             pos_input = input().strip().split()
 
-            if len(pos_input) != 3:
-                print("Please provide exactly 3 values: x, y and direction")
-                continue
-
-            x_str, y_str, direction = pos_input
-
             try:
-                x, y = int(x_str), int(y_str)
-
-            except ValueError:
-                print("x and y must both be integers")
-                continue
-
-            # Check existing cars if anything occupies the same spot
-            if any(car.x == x and car.y == y for car in self.cars):
-                print(f"The location ({x},{y}) is already occupied by another car.")
-                continue
-
-            if not (0 <= x < self.width and 0 <= y < self.height):
-                print(
-                    f"The location of the car is out of bounds. The grid size is up to ({self.width-1},{self.height-1})"
-                )
-                continue
-
-            if direction.upper() not in Car.VALID_DIRECTIONS:
-                print(
-                    f"Invalid car direction.Please note that only N, S, W, E (representing North, South, West, East) are allowed for direction."
-                )
+                x, y, direction = self.validate_position(pos_input)
+            except ValueError as error:
+                print(error)
                 continue
 
             break
@@ -76,18 +159,157 @@ class Simulation:
         while True:
             print(f"Please enter the commands for car {car_name}:")
 
-            commands = input().strip().upper()
-
-            if not all(cmd in Car.VALID_COMMANDS for cmd in commands):
-                print(
-                    f"Invalid Commands, Please only supply commands from {Car.VALID_COMMANDS}. The format should be `FRL` for example."
-                )
+            try:
+                commands = self.validate_commands(input())
+            except ValueError as error:
+                print(error)
                 continue
             break
 
-        car = Car(x, y, direction.upper(), car_name, commands)
+        car = Car(x, y, direction, car_name, commands)
         # Add the car to the simulation
-        self.cars.append(car)
+        self._append(car)
+
+    def insert_car(
+        self, car_name: str, x: int, y: int, direction: str, commands: str
+    ) -> Car:
+        """
+        Adds a car without prompting, using the same checks as add_car
+
+        Args:
+                car_name: Car Name
+                x: Initial x-coordinate (column)
+                y: Initial y-coordinate (row)
+                direction: Direction the car is facing (N, S, E, W)
+                commands: String of commands (F, L, R) to be executed
+
+        Returns:
+                The car that was added
+        """
+        self.validate_name(car_name)
+        self.check_free(x, y)
+        direction = self.check_placement(x, y, direction)
+        car = Car(x, y, direction, car_name, self.validate_commands(commands))
+        self._append(car)
+        return car
+
+    def validate_name(self, car_name: str) -> None:
+        """
+        Raises ValueError with the message for the user if the car name cannot be used
+
+        Args:
+                car_name: Stripped car name
+        """
+        # check for duplicates
+        self._sync_indexes()
+        if car_name in self._names:
+            raise ValueError(self.NAME_TAKEN)
+
+        self.check_name(car_name)
+
+    def validate_position(self, pos_input: list[str]) -> tuple[int, int, str]:
+        """
+        Checks an initial position given as [x, y, direction]
+
+        Args:
+                pos_input: The three values entered by the user
+
+        Returns:
+                x, y and the upper case direction, or raises ValueError with the message for the user
+        """
+        x, y, direction = self.parse_position(pos_input)
+        self.check_free(x, y)
+        return x, y, self.check_placement(x, y, direction)
+
+    def check_free(self, x: int, y: int) -> None:
+        """
+        Raises ValueError if another car starts on the cell
+
+        Args:
+                x: Initial x-coordinate
+                y: Initial y-coordinate
+        """
+        # Check existing cars if anything occupies the same spot
+        self._sync_indexes()
+        if (x, y) in self._cells:
+            raise ValueError(self.CELL_TAKEN.format(x=x, y=y))
+
+    @staticmethod
+    def check_name(car_name: str) -> None:
+        """
+        Raises ValueError if the name is empty, duplicates are checked by validate_name
+
+        Args:
+                car_name: Stripped car name
+        """
+        # check for empty name
+        if not car_name:
+            raise ValueError("Car name cannot be empty.")
+
+    @staticmethod
+    def parse_position(pos_input: list[str]) -> tuple[int, int, str]:
+        """
+        Splits [x, y, direction] into integer coordinates and the direction as entered
+
+        Args:
+                pos_input: The three values entered by the user
+        """
+        if len(pos_input) != 3:
+            raise ValueError("Please provide exactly 3 values: x, y and direction")
+
+        x_str, y_str, direction = pos_input
+
+        try:
+            x, y = int(x_str), int(y_str)
+
+        except ValueError:
+            raise ValueError("x and y must both be integers") from None
+
+        return x, y, direction
+
+    def check_placement(self, x: int, y: int, direction: str) -> str:
+        """
+        Checks that a position is inside the grid and the direction is valid
+
+        Args:
+                x: Initial x-coordinate
+                y: Initial y-coordinate
+                direction: Direction as entered
+
+        Returns:
+                The upper case direction
+        """
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            raise ValueError(
+                f"The location of the car is out of bounds. The grid size is up to ({self.width-1},{self.height-1})"
+            )
+
+        if direction.upper() not in Car.VALID_DIRECTIONS:
+            raise ValueError(
+                f"Invalid car direction.Please note that only N, S, W, E (representing North, South, West, East) are allowed for direction."
+            )
+
+        return direction.upper()
+
+    @staticmethod
+    def validate_commands(commands: str) -> str:
+        """
+        Checks a command string
+
+        Args:
+                commands: Commands as entered
+
+        Returns:
+                The stripped upper case commands, or raises ValueError with the message for the user
+        """
+        commands = commands.strip().upper()
+
+        if not all(cmd in Car.VALID_COMMANDS for cmd in commands):
+            raise ValueError(
+                f"Invalid Commands, Please only supply commands from {Car.VALID_COMMANDS}. The format should be `FRL` for example."
+            )
+
+        return commands
 
     def display_current_cars(self) -> None:
         """
@@ -99,6 +321,71 @@ class Simulation:
         for car in self.cars:
             print(str(car))
 
+    def bounding_box(self) -> tuple[int, int, int, int] | None:
+        """
+        Returns (min x, min y, max x, max y) of the cells the cars were placed on, None without cars.
+        Only cars added since the last call are looked at.
+
+        """
+        if self._bounded > len(self._cars):
+            self._bounds = None
+            self._bounded = 0
+
+        for car in self._cars[self._bounded :]:
+            if self._bounds is None:
+                self._bounds = (car.x, car.y, car.x, car.y)
+            else:
+                min_x, min_y, max_x, max_y = self._bounds
+                self._bounds = (
+                    min(min_x, car.x),
+                    min(min_y, car.y),
+                    max(max_x, car.x),
+                    max(max_y, car.y),
+                )
+        self._bounded = len(self._cars)
+        return self._bounds
+
+    def display_summary(self, recent: int = 3) -> None:
+        """
+        Prints the number of cars, where they are and the last few added, the same length for any fleet
+
+        Args:
+                recent: Number of most recently added cars to show
+        """
+        if not self.cars:
+            print("You have no cars yet.")
+            return
+
+        min_x, min_y, max_x, max_y = self.bounding_box()
+        print(
+            f"You have {len(self.cars)} car{'s' if len(self.cars) != 1 else ''} "
+            f"placed within ({min_x},{min_y}) to ({max_x},{max_y}). Most recently added:"
+        )
+        for car in self.cars[-recent:]:
+            print(str(car))
+
+    def display_cars_page(self, page: int, page_size: int = 20) -> bool:
+        """
+        Prints one page of the list of cars
+
+        Args:
+                page: Page number, from 0
+                page_size: Number of cars per page
+
+        Returns:
+                Whether there are more pages after this one
+        """
+        if not self.cars:
+            print("No cars in the field. Please add at least 1 car to list.")
+            return False
+
+        start = page * page_size
+        stop = min(start + page_size, len(self.cars))
+        print(f"Cars {start + 1} to {stop} of {len(self.cars)}:")
+        for car in self.cars[start:stop]:
+            print(str(car))
+        return stop < len(self.cars)
+
     def display_restart_menu(self) -> str:
         """
         Prints the Menu shown to users after the simulation is run
@@ -125,50 +412,645 @@ class Simulation:
 
         return restart_choice
 
-    def run_simulation(self):
+    def run_simulation(
+        self,
+        engine: str = "loop",
+        workers: int | None = None,
+        recorder: "TrajectoryRecorder | None" = None,
+        checkpointer: "Checkpointer | None" = None,
+        resume: str | None = None,
+        output: TextIO | None = None,
+        report_format: str = "text",
+    ) -> None:
         """
         Runs the simulation and outputs the results
 
+        Args:
+                engine: Stepping engine to use, one of Simulation.ENGINES
+                workers: Number of worker processes for engines that can use them
+                recorder: Writes the position of every car after every step, needs the loop engine
+                        and a run from step 1
+                checkpointer: Saves the state every few steps, needs the loop engine
+                resume: Checkpoint file to carry on from instead of starting at step 1
+                output: File the results are written to, defaults to standard output
+                report_format: Format of the results, one of report.FORMATS
         """
+        if report_format not in FORMATS:
+            raise ValueError(
+                f"Unknown report format {report_format!r}. Please choose from {FORMATS}"
+            )
+
+        if recorder is not None and resume:
+            # the log would lack the frames before the checkpoint
+            raise ValueError("A trajectory cannot be recorded when resuming from a checkpoint")
+
         if not self.cars:
             return
 
-        # get the longest_command from all cars to loop though
-        max_moves = max(len(car.commands) for car in self.cars)
+        start_step = self.restore_checkpoint(resume) if resume else 0
+        events = self.iter_events(
+            engine,
+            workers,
+            moves=recorder is not None,
+            checkpointer=checkpointer,
+            start_step=start_step,
+        )
+        if recorder is not None:
+            events = recorder.record(self, events)
+
+        # the printed report only needs the final state, so the events are just drained
+        for _ in events:
+            pass
+
+        if self.profiler is None:
+            self.display_results(output, report_format)
+        else:
+            with self.profiler.phase("report"):
+                self.display_results(output, report_format)
+
+    def simulate(self, engine: str = "loop", workers: int | None = None) -> None:
+        """
+        Runs the simulation without printing, the results are left on the cars
+
+        Args:
+                engine: Stepping engine to use, one of Simulation.ENGINES
+                workers: Number of worker processes for engines that can use them
+        """
+        for _ in self.iter_events(engine, workers):
+            pass
+
+    def iter_events(
+        self,
+        engine: str = "loop",
+        workers: int | None = None,
+        moves: bool = False,
+        checkpointer: "Checkpointer | None" = None,
+        start_step: int = 0,
+    ) -> Iterator["CollisionEvent | MoveEvent"]:
+        """
+        Runs the simulation and yields what happens, step by step.
+
+        The loop engine yields each event as soon as its step is done, and stopping the iteration
+        stops the run with the cars left at that step. The other engines run to the end first and
+        then yield their collisions in step order.
+
+        Args:
+                engine: Stepping engine to use, one of Simulation.ENGINES
+                workers: Number of worker processes for engines that can use them
+                moves: Also yield a MoveEvent for every command a car runs, loop engine only
+                checkpointer: Saves the state every few steps, loop engine only
+                start_step: Number of steps already run, for carrying on from a checkpoint
+
+        Returns:
+                CollisionEvent for each collision, after the MoveEvents of its step
+        """
+        if engine not in self.ENGINES:
+            raise ValueError(
+                f"Unknown engine {engine!r}. Please choose from {self.ENGINES}"
+            )
+
+        if moves and engine != "loop":
+            raise ValueError("Move events are only available from the loop engine")
+        if (checkpointer is not None or start_step) and engine != "loop":
+            raise ValueError("Checkpoints are only available from the loop engine")
+
+        if not self.cars:
+            return
+
+        # starting cells are indexed before the cars leave them
+        self._sync_indexes()
+
+        if engine == "loop":
+            yield from self._run_loop(moves, checkpointer, start_step)
+            return
+
+        # the other engines only leave their results on the cars, collisions from earlier runs are skipped
+        earlier = {id(car.collision) for car in self.cars if car.collided}
+        started = perf_counter()
+        if engine == "numpy":
+            # numpy is only needed for the vectorized engine
+            from vectorized import run_vectorized
+
+            run_vectorized(self)
+        elif engine == "trajectory":
+            run_trajectories(self, workers)
+        elif engine == "partitioned":
+            # partition builds Simulations of its own
+            from partition import run_partitioned
+
+            run_partitioned(self, workers)
+        elif engine == "sharded":
+            from sharding import run_sharded
+
+            run_sharded(self, workers)
+
+        if self.profiler is not None:
+            self.profiler.add_time(engine, perf_counter() - started)
 
-        # Start at 1 for the display
-        for move in range(1, max_moves + 1):
+        if self.shared_state is not None or self.renderer is not None:
+            last_step = max(
+                car.collision_step if car.collided else len(car.command_codes) for car in self.cars
+            )
+        if self.shared_state is not None:
+            self.shared_state.publish(self.cars, range(len(self.cars)), last_step)
+            self.shared_state.finish()
+        if self.renderer is not None:
+            self.renderer.finish(self, last_step, OccupancyIndex(self.cars).cells)
+
+        events = {}
+        for car in self.cars:
+            event = car.collision
+            if event is not None and id(event) not in earlier:
+                events[id(event)] = event
+        yield from sorted(events.values(), key=lambda event: event.step)
 
-            for car in self.cars:
-                if move <= len(car.commands) and car.collided != True:
-                    command = car.commands[move - 1]
-                    car.move(command, self.width, self.height)
+    def results(self) -> list[CarResult]:
+        """
+        Returns the final state of every car in the order they were added
 
-            pos_dict = {}
+        """
+        return [
+            CarResult(
+                car.name,
+                car.x,
+                car.y,
+                car.direction,
+                tuple(car.collided_with),
+                car.collision_step,
+            )
+            for car in self.cars
+        ]
 
-            for car in self.cars:
-                pos = (car.x, car.y)
-                pos_dict.setdefault(pos, []).append(car)
+    def get_state(self) -> tuple[list[tuple[int, int, int, int]], list]:
+        """
+        Returns the fleet state as plain tuples, compact to pickle or send to another process
 
-            for pos, car_list in pos_dict.items():
-                # Collision if more than one car at position
-                if len(car_list) > 1:
-                    for car in car_list:
-                        if not car.collided:
-                            car.collided = True
-                            car.collided_with = [c.name for c in car_list if c != car]
-                            car.collision_position = pos
-                            car.collision_step = move
+        Returns:
+                (x, y, heading, collision number or -1) per car, and
+                ((x, y), step, indexes of the cars on the cell) per collision
+        """
+        index_of = {id(car): index for index, car in enumerate(self.cars)}
+        numbers = {}
+        collisions = []
+        cars = []
 
-        # Display results
-        print("After simulation, the result is:")
         for car in self.cars:
-            if car.collided:
-                collided_with_str = " and ".join(car.collided_with)
-                pos_str = f"({car.collision_position[0]},{car.collision_position[1]})"
-                print(
-                    f"- {car.name}, collides with {collided_with_str} at {pos_str} at step {car.collision_step}"
+            event = car.collision
+            number = -1
+            if event is not None:
+                number = numbers.get(id(event))
+                if number is None:
+                    number = numbers[id(event)] = len(collisions)
+                    collisions.append(
+                        (event.position, event.step, [index_of[id(c)] for c in event.cars])
+                    )
+            cars.append((car.x, car.y, car.heading, number))
+
+        return cars, collisions
+
+    def set_state(
+        self,
+        state: tuple[list, list],
+        indexes: list[int | None] | None = None,
+        step_offset: int = 0,
+        reset: bool = False,
+    ) -> None:
+        """
+        Applies a state from get_state to the cars. Cars that had already collided are left as they are.
+
+        Args:
+                state: State returned by get_state
+                indexes: Index in self.cars of each car in the state, None to leave that car out.
+                        Defaults to the same order.
+                step_offset: Added to the step of every collision in the state
+                reset: Overwrite cars that had already collided too, and clear collisions not in the state
+        """
+        cars_state, collisions = state
+        if indexes is None:
+            indexes = range(len(cars_state))
+
+        events = {}
+        for index, (x, y, heading, number) in zip(indexes, cars_state):
+            if index is None:
+                continue
+            car = self.cars[index]
+            if car.collided and not reset:
+                continue
+
+            car.x = x
+            car.y = y
+            car.heading = heading
+            if number < 0 and reset:
+                car.collide(None)
+            elif number >= 0:
+                if number not in events:
+                    position, step, occupants = collisions[number]
+                    events[number] = CollisionEvent(
+                        position,
+                        step + step_offset,
+                        [self.cars[indexes[i]] for i in occupants],
+                    )
+                car.collide(events[number])
+
+    def restore_checkpoint(self, path: str) -> int:
+        """
+        Puts every car back to where a checkpoint of this simulation left it
+
+        Args:
+                path: Checkpoint file written while running this simulation
+
+        Returns:
+                Step the checkpoint was taken at, to carry on from
+        """
+        checkpoint = load_checkpoint(path)
+        cars_state = checkpoint.state[0]
+        if len(cars_state) != len(self.cars):
+            raise ValueError(
+                f"The checkpoint has {len(cars_state)} cars but the simulation has {len(self.cars)}"
+            )
+        self.set_state(checkpoint.state, reset=True)
+        return checkpoint.step
+
+    def _run_loop(
+        self,
+        moves: bool = False,
+        checkpointer: "Checkpointer | None" = None,
+        start_step: int = 0,
+    ) -> Iterator["CollisionEvent | MoveEvent"]:
+        """
+        Steps every car one command at a time and records collisions on the cars
+
+        Args:
+                moves: Yield a MoveEvent for every command a car runs
+                checkpointer: Told about every step that is done
+                start_step: Number of commands every car still moving has already run
+
+        Returns:
+                Events of each step, as soon as the step is done
+        """
+        cars = self.cars
+        profiler = self.profiler
+        shared = self.shared_state
+        renderer = self.renderer
+        started = perf_counter()
+        occupancy = OccupancyIndex(cars)
+
+        # Only cars with commands left that have not collided can change state
+        active = [
+            index
+            for index, car in enumerate(cars)
+            if len(car.command_codes) > start_step and not car.collided
+        ]
+        if profiler is not None:
+            profiler.add_time("setup", perf_counter() - started)
+        if shared is not None:
+            shared.publish(cars, range(len(cars)), start_step)
+
+        # Runs no other moving car can reach are applied in one go, which move events, checkpoints
+        # and anything watching the fleet step by step cannot follow.
+        # index -> (last step, x, y, heading, box) of the run.
+        skipping = not moves and checkpointer is None and shared is None and renderer is None
+        flying = {}
+        landings = []
+        # index -> spans of the car's long runs, and the step its next one is looked at
+        runs = {}
+        next_run = [0] * len(cars)
+        longest = 0
+        if skipping:
+            for index in active:
+                spans = long_runs(cars[index].command_codes, MIN_SKIPPED_RUN)
+                runs[index] = spans
+                # the first step is stepped to catch cars that start on the same cell
+                next_run[index] = self._next_run_step(spans, max(1, start_step))
+                longest = max([longest] + [end - start for start, end in spans])
+
+        width, height = self.width, self.height
+        cells = occupancy.cells
+        # steps before start_step were run before the checkpoint, the first one here is start_step + 1
+        move = start_step
+        while active or flying:
+            move += 1
+            if not active:
+                # every moving car is in the middle of a run, nothing happens until one ends
+                move = landings[0][0]
+
+            # A lone car only has to watch for the cells of parked cars.
+            # Its steps are skipped over, so move events, checkpoints and watchers need it stepped one at a time.
+            if len(active) == 1 and not flying and move > 1 and skipping:
+                started = perf_counter()
+                event = self._fast_forward(active[0], move, occupancy)
+                if profiler is not None:
+                    profiler.add_time("fast_forward", perf_counter() - started)
+                car = cars[active[0]]
+                move = event.step if event is not None else len(car.command_codes)
+                if shared is not None:
+                    shared.publish(cars, [active[0], *occupancy.cells.get((car.x, car.y), ())], move)
+                if event is not None:
+                    yield event
+                break
+
+            if profiler is not None:
+                started = perf_counter()
+
+            # cars may have been placed on the same cell, check them on the first step
+            entered = set(occupancy.crowded()) if move == 1 else set()
+            still_active = []
+            took_off = 0
+            # no run is long enough to get clear of that many cars
+            planning = skipping and len(active) + len(flying) < longest
+
+            for index in active:
+                car = cars[index]
+                if planning and move >= next_run[index]:
+                    flight, length = self._plan_run(index, move, occupancy, active, flying)
+                    next_run[index] = self._next_run_step(runs[index], move - 1 + length)
+                    if flight is not None:
+                        flying[index] = flight
+                        heappush(landings, (flight[0], index))
+                        took_off += 1
+                        continue
+                x, y = car.x, car.y
+                commands = car.command_codes
+                car.move(commands[move - 1], width, height)
+                if car.x != x or car.y != y:
+                    # OccupancyIndex.move inlined, this runs for every moving car at every step
+                    old = (x, y)
+                    new = (car.x, car.y)
+                    occupants = cells.pop(old)
+                    if len(occupants) > 1:
+                        occupants.remove(index)
+                        cells[old] = occupants
+                        occupants = [index]
+                    there = cells.setdefault(new, occupants)
+                    if there is not occupants:
+                        there.append(index)
+                        entered.add(new)
+                if moves:
+                    yield MoveEvent(move, index, car.x, car.y, car.heading)
+                if move < len(commands):
+                    still_active.append(index)
+
+            landed = []
+            while landings and landings[0][0] == move:
+                index = heappop(landings)[1]
+                car = cars[index]
+                _, x, y, car.heading, _ = flying.pop(index)
+                old = (car.x, car.y)
+                if (x, y) != old:
+                    if occupancy.move(index, old, (x, y)):
+                        entered.add((x, y))
+                    car.x, car.y = x, y
+                if move < len(car.command_codes):
+                    still_active.append(index)
+                landed.append(index)
+
+            if profiler is not None:
+                moved = perf_counter()
+
+            # Only cells a car moved onto while another car was there can hold a new collision
+            found = 0
+            hit = []
+            for pos in entered:
+                event = self._record_collision(occupancy, pos, move)
+                if event is not None:
+                    found += 1
+                    if shared is not None:
+                        hit.extend(occupancy.cells[pos])
+                    yield event
+
+            if profiler is not None:
+                profiler.add_time("move", moved - started)
+                profiler.add_time("collisions", perf_counter() - moved)
+                # cars in the middle of a skipped run are running commands too
+                running = len(active) - took_off + len(flying) + len(landed)
+                profiler.record_step(move, running, len(entered), found, len(cars) - running)
+
+            if shared is not None:
+                # parked cars only change when something runs into them
+                shared.publish(cars, active + landed + hit, move)
+            if renderer is not None:
+                renderer.step_done(self, move, occupancy.cells)
+
+            if found:
+                still_active = [index for index in still_active if not cars[index].collided]
+            active = still_active
+
+            if checkpointer is not None:
+                checkpointer.step_done(self, move)
+
+        if shared is not None:
+            shared.finish()
+        if renderer is not None:
+            renderer.finish(self, move, occupancy.cells)
+
+    @staticmethod
+    def _next_run_step(spans: list[tuple[int, int]], command: int) -> float:
+        """
+        Returns the step from which a car has a long run ahead of it, infinity if it has none left
+
+        Args:
+                spans: (start, end) indexes of the long runs of the car
+                command: Index of the first command the run may start at
+        """
+        position = bisect_right(spans, (command, float("inf"))) - 1
+        if position >= 0 and spans[position][1] - command >= MIN_SKIPPED_RUN:
+            # what is left of the run the command is part of
+            return command + 1
+        position += 1
+        return spans[position][0] + 1 if position < len(spans) else float("inf")
+
+    def _plan_run(
+        self, index: int, move: int, occupancy: OccupancyIndex, active: list[int], flying: dict
+    ) -> tuple[tuple | None, int]:
+        """
+        Works out the run of commands a car starts at step move in one go, if no other moving car
+        can reach the cells it covers before the run ends. A car moves at most one cell per step,
+        so that holds when every other car is further than the length of the run from them.
+        Only parked cars can then be in the way, the first one on the path stops the car.
+
+        Args:
+                index: Index of the car
+                move: Step the run starts at
+                occupancy: Occupancy index of the simulation
+                active: Cars stepped one command at a time
+                flying: Cars in the middle of a run, index -> (last step, x, y, heading, box)
+
+        Returns:
+                (last step, x, y, heading, box) of the run or None to step it,
+                and the number of commands in the run
+        """
+        car = self.cars[index]
+        forward, length, turn = next(car.program.ops_from(move - 1))
+        # checking the other cars costs about as much as stepping a run that short
+        if length < MIN_SKIPPED_RUN or length <= len(active) + len(flying):
+            return None, length
+
+        x, y = car.x, car.y
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None, length
+        dx, dy = DELTAS[car.heading] if forward else (0, 0)
+        end_x = advance(x, dx, length, self.width)
+        end_y = advance(y, dy, length, self.height)
+        box = (min(x, end_x), min(y, end_y), max(x, end_x), max(y, end_y))
+
+        cars = self.cars
+        for other in active:
+            if other != index:
+                other_car = cars[other]
+                other_x, other_y = other_car.x, other_car.y
+                distance = max(box[0] - other_x, 0, other_x - box[2]) + max(
+                    box[1] - other_y, 0, other_y - box[3]
                 )
+                if distance <= length:
+                    return None, length
+        for other_box in (flight[4] for flight in flying.values()):
+            distance = max(box[0] - other_box[2], 0, other_box[0] - box[2]) + max(
+                box[1] - other_box[3], 0, other_box[1] - box[3]
+            )
+            if distance <= length:
+                return None, length
+
+        if not forward:
+            return (move + length - 1, x, y, (car.heading + turn) & 3, box), length
+
+        # the first parked car on the path, looked up cell by cell or among the parked cars,
+        # whichever is fewer
+        cells = occupancy.cells
+        path = abs(end_x - x) + abs(end_y - y)
+        if path <= len(cells):
+            distances = (
+                distance
+                for distance in range(1, path + 1)
+                if (x + dx * distance, y + dy * distance) in cells
+            )
+        else:
+            distances = sorted(
+                abs(cell_x - x) + abs(cell_y - y)
+                for cell_x, cell_y in cells
+                if box[0] <= cell_x <= box[2] and box[1] <= cell_y <= box[3] and (cell_x, cell_y) != (x, y)
+            )
+        hit = next(iter(distances), None)
+        if hit is not None:
+            return (move + hit - 1, x + dx * hit, y + dy * hit, car.heading, box), length
+        return (move + length - 1, end_x, end_y, car.heading, box), length
+
+    def _fast_forward(
+        self, index: int, move: int, occupancy: OccupancyIndex
+    ) -> CollisionEvent | None:
+        """
+        Runs the remaining commands of the only car still moving, starting at step move.
+        Every other car is parked, so each run of the car's compiled program is applied at once.
+
+        Args:
+                index: Index of the moving car
+                move: Step to start from
+                occupancy: Occupancy index of the simulation
+
+        Returns:
+                Collision that stopped the car, if any
+        """
+        car = self.cars[index]
+        start = (car.x, car.y)
+
+        # Parked cars within reach of the moving car, by row and by column
+        reach = car.command_codes.count(b"F", move - 1)
+        rows = {}
+        cols = {}
+        for (x, y), occupants in occupancy.cells.items():
+            if occupants != [index] and abs(x - car.x) + abs(y - car.y) <= reach:
+                rows.setdefault(y, []).append(x)
+                cols.setdefault(x, []).append(y)
+        for cells in (*rows.values(), *cols.values()):
+            cells.sort()
+
+        step = move
+        for forward, length, turn in car.program.ops_from(move - 1):
+            if not forward:
+                car.heading = (car.heading + turn) & 3
+                step += length
+                continue
+
+            dx, dy = DELTAS[car.heading]
+            new_x = advance(car.x, dx, length, self.width)
+            new_y = advance(car.y, dy, length, self.height)
+
+            # The car moves one cell per command until it stops, so it hits the first parked car on the way
+            if new_x != car.x:
+                hit = first_between(rows.get(car.y, []), car.x, new_x)
+                hit = hit if hit is None else (hit, car.y)
+            elif new_y != car.y:
+                hit = first_between(cols.get(car.x, []), car.y, new_y)
+                hit = hit if hit is None else (car.x, hit)
             else:
-                pos_str = f"({car.x},{car.y})"
-                print(f"- {car.name}, {pos_str} {car.direction}")
+                hit = None
+
+            if hit is not None:
+                distance = abs(hit[0] - car.x) + abs(hit[1] - car.y)
+                occupancy.move(index, start, hit)
+                car.x, car.y = hit
+                return self._record_collision(occupancy, hit, step + distance - 1)
+
+            car.x = new_x
+            car.y = new_y
+            step += length
+
+        # the index stays right for anything that looks at the cells after the run
+        if (car.x, car.y) != start:
+            occupancy.move(index, start, (car.x, car.y))
+        return None
+
+    def _record_collision(
+        self, occupancy: OccupancyIndex, pos: tuple[int, int], move: int
+    ) -> CollisionEvent | None:
+        """
+        Marks the cars on a cell as collided if there is more than one
+
+        Args:
+                occupancy: Occupancy index of the simulation
+                pos: (x, y) of the cell to check
+                move: Current step
+
+        Returns:
+                The new collision, None if no car collided
+        """
+        occupants = occupancy.occupants(pos)
+        # Collision if more than one car at position
+        if len(occupants) < 2:
+            return None
+        return self.mark_collision(occupants, pos, move)
+
+    def mark_collision(
+        self, occupants: list[int], pos: tuple[int, int], move: int
+    ) -> CollisionEvent | None:
+        """
+        Marks every car on a crowded cell that has not collided yet as collided
+
+        Args:
+                occupants: Indexes of all cars on the cell, in the order they were added
+                pos: (x, y) of the cell
+                move: Current step
+
+        Returns:
+                The new collision, None if every car on the cell had already collided
+        """
+        # one event shared by every car on the cell
+        event = None
+        for index in occupants:
+            car = self.cars[index]
+            if not car.collided:
+                if event is None:
+                    event = CollisionEvent(pos, move, [self.cars[i] for i in occupants])
+                car.collide(event)
+        return event
+
+    def display_results(
+        self, output: TextIO | None = None, report_format: str = "text"
+    ) -> None:
+        """
+        Prints the final position of every car, or where and when it collided
+
+        Args:
+                output: File the results are written to, defaults to standard output
+                report_format: Format of the results, one of report.FORMATS
+        """
+        write_report(self.cars, output, report_format)
@@ -1,7 +1,46 @@
+import csv
+import io
+import asyncio
+import json
+import os
+import multiprocessing
+import pstats
+import random
+import re
+import signal
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import resource_tracker
 from unittest.mock import patch
 import pytest
-from car import Car
-from simulation import Simulation
+import benchmark
+import carsimulation
+from batch import run_batch, run_scenario
+from car import HEADINGS, Car, CollisionEvent
+from carsimulation import parse_scenario
+from checkpoint import Checkpointer, load_checkpoint, save_checkpoint
+from incremental import IncrementalSimulation
+from occupancy import OccupancyIndex
+from partition import interaction_components, path_box, run_partitioned
+from profiling import Profiler
+from program import CommandProgram, advance, long_runs
+from recorder import RECORD, TrajectoryLog, TrajectoryRecorder
+from renderer import ViewportRenderer
+from report import write_report
+from service import ServiceClient, SimulationService, check_local
+from sharding import run_sharded, tile_edges
+from sharedstate import SEQUENCE, SEQUENCE_OFFSET, FleetObserver, SharedFleetState
+from simulation import CarResult, MoveEvent, Simulation
+from trajectory import NEVER, car_trajectory, compute_trajectories
+from whatif import WhatIfEvaluator
+
+
+def require_engine(engine):
+    """Skips the test when the engine's optional dependency is not installed"""
+    if engine == "numpy":
+        pytest.importorskip("numpy")
 
 
 class TestCar:
@@ -121,6 +160,60 @@ class TestCar:
         expected_str = "- TestCar, (3,4), N , FLR"
         assert str(car) == expected_str
 
+    def test_car_has_no_instance_dict(self):
+        """Test that cars use slots and store direction and commands compactly"""
+        car = Car(1, 2, "W", "TestCar", "FRL")
+        assert not hasattr(car, "__dict__")
+        assert car.heading == HEADINGS.index("W")
+        assert car.command_codes == b"FRL"
+        assert car._collision is None
+
+        car.direction = "S"
+        assert car.direction == "S"
+        assert car.heading == HEADINGS.index("S")
+
+    def test_invalid_direction_and_commands(self):
+        """Test that a car cannot hold a direction or command it cannot encode"""
+        with pytest.raises(ValueError):
+            Car(0, 0, "Q", "TestCar", "F")
+        with pytest.raises(ValueError):
+            Car(0, 0, "N", "TestCar", "FXF")
+
+    def test_move_accepts_command_bytes(self):
+        """Test that commands can be given as their byte value"""
+        car = Car(5, 5, "N", "TestCar", "FR")
+        for command in car.command_codes:
+            car.move(command, 10, 10)
+        assert (car.x, car.y, car.direction) == (5, 6, "E")
+
+    def test_collision_is_recorded_lazily(self):
+        """Test that collision details only exist once a car has collided"""
+        car = Car(0, 0, "N", "TestCar", "F")
+        other = Car(0, 0, "S", "Other", "")
+        car.collide(CollisionEvent((0, 0), 3, [car, other]))
+        assert car.collided is True
+        assert car.collided_with == ["Other"]
+        assert car.collision_position == (0, 0)
+        assert car.collision_step == 3
+
+        # collided cars do not move
+        car.move("F", 10, 10)
+        assert (car.x, car.y) == (0, 0)
+
+    def test_memory_per_car(self):
+        """Measure the memory of a car with a 10-command string, including its list slot"""
+        n_cars = 10_000
+        names = [f"C{i}" for i in range(n_cars)]
+        tracemalloc.start()
+        try:
+            cars = [Car(i % 100, i // 100, "N", names[i], "FFRFFLFRFF") for i in range(n_cars)]
+            size, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        per_car = size / len(cars)
+        assert per_car < 160, f"{per_car:.0f} bytes per car"
+
 
 class TestSimulation:
     def test_simulation_initialization(self):
@@ -144,7 +237,8 @@ class TestSimulation:
         assert car.direction == "N"
         assert car.commands == "FLR"
 
-    def test_collision_detection(self):
+    @pytest.mark.parametrize("engine", Simulation.ENGINES)
+    def test_collision_detection(self, engine):
         """Test that collisions are detected correctly"""
         sim = Simulation(10, 10)
 
@@ -153,7 +247,8 @@ class TestSimulation:
         car2 = Car(2, 4, "S", "Car2", "FF")
 
         sim.cars = [car1, car2]
-        sim.run_simulation()
+        require_engine(engine)
+        sim.run_simulation(engine=engine)
 
         # Both cars should have collided at (2,3)
         assert car1.collided is True
@@ -163,13 +258,15 @@ class TestSimulation:
         assert "Car2" in car1.collided_with
         assert "Car1" in car2.collided_with
 
-    def test_multiple_commands_execution(self):
+    @pytest.mark.parametrize("engine", Simulation.ENGINES)
+    def test_multiple_commands_execution(self, engine):
         """Test execution of multiple commands for a car"""
         sim = Simulation(10, 10)
 
         car = Car(2, 2, "N", "TestCar", "FFRFF")
         sim.cars = [car]
-        sim.run_simulation()
+        require_engine(engine)
+        sim.run_simulation(engine=engine)
 
         # After the commands, the car should be at (4,4) facing East
         assert car.x == 4
@@ -177,7 +274,8 @@ class TestSimulation:
         assert car.direction == "E"
         assert car.collided is False
 
-    def test_cars_with_different_command_lengths(self):
+    @pytest.mark.parametrize("engine", Simulation.ENGINES)
+    def test_cars_with_different_command_lengths(self, engine):
         """Test simulation with cars having different command lengths"""
         sim = Simulation(10, 10)
 
@@ -185,7 +283,8 @@ class TestSimulation:
         car2 = Car(5, 5, "S", "Car2", "FFLRFR")
 
         sim.cars = [car1, car2]
-        sim.run_simulation()
+        require_engine(engine)
+        sim.run_simulation(engine=engine)
 
         # Car1
         assert car1.x == 1
@@ -196,3 +295,1805 @@ class TestSimulation:
         assert car2.x == 5
         assert car2.y == 2
         assert car2.direction == "W"
+
+
+def random_specs(seed, width, height, n_cars, max_commands):
+    """Random (name, x, y, direction, commands) specs with unique start cells"""
+    rng = random.Random(seed)
+    cells = rng.sample(range(width * height), n_cars)
+    return [
+        (
+            f"C{i}",
+            cell // height,
+            cell % height,
+            rng.choice(Car.VALID_DIRECTIONS),
+            "".join(
+                rng.choice("FFFLR") for _ in range(rng.randint(0, max_commands))
+            ),
+        )
+        for i, cell in enumerate(cells)
+    ]
+
+
+def build_simulation(width, height, specs):
+    """Simulation holding a fresh Car for every spec"""
+    sim = Simulation(width, height)
+    sim.cars = [Car(x, y, direction, name, commands) for name, x, y, direction, commands in specs]
+    return sim
+
+
+def reference_report(width, height, specs):
+    """Report lines of the original one-car-at-a-time step loop, used as the oracle"""
+    deltas = {"N": (0, 1), "E": (1, 0), "S": (0, -1), "W": (-1, 0)}
+    right = {"N": "E", "E": "S", "S": "W", "W": "N"}
+    left = {value: key for key, value in right.items()}
+    cars = [
+        {"name": name, "x": x, "y": y, "dir": direction, "cmds": commands, "hit": None}
+        for name, x, y, direction, commands in specs
+    ]
+
+    max_moves = max((len(car["cmds"]) for car in cars), default=0)
+    for move in range(1, max_moves + 1):
+        for car in cars:
+            if move <= len(car["cmds"]) and car["hit"] is None:
+                command = car["cmds"][move - 1]
+                if command == "F":
+                    dx, dy = deltas[car["dir"]]
+                    if 0 <= car["x"] + dx < width:
+                        car["x"] += dx
+                    if 0 <= car["y"] + dy < height:
+                        car["y"] += dy
+                elif command == "R":
+                    car["dir"] = right[car["dir"]]
+                else:
+                    car["dir"] = left[car["dir"]]
+
+        pos_dict = {}
+        for car in cars:
+            pos_dict.setdefault((car["x"], car["y"]), []).append(car)
+        for pos, car_list in pos_dict.items():
+            if len(car_list) > 1:
+                for car in car_list:
+                    if car["hit"] is None:
+                        others = [c["name"] for c in car_list if c is not car]
+                        car["hit"] = (others, pos, move)
+
+    lines = ["After simulation, the result is:"]
+    for car in cars:
+        if car["hit"]:
+            others, pos, move = car["hit"]
+            lines.append(
+                f"- {car['name']}, collides with {' and '.join(others)} at ({pos[0]},{pos[1]}) at step {move}"
+            )
+        else:
+            lines.append(f"- {car['name']}, ({car['x']},{car['y']}) {car['dir']}")
+    return lines
+
+
+# (width, height, n_cars, max_commands) for the randomised engine comparisons
+RANDOM_FLEETS = [(5, 5, 6, 12), (8, 6, 20, 30), (4, 4, 16, 8), (30, 30, 40, 60)]
+
+
+class TestVectorizedEngine:
+    def test_unknown_engine(self):
+        """Test that an unknown engine name is rejected"""
+        sim = build_simulation(10, 10, [("Car1", 1, 1, "N", "F")])
+        with pytest.raises(ValueError):
+            sim.run_simulation(engine="abacus")
+
+    @pytest.mark.parametrize("seed", range(10))
+    @pytest.mark.parametrize("fleet", RANDOM_FLEETS)
+    def test_matches_object_engine(self, capsys, fleet, seed):
+        """Test that the NumPy engine prints and stores exactly what the object engine does"""
+        pytest.importorskip("numpy")
+        width, height, n_cars, max_commands = fleet
+        specs = random_specs(seed, width, height, n_cars, max_commands)
+
+        loop_sim = build_simulation(width, height, specs)
+        loop_sim.run_simulation()
+        loop_out = capsys.readouterr().out
+
+        numpy_sim = build_simulation(width, height, specs)
+        numpy_sim.run_simulation(engine="numpy")
+        numpy_out = capsys.readouterr().out
+
+        assert numpy_out == loop_out
+        assert loop_out.splitlines() == reference_report(width, height, specs)
+        for loop_car, numpy_car in zip(loop_sim.cars, numpy_sim.cars):
+            assert (numpy_car.x, numpy_car.y, numpy_car.direction) == (
+                loop_car.x,
+                loop_car.y,
+                loop_car.direction,
+            )
+            assert numpy_car.collided == loop_car.collided
+            assert numpy_car.collided_with == loop_car.collided_with
+            assert numpy_car.collision_position == loop_car.collision_position
+            assert numpy_car.collision_step == loop_car.collision_step
+
+    def test_shared_start_cell_collides_on_first_step(self, capsys):
+        """Test that cars placed on the same cell collide at step 1 in both engines"""
+        pytest.importorskip("numpy")
+        specs = [("A", 2, 2, "N", "L"), ("B", 2, 2, "E", "RR"), ("C", 5, 5, "S", "F")]
+        for engine in ("loop", "numpy"):
+            build_simulation(10, 10, specs).run_simulation(engine=engine)
+            assert capsys.readouterr().out.splitlines() == reference_report(10, 10, specs)
+
+
+class TestOccupancyIndex:
+    def test_index_follows_moves(self):
+        """Test that the index tracks cars as they move between cells"""
+        cars = [Car(0, 0, "N", "A", ""), Car(1, 0, "N", "B", ""), Car(0, 0, "E", "C", "")]
+        occupancy = OccupancyIndex(cars)
+
+        assert occupancy.occupants((0, 0)) == [0, 2]
+        assert occupancy.crowded() == [(0, 0)]
+
+        occupancy.move(0, (0, 0), (0, 1))
+        assert occupancy.occupants((0, 0)) == [2]
+        assert occupancy.occupants((0, 1)) == [0]
+        assert occupancy.crowded() == []
+
+        occupancy.move(1, (1, 0), (0, 1))
+        assert occupancy.occupants((0, 1)) == [0, 1]
+        assert occupancy.occupants((1, 0)) == []
+        assert (1, 0) not in occupancy.cells
+
+    def test_occupants_in_simulation_order(self):
+        """Test that occupants come back in the order the cars were added"""
+        cars = [Car(0, 0, "N", "A", ""), Car(0, 1, "N", "B", "")]
+        occupancy = OccupancyIndex(cars)
+        occupancy.move(1, (0, 1), (0, 2))
+        occupancy.move(0, (0, 0), (0, 2))
+        assert occupancy.occupants((0, 2)) == [0, 1]
+
+    @pytest.mark.parametrize("seed", range(10))
+    @pytest.mark.parametrize("fleet", RANDOM_FLEETS)
+    def test_loop_matches_reference(self, capsys, fleet, seed):
+        """Test that the indexed loop reports exactly what a full rescan every step does"""
+        width, height, n_cars, max_commands = fleet
+        specs = random_specs(seed, width, height, n_cars, max_commands)
+        build_simulation(width, height, specs).run_simulation()
+        assert capsys.readouterr().out.splitlines() == reference_report(width, height, specs)
+
+    def test_stationary_car_is_hit(self):
+        """Test that a car that has finished its commands still collides when driven into"""
+        sim = build_simulation(10, 10, [("A", 2, 2, "N", ""), ("B", 2, 0, "N", "FFF")])
+        sim.run_simulation()
+        car_a, car_b = sim.cars
+        assert car_a.collided and car_b.collided
+        assert car_a.collision_step == car_b.collision_step == 2
+        assert car_a.collided_with == ["B"]
+        assert car_b.collided_with == ["A"]
+
+
+class TestActiveSetScheduler:
+    def test_collided_cars_stop_stepping(self):
+        """Test that no car is stepped again once every car has collided"""
+        sim = build_simulation(10, 10, [("A", 2, 2, "N", "F" * 1000), ("B", 2, 4, "S", "F" * 1000)])
+        with patch.object(Car, "move", autospec=True, side_effect=Car.move) as mock_move:
+            sim.run_simulation()
+        # one command each at step 1, then both collide at (2,3)
+        assert mock_move.call_count == 2
+        assert sim.cars[0].collision_step == 1
+
+    def test_finished_cars_are_not_rescanned(self):
+        """Test that cars with short commands are only stepped for their own commands"""
+        specs = [(f"S{i}", i, 0, "N", "F") for i in range(5)] + [("Long", 9, 9, "S", "L" * 500)]
+        sim = build_simulation(10, 10, specs)
+        with patch.object(Car, "move", autospec=True, side_effect=Car.move) as mock_move:
+            sim.run_simulation()
+        # every car steps once, then the long car runs its remaining rotations as one op
+        assert mock_move.call_count == 6
+        assert sim.cars[5].direction == "S"
+        assert [(car.x, car.y) for car in sim.cars[:5]] == [(i, 1) for i in range(5)]
+
+    def test_lone_car_hits_parked_car(self, capsys):
+        """Test that a fast-forwarded car still collides with a parked car"""
+        specs = [("A", 0, 0, "N", "F"), ("B", 5, 0, "N", "FLFFFFFLF" + "R" * 20)]
+        build_simulation(10, 10, specs).run_simulation()
+        assert capsys.readouterr().out.splitlines() == reference_report(10, 10, specs)
+
+    def test_lone_car_out_of_reach(self, capsys):
+        """Test that a fast-forwarded car far from every parked car ends in the right place"""
+        specs = [("A", 0, 0, "N", "F"), ("B", 9, 9, "S", "FRFLFRRFFFF")]
+        build_simulation(10, 10, specs).run_simulation()
+        assert capsys.readouterr().out.splitlines() == reference_report(10, 10, specs)
+
+    @pytest.mark.parametrize("seed", range(20))
+    def test_skewed_command_lengths(self, capsys, seed):
+        """Test fleets where one car keeps going long after the rest have stopped"""
+        specs = random_specs(seed, 6, 6, 10, 6)
+        rng = random.Random(seed)
+        specs[0] = specs[0][:4] + ("".join(rng.choice("FFFLR") for _ in range(200)),)
+        build_simulation(6, 6, specs).run_simulation()
+        assert capsys.readouterr().out.splitlines() == reference_report(6, 6, specs)
+
+
+class TestTrajectoryEngine:
+    def test_car_trajectory(self):
+        """Test that a precomputed trajectory follows Car.move, boundaries included"""
+        xs, ys, headings = car_trajectory(0, 1, HEADINGS.index("S"), b"FFLFR", 10, 10)
+        assert list(xs) == [0, 0, 0, 0, 1, 1]
+        assert list(ys) == [1, 0, 0, 0, 0, 0]
+        assert "".join(HEADINGS[heading] for heading in headings) == "SSSEES"
+
+    def test_parallel_trajectories_match(self):
+        """Test that trajectories computed in worker processes match the in-process ones"""
+        specs = [(x, 2, 1, b"FRFLF" * 3) for x in range(10)]
+        assert compute_trajectories(specs, 20, 20, workers=2, chunk_size=3) == compute_trajectories(
+            specs, 20, 20
+        )
+
+    @pytest.mark.parametrize("seed", range(10))
+    @pytest.mark.parametrize("fleet", RANDOM_FLEETS)
+    def test_matches_reference(self, capsys, fleet, seed):
+        """Test that joining trajectories reports exactly what stepping does"""
+        width, height, n_cars, max_commands = fleet
+        specs = random_specs(seed, width, height, n_cars, max_commands)
+        build_simulation(width, height, specs).run_simulation(engine="trajectory")
+        assert capsys.readouterr().out.splitlines() == reference_report(width, height, specs)
+
+    def test_cascade_into_frozen_cars(self, capsys):
+        """Test that cars frozen by a collision are hit again by later arrivals"""
+        specs = [
+            ("A", 2, 2, "N", "FFFF"),
+            ("B", 2, 4, "S", "FFFF"),
+            ("C", 2, 7, "S", "FFFFFFF"),
+            ("D", 0, 3, "E", "LRFFFF"),
+        ]
+        sim = build_simulation(10, 10, specs)
+        sim.run_simulation(engine="trajectory")
+        assert capsys.readouterr().out.splitlines() == reference_report(10, 10, specs)
+        assert sim.cars[2].collided_with == ["A", "B", "D"]
+
+
+class TestCommandProgram:
+    def test_runs_are_folded(self):
+        """Test that F runs and rotation runs each compile to one op"""
+        program = CommandProgram(b"FFFLLRFRRRRF")
+        assert program.starts == [0, 3, 6, 7, 11]
+        assert program.ops == [
+            (True, 3, 0),
+            (False, 3, 3),
+            (True, 1, 0),
+            (False, 4, 0),
+            (True, 1, 0),
+        ]
+        assert len(program) == 5
+
+    def test_ops_from_middle_of_run(self):
+        """Test that running from the middle of a run only covers the remaining commands"""
+        program = CommandProgram(b"FFFLLRF")
+        assert list(program.ops_from(1)) == [(True, 2, 0), (False, 3, 3), (True, 1, 0)]
+        assert list(program.ops_from(4)) == [(False, 2, 0), (True, 1, 0)]
+        assert list(program.ops_from(7)) == []
+
+    def test_advance_clamps(self):
+        """Test that a forward run stops at the boundary like single steps do"""
+        assert advance(2, 1, 3, 10) == 5
+        assert advance(8, 1, 5, 10) == 9
+        assert advance(1, -1, 5, 10) == 0
+        assert advance(4, 0, 5, 10) == 4
+
+    def test_car_program_is_cached(self):
+        """Test that a car compiles its commands once and again after they change"""
+        car = Car(0, 0, "N", "TestCar", "FFL")
+        assert car.program is car.program
+        car.commands = "RR"
+        assert car.program.ops == [(False, 2, 2)]
+
+    def test_long_straight_runs(self, capsys):
+        """Test a lone car with long straight runs against the step by step result"""
+        specs = [
+            ("A", 0, 0, "N", "F"),
+            ("B", 3, 3, "E", "F"),
+            ("C", 0, 9, "S", "L" + "F" * 50 + "L" + "F" * 3 + "R" * 7 + "F" * 400),
+        ]
+        build_simulation(20, 20, specs).run_simulation()
+        assert capsys.readouterr().out.splitlines() == reference_report(20, 20, specs)
+
+    @pytest.mark.parametrize("seed", range(20))
+    def test_lone_car_runs_match_reference(self, capsys, seed):
+        """Test fast-forwarded programs among parked cars against the step by step result"""
+        rng = random.Random(seed)
+        specs = [(name, x, y, d, "") for name, x, y, d, _ in random_specs(seed, 12, 12, 15, 0)]
+        program = "".join(rng.choice(["F" * rng.randint(1, 9), "L", "R", "RR"]) for _ in range(40))
+        specs[0] = specs[0][:4] + (program,)
+        build_simulation(12, 12, specs).run_simulation()
+        assert capsys.readouterr().out.splitlines() == reference_report(12, 12, specs)
+
+    def test_long_runs(self):
+        """Test that only runs of at least the given length are found, rotations counting as one run"""
+        assert long_runs(b"FFFFLRLRFF" + b"F" * 6, 4) == [(0, 4), (4, 8), (8, 16)]
+        assert long_runs(b"FFFLLLF", 4) == []
+
+    def test_far_apart_runs_are_skipped(self):
+        """Test that runs no other moving car can reach are applied without stepping them"""
+        specs = [
+            ("A", 0, 0, "N", "F" * 100_000 + "R" + "F" * 10),
+            ("B", 500_000, 0, "E", "L" * 100_000),
+            ("C", 0, 300_000, "W", "RRF" * 200 + "F" * 100_000),
+        ]
+        sim = build_simulation(1_000_000, 1_000_000, specs)
+        sim.profiler = Profiler()
+        sim.simulate()
+        # every car runs its first command alone, then only C's short runs are stepped
+        assert len(sim.profiler.steps) < 700
+        # no car is idle before B finishes at step 100_000, even while all of them are mid-run
+        counters = sim.profiler.counters
+        for step, moved, idle in zip(sim.profiler.steps, counters["moved"], counters["idle"]):
+            assert (moved, idle) == ((3, 0) if step < 100_000 else (moved, 3 - moved))
+        stepped = build_simulation(1_000_000, 1_000_000, specs)
+        for _ in stepped.iter_events(moves=True):
+            pass
+        assert sim.results() == stepped.results()
+        assert (sim.cars[0].x, sim.cars[0].y) == (10, 100_000)
+
+    def test_watched_runs_are_stepped(self):
+        """Test that a shared state and a renderer see every car where it is after every step of long runs"""
+        specs = [("A", 0, 0, "N", "F" * 500), ("B", 1000, 0, "N", "F" * 500), ("C", 0, 1000, "E", "F" * 500)]
+        sim = build_simulation(2000, 2000, specs)
+
+        def expected(step):
+            return [0, 1000, step], [step, step, 1000]
+
+        class StepLog:
+            def __init__(self):
+                self.cells = []
+
+            def step_done(self, simulation, step, cells):
+                self.cells.append((step, sorted(cells)))
+
+            def finish(self, simulation, step, cells):
+                pass
+
+        with SharedFleetState(sim.cars, 2000, 2000) as state, FleetObserver(state.name) as observer:
+            publish = state.publish
+            published = []
+
+            def publish_and_read(cars, indices, step):
+                publish(cars, indices, step)
+                snapshot = observer.snapshot()
+                published.append((snapshot.step, snapshot.x, snapshot.y))
+
+            state.publish = publish_and_read
+            sim.shared_state = state
+            sim.renderer = StepLog()
+            sim.simulate()
+
+        assert published == [(step, *expected(step)) for step in range(501)]
+        assert sim.renderer.cells == [
+            (step, sorted(zip(*expected(step)))) for step in range(1, 501)
+        ]
+
+    @pytest.mark.parametrize("seed", range(20))
+    def test_skipped_runs_match_stepping(self, seed):
+        """Test fleets with long runs near each other and parked cars against stepping every command"""
+        rng = random.Random(seed)
+        specs = []
+        for name, x, y, d, _ in random_specs(seed, 60, 60, 8, 0):
+            runs = [rng.choice(["F" * rng.randint(1, 90), "L" * rng.randint(1, 50), "R", "F"]) for _ in range(rng.randint(0, 6))]
+            specs.append((name, x, y, d, "".join(runs)))
+        sim = build_simulation(60, 60, specs)
+        sim.simulate()
+        stepped = build_simulation(60, 60, specs)
+        for _ in stepped.iter_events(moves=True):
+            pass
+        assert sim.results() == stepped.results()
+
+
+class TestCollisionEvent:
+    def test_pile_up_shares_one_event(self):
+        """Test that every car in a pile-up refers to the same event"""
+        specs = [("A", 2, 0, "N", "FF"), ("B", 2, 4, "S", "FF"), ("C", 0, 2, "E", "FF"), ("D", 4, 2, "W", "FF")]
+        sim = build_simulation(10, 10, specs)
+        sim.run_simulation()
+
+        event = sim.cars[0].collision
+        assert all(car.collision is event for car in sim.cars)
+        assert event.position == (2, 2)
+        assert event.step == 2
+        assert event.cars == sim.cars
+        assert sim.cars[2].collided_with == ["A", "B", "D"]
+
+    def test_late_arrival_gets_its_own_event(self):
+        """Test that a car driving into a pile-up later records a new event naming every car there"""
+        specs = [("A", 2, 2, "N", "F"), ("B", 2, 4, "S", "F"), ("C", 2, 6, "S", "FFF")]
+        sim = build_simulation(10, 10, specs)
+        sim.run_simulation()
+
+        car_a, car_b, car_c = sim.cars
+        assert car_a.collision is car_b.collision
+        assert car_c.collision is not car_a.collision
+        assert car_c.collision.step == 3
+        assert car_c.collided_with == ["A", "B"]
+        assert car_a.collided_with == ["B"]
+
+    def test_describe_matches_report(self, capsys):
+        """Test that the printed result is formatted from the shared event"""
+        specs = [("A", 2, 2, "N", "FF"), ("B", 2, 4, "S", "FF")]
+        sim = build_simulation(10, 10, specs)
+        sim.run_simulation()
+        assert sim.cars[0].collision.describe(sim.cars[0]) == "collides with B at (2,3) at step 1"
+        assert capsys.readouterr().out.splitlines() == reference_report(10, 10, specs)
+
+
+class TestScenarioLoader:
+    def test_parse_scenario(self):
+        """Test that a scenario builds the same cars as entering them one by one"""
+        sim = parse_scenario("10 10\n\nA 1 2 n ffrff\nB 7 8 W\n")
+        assert (sim.width, sim.height) == (10, 10)
+        assert [str(car) for car in sim.cars] == ["- A, (1,2), N , FFRFF", "- B, (7,8), W , "]
+
+    @pytest.mark.parametrize(
+        "text, message",
+        [
+            ("", "The scenario is empty"),
+            ("10", "Line 1: Please provide exactly 2 numbers"),
+            ("0 10", "Line 1: Width and height must be positive integers."),
+            ("10 10\nA 1 2 N F\nA 3 3 N F", "Line 3: A car with that name already exists"),
+            ("10 10\nA 1 2 N F\nB 1 2 S F", "Line 3: The location (1,2) is already occupied by another car."),
+            ("10 10\nA 10 2 N F", "Line 2: The location of the car is out of bounds."),
+            ("10 10\nA x 2 N F", "Line 2: x and y must both be integers"),
+            ("10 10\nA 1 2 Q F", "Line 2: Invalid car direction."),
+            ("10 10\nA 1 2 N FXF", "Line 2: Invalid Commands"),
+            ("10 10\nA 1 2", "Line 2: Please provide the name, x, y, direction and commands"),
+        ],
+    )
+    def test_invalid_scenarios(self, text, message):
+        """Test that invalid lines are reported with the add_car messages"""
+        with pytest.raises(ValueError, match=re.escape(message)):
+            parse_scenario(text)
+
+    def test_insert_car_uses_add_car_rules(self):
+        """Test that cars added without prompting are checked like typed ones"""
+        sim = Simulation(10, 10)
+        car = sim.insert_car("A", 1, 2, "n", "ffl")
+        assert (car.direction, car.commands) == ("N", "FFL")
+        assert sim.cars == [car]
+
+        with pytest.raises(ValueError, match="already exists"):
+            sim.insert_car("A", 3, 3, "N", "")
+        with pytest.raises(ValueError, match="already occupied"):
+            sim.insert_car("B", 1, 2, "N", "")
+        with pytest.raises(ValueError, match="cannot be empty"):
+            sim.insert_car("", 3, 3, "N", "")
+
+    @patch("builtins.input", side_effect=["Car1", "Car2", "1 1 N", "3 3 X", "3 3 S", "FZ", "FL"])
+    def test_add_car_reprompts(self, mock_input, capsys):
+        """Test that add_car still prints each message and asks again"""
+        sim = Simulation(10, 10)
+        sim.cars = [Car(1, 1, "N", "Car1", "")]
+        sim.add_car()
+
+        out = capsys.readouterr().out
+        assert "A car with that name already exists" in out
+        assert "The location (1,1) is already occupied by another car." in out
+        assert "Invalid car direction." in out
+        assert "Invalid Commands" in out
+        assert str(sim.cars[1]) == "- Car2, (3,3), S , FL"
+
+    def test_headless_run(self, tmp_path, capsys):
+        """Test running a scenario file from the command line"""
+        scenario = tmp_path / "scenario.txt"
+        scenario.write_text("10 10\nA 1 2 N FFRFFFFRRL\nB 7 8 W FFLFFFFFFF\n")
+        assert carsimulation.main([str(scenario), "--engine", "trajectory"]) == 0
+        assert capsys.readouterr().out.splitlines() == [
+            "After simulation, the result is:",
+            "- A, collides with B at (5,4) at step 7",
+            "- B, collides with A at (5,4) at step 7",
+        ]
+
+    def test_headless_invalid_file(self, tmp_path, capsys):
+        """Test that an invalid scenario file is reported on stderr"""
+        scenario = tmp_path / "scenario.txt"
+        scenario.write_text("10 10\nA 1 2 N F\nA 2 2 N F\n")
+        assert carsimulation.main([str(scenario)]) == 1
+        assert "Line 3" in capsys.readouterr().err
+
+    def test_large_scenario(self):
+        """Test that 50k cars load in one pass"""
+        lines = ["500 500"] + [f"C{i} {i % 500} {i // 500} E FFRFL" for i in range(50_000)]
+        sim = parse_scenario("\n".join(lines))
+        assert len(sim.cars) == 50_000
+        assert sim.cars[-1].name == "C49999"
+
+
+class TestSimulationIndexes:
+    def test_indexes_follow_assigned_cars(self):
+        """Test that replacing or appending to sim.cars keeps the checks in sync"""
+        sim = Simulation(10, 10)
+        sim.cars = [Car(1, 1, "N", "A", "")]
+        with pytest.raises(ValueError, match="already exists"):
+            sim.validate_name("A")
+
+        sim.cars.append(Car(2, 2, "N", "B", ""))
+        with pytest.raises(ValueError, match=re.escape("The location (2,2) is already occupied")):
+            sim.insert_car("C", 2, 2, "N", "")
+
+        sim.cars = [Car(5, 5, "N", "D", "")]
+        sim.insert_car("A", 1, 1, "N", "")
+        assert [car.name for car in sim.cars] == ["D", "A"]
+
+    def test_checks_do_not_scan_cars(self):
+        """Test that adding a car does not look at every existing car"""
+        sim = Simulation(300, 300)
+        for i in range(2_000):
+            sim.insert_car(f"C{i}", i % 300, i // 300, "N", "F")
+
+        class NoScan(list):
+            def __iter__(self):
+                raise AssertionError("cars were scanned")
+
+        sim._cars = NoScan(sim.cars)
+        sim.insert_car("New", 299, 299, "S", "")
+        with pytest.raises(ValueError, match="already exists"):
+            sim.insert_car("C5", 100, 100, "S", "")
+        with pytest.raises(ValueError, match="already occupied"):
+            sim.insert_car("Other", 0, 0, "S", "")
+
+    @patch("builtins.input", side_effect=["Car1", "Car2", "2 3 N", "4 4 N", "F"])
+    def test_add_car_uses_indexes(self, mock_input, capsys):
+        """Test that interactive and programmatic cars share the indexes"""
+        sim = Simulation(10, 10)
+        sim.insert_car("Car1", 2, 3, "E", "")
+        sim.add_car()
+        out = capsys.readouterr().out
+        assert "A car with that name already exists" in out
+        assert "The location (2,3) is already occupied by another car." in out
+        with pytest.raises(ValueError, match="already exists"):
+            sim.insert_car("Car2", 9, 9, "N", "")
+
+
+def random_scenario_text(seed):
+    """Scenario file text of a small random fleet"""
+    specs = random_specs(seed, 6, 6, 8, 15)
+    return "6 6\n" + "\n".join(f"{name} {x} {y} {d} {commands}" for name, x, y, d, commands in specs)
+
+
+class TestBatchRunner:
+    def test_results(self):
+        """Test that results hold the final state of every car"""
+        sim = build_simulation(10, 10, [("A", 2, 2, "N", "F"), ("B", 2, 4, "S", "F"), ("C", 0, 0, "E", "FL")])
+        sim.simulate()
+        car_a, car_b, car_c = sim.results()
+        assert car_a == CarResult("A", 2, 3, "N", ("B",), 1)
+        assert car_a.collided
+        assert car_c == CarResult("C", 1, 0, "N", (), None)
+        assert not car_c.collided
+        assert car_b.collided_with == ("A",)
+
+    def test_ordered_batch(self):
+        """Test that an ordered batch yields every scenario's results in input order"""
+        scenarios = [random_scenario_text(seed) for seed in range(40)]
+        results = list(run_batch(scenarios, workers=2, chunk_size=3))
+        assert [index for index, _ in results] == list(range(40))
+        for index, car_results in results:
+            assert car_results == run_scenario(scenarios[index])
+
+    def test_completion_order_batch(self):
+        """Test that an unordered batch still yields every scenario exactly once"""
+        scenarios = [build_simulation(6, 6, random_specs(seed, 6, 6, 8, 15)) for seed in range(25)]
+        expected = [run_scenario(build_simulation(6, 6, random_specs(seed, 6, 6, 8, 15))) for seed in range(25)]
+        results = dict(run_batch(iter(scenarios), workers=2, chunk_size=4, ordered=False, engine="trajectory"))
+        assert sorted(results) == list(range(25))
+        assert [results[index] for index in range(25)] == expected
+
+    def test_unknown_engine(self):
+        """Test that an unknown engine is rejected before any worker starts"""
+        with pytest.raises(ValueError):
+            list(run_batch([], engine="abacus"))
+
+
+def clustered_specs(seed, n_clusters, per_cluster, spacing):
+    """Random fleets of small neighbourhoods spaced far apart on one grid"""
+    specs = []
+    for cluster in range(n_clusters):
+        origin = cluster * spacing
+        for name, x, y, direction, commands in random_specs(seed * 100 + cluster, 6, 6, per_cluster, 8):
+            specs.append((f"K{cluster}{name}", origin + x, origin + y, direction, commands))
+    return specs
+
+
+class TestPartitioning:
+    def test_path_box(self):
+        """Test that a path box covers exactly the cells a car drives over"""
+        car = Car(2, 2, "N", "A", "FFRFFFRFFFFFFFL")
+        assert path_box(car, 10, 10) == (2, 0, 5, 4)
+
+    def test_components(self):
+        """Test that cars are grouped only with cars whose paths they may cross"""
+        cars = [
+            Car(0, 0, "N", "A", "FFF"),
+            Car(9, 9, "S", "B", "F"),
+            Car(2, 2, "W", "C", "FF"),
+            Car(5, 5, "E", "D", ""),
+            Car(9, 7, "N", "E", "F"),
+        ]
+        assert interaction_components(cars, 10, 10) == [[0, 2], [1, 4], [3]]
+
+    def test_state_round_trip(self):
+        """Test that a fleet state can be copied onto fresh cars"""
+        specs = [("A", 2, 2, "N", "FF"), ("B", 2, 4, "S", "FF"), ("C", 0, 0, "E", "FL")]
+        sim = build_simulation(10, 10, specs)
+        sim.simulate()
+
+        copy = build_simulation(10, 10, specs)
+        copy.set_state(sim.get_state())
+        assert copy.results() == sim.results()
+        assert copy.cars[0].collision is copy.cars[1].collision
+
+    @pytest.mark.parametrize("seed", range(4))
+    def test_matches_reference(self, capsys, seed):
+        """Test that simulating the components apart reports exactly what one run does"""
+        specs = clustered_specs(seed, 6, 10, 20)
+        build_simulation(120, 120, specs).run_simulation(engine="partitioned", workers=2)
+        assert capsys.readouterr().out.splitlines() == reference_report(120, 120, specs)
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_idle_cars_on_one_cell(self, workers):
+        """Test that cars without commands starting on one cell collide once the rest of the fleet moves"""
+        specs = [("A", 0, 0, "N", "FF"), ("B", 20, 20, "E", ""), ("C", 20, 20, "S", ""), ("D", 30, 5, "W", ""), ("E", 30, 5, "N", "")]
+        sim = build_simulation(40, 40, specs)
+        run_partitioned(sim, workers)
+        assert sim.results() == incremental_results(40, 40, specs)
+        assert sim.cars[1].collided_with == ["C"] and sim.cars[1].collision_step == 1
+
+    def test_in_process(self, capsys):
+        """Test running every component in this process"""
+        specs = clustered_specs(7, 3, 12, 10)
+        build_simulation(40, 40, specs).run_simulation(engine="partitioned", workers=1)
+        assert capsys.readouterr().out.splitlines() == reference_report(40, 40, specs)
+
+
+class TestSharding:
+    def test_tile_edges(self):
+        """Test that tiles split an axis into near-equal parts"""
+        assert tile_edges(10, 3) == [0, 3, 6, 10]
+        assert tile_edges(2, 5) == [0, 1, 2]
+
+    def test_car_crosses_tiles(self):
+        """Test that a car driving over several tiles is handed off and still collides"""
+        sim = build_simulation(
+            20, 4, [("A", 0, 0, "E", "F" * 19), ("B", 19, 0, "N", "")]
+        )
+        run_sharded(sim, workers=2, tiles=(4, 1), halo=3)
+        assert sim.results() == [
+            CarResult("A", 19, 0, "E", ("B",), 19),
+            CarResult("B", 19, 0, "N", ("A",), 19),
+        ]
+
+    @pytest.mark.parametrize("seed", range(6))
+    def test_matches_reference(self, capsys, seed):
+        """Test that small tiles and halos report exactly what one run does"""
+        specs = random_specs(seed, 16, 12, 40, 30)
+        sim = build_simulation(16, 12, specs)
+        run_sharded(sim, workers=2, tiles=(3, 2), halo=1 + seed % 4)
+        sim.display_results()
+        assert capsys.readouterr().out.splitlines() == reference_report(16, 12, specs)
+
+
+class TestEventStream:
+    def test_collisions_as_they_happen(self):
+        """Test that each collision is yielded once, with its cell and step"""
+        sim = build_simulation(
+            10, 10, [("A", 2, 2, "N", "FF"), ("B", 2, 4, "S", "FF"), ("C", 0, 0, "E", "FFF")]
+        )
+        events = list(sim.iter_events())
+        assert len(events) == 1
+        assert events[0].position == (2, 3)
+        assert events[0].step == 1
+        assert events[0] is sim.cars[0].collision
+
+    def test_move_events(self):
+        """Test that move events replay every command up to the final positions"""
+        specs = random_specs(3, 8, 8, 10, 20)
+        sim = build_simulation(8, 8, specs)
+        final = {}
+        steps = []
+        for event in sim.iter_events(moves=True):
+            if isinstance(event, MoveEvent):
+                final[event.index] = (event.x, event.y, event.direction)
+                steps.append(event.step)
+        assert steps == sorted(steps)
+        for index, car in enumerate(sim.cars):
+            if index in final:
+                assert final[index] == (car.x, car.y, car.direction)
+
+    def test_lone_car_move_events(self):
+        """Test that a lone car is stepped one command at a time when moves are asked for"""
+        sim = build_simulation(10, 10, [("A", 0, 0, "N", "F"), ("B", 5, 5, "N", "FFRFF")])
+        events = list(sim.iter_events(moves=True))
+        assert [event.step for event in events if event.index == 1] == [1, 2, 3, 4, 5]
+        assert events[-1] == MoveEvent(5, 1, 7, 7, 1)
+
+    def test_stop_early(self):
+        """Test that stopping at the first collision leaves the other cars at that step"""
+        sim = build_simulation(
+            10, 10, [("A", 2, 2, "N", "FF"), ("B", 2, 4, "S", "FF"), ("C", 0, 0, "N", "FFFF")]
+        )
+        for event in sim.iter_events():
+            break
+        assert event.step == 1
+        assert (sim.cars[2].x, sim.cars[2].y) == (0, 1)
+
+    @pytest.mark.parametrize("engine", Simulation.ENGINES)
+    @pytest.mark.parametrize(
+        "size, specs",
+        [
+            (10, random_specs(5, 10, 10, 30, 25)),
+            # cars without commands on one cell, far from the only car that moves
+            (100, [("A", 0, 0, "N", "FF"), ("B", 90, 90, "E", ""), ("C", 90, 90, "S", ""), ("D", 90, 90, "W", "")]),
+        ],
+    )
+    def test_engines_yield_same_collisions(self, engine, size, specs):
+        """Test that every engine yields the collisions of the loop engine in step order"""
+        require_engine(engine)
+
+        def collisions(engine):
+            # several workers, so the partitioned and sharded engines split the fleet
+            events = build_simulation(size, size, specs).iter_events(engine, workers=4)
+            return sorted(
+                (event.step, event.position, [car.name for car in event.cars]) for event in events
+            )
+
+        steps = [event.step for event in build_simulation(size, size, specs).iter_events(engine, workers=4)]
+        assert steps == sorted(steps)
+        assert collisions(engine) == collisions("loop")
+
+    def test_moves_need_loop_engine(self):
+        """Test that move events are refused for engines that do not step"""
+        sim = build_simulation(10, 10, [("A", 0, 0, "N", "F")])
+        with pytest.raises(ValueError):
+            next(sim.iter_events("trajectory", moves=True))
+
+
+class TestTrajectoryRecorder:
+    def test_frames_follow_each_step(self, tmp_path):
+        """Test that every frame holds where each car was after that step"""
+        specs = [("A", 0, 0, "N", "FFRFF"), ("B", 5, 5, "W", "LF"), ("C", 9, 9, "E", "")]
+        path = tmp_path / "run.log"
+        build_simulation(10, 10, specs).run_simulation(recorder=TrajectoryRecorder(path))
+
+        # no collisions, so every car follows its own commands
+        expected = []
+        cars = [Car(x, y, direction, name, commands) for name, x, y, direction, commands in specs]
+        for step in range(6):
+            expected.append([(car.x, car.y, car.direction) for car in cars])
+            for car in cars:
+                if step < len(car.commands):
+                    car.move(car.commands[step], 10, 10)
+
+        with TrajectoryLog(path) as log:
+            assert (log.car_count, log.width, log.height, log.steps) == (3, 10, 10, 5)
+            assert [log.frame(step) for step in range(6)] == expected
+            assert log.position(0, 3) == (0, 2, "E")
+            assert log.position(2, 5) == (9, 9, "E")
+
+    @pytest.mark.parametrize("seed", range(3))
+    def test_last_frame_matches_results(self, tmp_path, capsys, seed):
+        """Test that recording leaves the report unchanged and ends on the final positions"""
+        specs = random_specs(seed, 8, 8, 20, 25)
+        sim = build_simulation(8, 8, specs)
+        sim.run_simulation(recorder=TrajectoryRecorder(tmp_path / "run.log"))
+        assert capsys.readouterr().out.splitlines() == reference_report(8, 8, specs)
+
+        with TrajectoryLog(tmp_path / "run.log") as log:
+            assert log.steps <= max(len(spec[4]) for spec in specs)
+            assert log.frame(log.steps) == [(car.x, car.y, car.direction) for car in sim.cars]
+            frame = log.frame_bytes(log.steps)
+            assert len(frame) == RECORD.size * len(specs)
+            frame.release()
+
+    def test_out_of_range(self, tmp_path):
+        """Test that steps and cars outside the log are refused"""
+        path = tmp_path / "run.log"
+        build_simulation(10, 10, [("A", 0, 0, "N", "F")]).run_simulation(
+            recorder=TrajectoryRecorder(path)
+        )
+        with TrajectoryLog(path) as log:
+            with pytest.raises(IndexError):
+                log.position(0, 2)
+            with pytest.raises(IndexError):
+                log.position(1, 0)
+
+    def test_not_a_log(self, tmp_path):
+        """Test that other files are not read as logs"""
+        path = tmp_path / "other.bin"
+        path.write_bytes(b"0" * 64)
+        with pytest.raises(ValueError):
+            TrajectoryLog(path)
+
+    def test_record_from_command_line(self, tmp_path, capsys):
+        """Test recording a headless run"""
+        scenario = tmp_path / "scenario.txt"
+        scenario.write_text("10 10\nA 1 2 N FFRFFFFRRL\nB 7 8 W FFLFFFFFFF\n")
+        path = tmp_path / "run.log"
+        assert carsimulation.main([str(scenario), "--record", str(path)]) == 0
+        with TrajectoryLog(path) as log:
+            assert log.position(0, 7) == (5, 4, "E")
+            assert log.position(1, 7) == (5, 4, "S")
+            # both cars stopped at step 7, so nothing changes after it
+            assert log.steps == 7
+
+    def test_record_needs_loop_engine(self, tmp_path, capsys):
+        """Test that recording with an engine that does not step is reported"""
+        scenario = tmp_path / "scenario.txt"
+        scenario.write_text("10 10\nA 1 2 N F\n")
+        args = [str(scenario), "--engine", "trajectory", "--record", str(tmp_path / "run.log")]
+        assert carsimulation.main(args) == 1
+        assert "loop engine" in capsys.readouterr().err
+
+
+class TestCheckpoints:
+    def test_round_trip(self, tmp_path):
+        """Test that a saved state loads back unchanged"""
+        sim = build_simulation(
+            10, 10, [("A", 2, 2, "N", "FF"), ("B", 2, 4, "S", "FF"), ("C", 0, 0, "E", "F")]
+        )
+        sim.simulate()
+        save_checkpoint(tmp_path / "run.ckpt", 2, sim.get_state())
+        checkpoint = load_checkpoint(tmp_path / "run.ckpt")
+        assert checkpoint.step == 2
+        assert checkpoint.state == sim.get_state()
+
+    @pytest.mark.parametrize("seed", range(4))
+    def test_resume_from_every_checkpoint(self, tmp_path, capsys, seed):
+        """Test that carrying on from any checkpoint reports exactly what one run does"""
+        specs = random_specs(seed, 8, 8, 20, 30)
+        expected = reference_report(8, 8, specs)
+
+        class KeepAll(Checkpointer):
+            def step_done(self, simulation, step):
+                save_checkpoint(tmp_path / f"{step}.ckpt", step, simulation.get_state())
+
+        sim = build_simulation(8, 8, specs)
+        for _ in sim.iter_events(checkpointer=KeepAll(tmp_path / "unused", 1)):
+            pass
+
+        steps = sorted(int(path.stem) for path in tmp_path.glob("*.ckpt"))
+        assert steps
+        for step in steps:
+            resumed = build_simulation(8, 8, specs)
+            resumed.run_simulation(resume=tmp_path / f"{step}.ckpt")
+            assert capsys.readouterr().out.splitlines() == expected
+
+    def test_resume_over_finished_run(self, tmp_path, capsys):
+        """Test that resuming a finished simulation clears collisions from after the checkpoint"""
+        specs = [("A", 0, 0, "E", "FFFF"), ("B", 4, 0, "W", "FFFF"), ("C", 9, 9, "S", "FFFFF")]
+        path = tmp_path / "run.ckpt"
+        # stop as soon as step 2 starts, the checkpoint then holds step 1
+        events = build_simulation(10, 10, specs).iter_events(
+            moves=True, checkpointer=Checkpointer(path, 1)
+        )
+        for event in events:
+            if event.step == 2:
+                break
+        assert load_checkpoint(path).step == 1
+
+        sim = build_simulation(10, 10, specs)
+        sim.run_simulation()
+        expected = capsys.readouterr().out.splitlines()
+        assert sim.cars[0].collision_step == 2
+
+        sim.run_simulation(resume=path)
+        assert capsys.readouterr().out.splitlines() == expected == reference_report(10, 10, specs)
+
+    def test_checkpoint_interval(self, tmp_path):
+        """Test that checkpoints are only written every few steps"""
+        sim = build_simulation(10, 10, [("A", 0, 0, "N", "F" * 7), ("B", 5, 0, "N", "F" * 7)])
+        with patch("checkpoint.save_checkpoint") as save:
+            for _ in sim.iter_events(checkpointer=Checkpointer(tmp_path / "run.ckpt", 3)):
+                pass
+        assert [call.args[1] for call in save.call_args_list] == [3, 6]
+
+    def test_wrong_simulation(self, tmp_path):
+        """Test that a checkpoint of another fleet is refused"""
+        sim = build_simulation(10, 10, [("A", 0, 0, "N", "F")])
+        save_checkpoint(tmp_path / "run.ckpt", 1, sim.get_state())
+        other = build_simulation(10, 10, [("A", 0, 0, "N", "F"), ("B", 1, 1, "N", "F")])
+        with pytest.raises(ValueError):
+            other.restore_checkpoint(tmp_path / "run.ckpt")
+
+    def test_not_a_checkpoint(self, tmp_path):
+        """Test that other files are not read as checkpoints"""
+        (tmp_path / "other.bin").write_bytes(b"not a checkpoint")
+        with pytest.raises(ValueError):
+            load_checkpoint(tmp_path / "other.bin")
+
+    def test_resume_from_command_line(self, tmp_path, capsys):
+        """Test checkpointing and resuming a headless run"""
+        scenario = tmp_path / "scenario.txt"
+        scenario.write_text("10 10\nA 1 2 N FFRFFFFRRL\nB 7 8 W FFLFFFFFFF\n")
+        path = str(tmp_path / "run.ckpt")
+        args = [str(scenario), "--checkpoint", path, "--checkpoint-every", "5"]
+        assert carsimulation.main(args) == 0
+        expected = capsys.readouterr().out
+        assert load_checkpoint(path).step == 5
+        assert carsimulation.main(args + ["--resume"]) == 0
+        assert capsys.readouterr().out == expected
+
+    def test_resume_refuses_recorder(self, tmp_path, capsys):
+        """Test that a resumed run cannot record a trajectory, its log would start mid-run"""
+        scenario = tmp_path / "scenario.txt"
+        scenario.write_text("10 10\nA 1 2 N FFRFFFFRRL\n")
+        path = str(tmp_path / "run.ckpt")
+        assert carsimulation.main([str(scenario), "--checkpoint", path, "--checkpoint-every", "5"]) == 0
+        sim = build_simulation(10, 10, [("A", 1, 2, "N", "FFRFFFFRRL")])
+        with pytest.raises(ValueError):
+            sim.run_simulation(recorder=TrajectoryRecorder(tmp_path / "run.log"), resume=path)
+        assert not (tmp_path / "run.log").exists()
+        with pytest.raises(SystemExit):
+            carsimulation.main([str(scenario), "--checkpoint", path, "--resume", "--record", str(tmp_path / "run.log")])
+
+    def test_checkpoints_need_loop_engine(self):
+        """Test that engines that do not step refuse checkpoints"""
+        sim = build_simulation(10, 10, [("A", 0, 0, "N", "F")])
+        with pytest.raises(ValueError):
+            next(sim.iter_events("trajectory", start_step=1))
+
+
+def incremental_results(width, height, specs):
+    """Results of a fresh simulation of the specs"""
+    sim = build_simulation(width, height, specs)
+    sim.simulate()
+    return sim.results()
+
+
+class TestIncrementalSimulation:
+    def test_append_without_meeting(self):
+        """Test that a path that meets no other car is applied without running anything again"""
+        specs = [("A", 0, 0, "N", "FF"), ("B", 5, 5, "E", "FF")]
+        inc = IncrementalSimulation(build_simulation(10, 10, specs), snapshot_every=1)
+        inc.run()
+        with patch.object(Car, "move", autospec=True, side_effect=Car.move) as mock_move:
+            assert inc.append_commands("A", "RFF") == NEVER
+        assert mock_move.call_count == 0
+        assert inc.simulation.results() == incremental_results(
+            10, 10, [("A", 0, 0, "N", "FFRFF"), ("B", 5, 5, "E", "FF")]
+        )
+
+    def test_append_runs_from_snapshot(self):
+        """Test that the run carries on from the last snapshot before the new path meets a car"""
+        specs = [("A", 0, 0, "E", "F"), ("B", 5, 0, "N", "F" * 8), ("C", 9, 9, "S", "")]
+        inc = IncrementalSimulation(build_simulation(10, 10, specs), snapshot_every=2)
+        inc.run()
+        # A drives up B's column into B, parked at (5,8) since step 8
+        assert inc.append_commands("A", "FFFFL" + "F" * 8) == 8
+        specs[0] = ("A", 0, 0, "E", "FFFFFL" + "F" * 8)
+        assert inc.simulation.results() == incremental_results(10, 10, specs)
+        assert inc.simulation.cars[0].collision_step == 14
+
+    def test_append_to_car_hit_while_parked(self):
+        """Test that a parked car that drives off before it is hit is not hit"""
+        specs = [("A", 3, 0, "N", "F"), ("B", 0, 1, "E", "FFFF")]
+        inc = IncrementalSimulation(build_simulation(10, 10, specs), snapshot_every=1)
+        inc.run()
+        assert inc.simulation.cars[0].collision_step == 3
+        inc.append_commands("A", "F")
+        specs[0] = ("A", 3, 0, "N", "FF")
+        assert inc.simulation.results() == incremental_results(10, 10, specs)
+        assert not inc.simulation.cars[0].collided
+
+    def test_add_car(self):
+        """Test adding a car that drives into another"""
+        specs = [("A", 0, 0, "E", "FFFF"), ("B", 9, 9, "S", "FF")]
+        inc = IncrementalSimulation(build_simulation(10, 10, specs), snapshot_every=1)
+        inc.run()
+        assert inc.add_car("C", 2, 2, "S", "FF") == 1
+        specs.append(("C", 2, 2, "S", "FF"))
+        assert inc.simulation.results() == incremental_results(10, 10, specs)
+
+    def test_edit_checks(self):
+        """Test that edits are checked like new cars and commands"""
+        inc = IncrementalSimulation(build_simulation(10, 10, [("A", 0, 0, "N", "F")]))
+        inc.run()
+        with pytest.raises(ValueError):
+            inc.append_commands("B", "F")
+        with pytest.raises(ValueError):
+            inc.append_commands("A", "X")
+        with pytest.raises(ValueError):
+            inc.add_car("B", 0, 0, "N", "F")
+
+    @pytest.mark.parametrize("seed", range(20))
+    def test_random_edits(self, seed):
+        """Test that random edits give the same results as running from scratch"""
+        rng = random.Random(seed)
+        specs = random_specs(seed, 7, 7, 12, 15)
+        free = sorted(set(range(49)) - {x * 7 + y for _, x, y, _, _ in specs})
+        inc = IncrementalSimulation(build_simulation(7, 7, specs), snapshot_every=rng.randint(1, 4))
+        inc.run()
+        for edit in range(4):
+            commands = "".join(rng.choice("FFFLR") for _ in range(rng.randint(0, 10)))
+            if edit % 2:
+                cell = free.pop(rng.randrange(len(free)))
+                spec = (f"N{edit}", cell // 7, cell % 7, rng.choice("NESW"), commands)
+                inc.add_car(*spec)
+                specs.append(spec)
+            else:
+                index = rng.randrange(len(specs))
+                inc.append_commands(specs[index][0], commands)
+                specs[index] = (*specs[index][:4], specs[index][4] + commands)
+            assert inc.simulation.results() == incremental_results(7, 7, specs)
+
+
+def candidate_collision_step(width, height, specs, commands):
+    """Collision step of the first car of the specs run with other commands, NEVER if none"""
+    name, x, y, direction, _ = specs[0]
+    sim = build_simulation(width, height, [(name, x, y, direction, commands), *specs[1:]])
+    sim.simulate()
+    return sim.cars[0].collision_step or NEVER
+
+
+class TestWhatIfEvaluator:
+    def test_candidates(self):
+        """Test scoring candidates against fixed traffic"""
+        specs = [("X", 0, 0, "E", ""), ("A", 3, 3, "S", "FFF"), ("B", 9, 0, "W", "")]
+        evaluator = WhatIfEvaluator(build_simulation(10, 10, specs), "X")
+        # A parks on (3,0) at step 3: stop short of it, meet it there, cross behind it into parked B
+        candidates = ["LRFF", "FFF", "LFR" + "F" * 9 + "RF", "LFR" + "F" * 8]
+        assert evaluator.evaluate(candidates, workers=1) == [NEVER, 3, 14, NEVER]
+        assert evaluator.safe(candidates, workers=1) == ["LRFF", "LFR" + "F" * 8]
+        assert evaluator.first_collision("fff") == 3
+
+    def test_car_left_out_of_traffic(self):
+        """Test that the car's own commands play no part"""
+        specs = [("X", 0, 0, "N", "RFFFF"), ("A", 2, 0, "N", "")]
+        evaluator = WhatIfEvaluator(build_simulation(10, 10, specs), "X")
+        assert evaluator.first_collision("F") == NEVER
+
+    def test_unknown_car(self):
+        """Test that only cars in the simulation can be evaluated"""
+        with pytest.raises(ValueError):
+            WhatIfEvaluator(build_simulation(10, 10, [("A", 0, 0, "N", "F")]), "B")
+
+    @pytest.mark.parametrize("seed", range(10))
+    def test_matches_full_runs(self, seed):
+        """Test that every score is the collision step of a full run with that candidate"""
+        rng = random.Random(seed)
+        specs = random_specs(seed, 7, 7, 12, 20)
+        evaluator = WhatIfEvaluator(build_simulation(7, 7, specs), specs[0][0])
+        candidates = [
+            "".join(rng.choice("FFFLR") for _ in range(rng.randint(0, 25))) for _ in range(40)
+        ]
+        expected = [candidate_collision_step(7, 7, specs, commands) for commands in candidates]
+        assert evaluator.evaluate(candidates, workers=1) == expected
+        assert evaluator.evaluate(candidates, workers=2, chunk_size=8) == expected
+
+
+class TestBenchmark:
+    @pytest.mark.parametrize("name", benchmark.WORKLOADS)
+    def test_workloads_are_valid(self, name):
+        """Test that every workload builds through the same checks as the prompts"""
+        width, height, specs = benchmark.WORKLOADS[name](random.Random(0), 0.01)
+        sim = benchmark.build(width, height, specs)
+        assert len(sim.cars) == len(specs) > 0
+
+    def test_run_workload(self):
+        """Test that a run reports its timings and counts"""
+        result = benchmark.run_workload("dense", scale=0.01, repeat=1)
+        assert result["cars"] == 20
+        assert result["commands"] == 20 * 50
+        assert result["run_s"] > 0 and result["peak_mb"] > 0
+
+    def test_compare(self):
+        """Test that only slowdowns beyond the tolerance are flagged"""
+        baseline = {"dense": {"setup_s": 1.0, "run_s": 1.0, "peak_mb": 10.0}}
+        results = {
+            "dense": {"setup_s": 1.1, "run_s": 2.0, "peak_mb": 10.0},
+            "new": {"setup_s": 1.0, "run_s": 1.0, "peak_mb": 1.0},
+        }
+        assert benchmark.compare(results, baseline, 0.25) == ["dense run_s: 1.000 -> 2.000"]
+
+    def test_baseline_round_trip(self, tmp_path, capsys):
+        """Test saving a baseline and comparing against it"""
+        baseline = str(tmp_path / "baseline.json")
+        args = ["dense", "--scale", "0.01", "--repeat", "1", "--baseline", baseline]
+        assert benchmark.main(args) == 0
+        assert "No baseline" in capsys.readouterr().err
+        assert benchmark.main(args + ["--save-baseline"]) == 0
+        assert benchmark.main(args + ["--tolerance", "1000"]) == 0
+        captured = capsys.readouterr()
+        assert "dense" in captured.out and "steps/s" in captured.out
+        assert not captured.err
+
+
+class TestProfiler:
+    def test_step_counters(self):
+        """Test that each step records cars moved, cells checked, collisions and idle cars"""
+        sim = build_simulation(
+            10, 10, [("A", 2, 2, "N", "FF"), ("B", 2, 4, "S", "FF"), ("C", 0, 0, "E", "FFF")]
+        )
+        sim.profiler = Profiler()
+        sim.simulate()
+        # A and B collide at step 1, C then runs alone, only the cell A and B share is checked
+        assert list(sim.profiler.steps) == [1]
+        assert sim.profiler.totals() == {"moved": 3, "checked": 1, "collisions": 1, "idle": 0}
+        assert set(sim.profiler.phases) == {"setup", "move", "collisions", "fast_forward"}
+
+    def test_idle_cars(self):
+        """Test that cars that stopped are counted as skipped"""
+        sim = build_simulation(
+            10, 10, [("A", 0, 0, "N", "F"), ("B", 5, 5, "N", "FFF"), ("C", 9, 0, "N", "FFF")]
+        )
+        sim.profiler = Profiler()
+        sim.simulate()
+        assert list(sim.profiler.counters["idle"]) == [0, 1, 1]
+        assert list(sim.profiler.counters["moved"]) == [3, 2, 2]
+
+    @pytest.mark.parametrize("engine", Simulation.ENGINES)
+    def test_phases(self, capsys, engine):
+        """Test that the engine and the report are timed"""
+        require_engine(engine)
+        sim = build_simulation(10, 10, [("A", 0, 0, "N", "FF"), ("B", 5, 5, "N", "FF")])
+        sim.profiler = Profiler()
+        sim.run_simulation(engine=engine)
+        assert "report" in sim.profiler.phases
+        assert ("move" if engine == "loop" else engine) in sim.profiler.phases
+        assert all(seconds >= 0 for _, seconds in sim.profiler.phases.values())
+
+    def test_exports(self, tmp_path):
+        """Test the JSON and pstats exports"""
+        sim = build_simulation(10, 10, [("A", 0, 0, "N", "FF"), ("B", 5, 5, "N", "FF")])
+        sim.profiler = Profiler()
+        sim.simulate()
+        sim.profiler.write_json(tmp_path / "run.json")
+        data = json.loads((tmp_path / "run.json").read_text())
+        assert data["steps"] == [1, 2]
+        assert data["counters"]["moved"] == [2, 2]
+        assert data["phases"]["move"]["calls"] == 2
+
+        sim.profiler.write_pstats(tmp_path / "run.prof")
+        stats = pstats.Stats(str(tmp_path / "run.prof"))
+        assert {name for _, _, name in stats.stats} == set(sim.profiler.phases)
+
+    def test_profile_from_command_line(self, tmp_path, capsys):
+        """Test profiling a headless run"""
+        scenario = tmp_path / "scenario.txt"
+        scenario.write_text("10 10\nA 1 2 N FFRFFFFRRL\nB 7 8 W FFLFFFFFFF\n")
+        assert carsimulation.main([str(scenario), "--profile", str(tmp_path / "run.json")]) == 0
+        assert json.loads((tmp_path / "run.json").read_text())["totals"]["collisions"] == 1
+
+
+class TestReport:
+    SPECS = [("A", 2, 2, "N", "FF"), ("B", 2, 4, "S", "FF"), ("C, the third", 0, 0, "E", "FFL")]
+
+    def run(self, **kwargs):
+        """Report of the specs in a given format"""
+        output = io.StringIO()
+        sim = build_simulation(10, 10, self.SPECS)
+        sim.run_simulation(output=output, **kwargs)
+        return output.getvalue()
+
+    def test_text_matches_printed_report(self, capsys):
+        """Test that the buffered text report is the report the CLI prints"""
+        build_simulation(10, 10, self.SPECS).run_simulation()
+        assert self.run() == capsys.readouterr().out
+        assert self.run().splitlines() == reference_report(10, 10, self.SPECS)
+
+    def test_csv(self):
+        """Test one CSV row per car, with names quoted where needed"""
+        rows = list(csv.DictReader(io.StringIO(self.run(report_format="csv"))))
+        assert rows[0] == {
+            "name": "A",
+            "x": "2",
+            "y": "3",
+            "direction": "N",
+            "collided_with": "B",
+            "collision_step": "1",
+        }
+        assert rows[2]["name"] == "C, the third"
+        assert (rows[2]["x"], rows[2]["collided_with"], rows[2]["collision_step"]) == ("2", "", "")
+
+    def test_jsonl(self):
+        """Test one JSON object per car with the fields of CarResult"""
+        records = [json.loads(line) for line in self.run(report_format="jsonl").splitlines()]
+        sim = build_simulation(10, 10, self.SPECS)
+        sim.simulate()
+        for record in records:
+            record["collided_with"] = tuple(record["collided_with"])
+        assert [CarResult(**record) for record in records] == sim.results()
+
+    def test_few_large_writes(self):
+        """Test that the report is written a chunk of cars at a time"""
+        sim = build_simulation(10, 10, random_specs(0, 10, 10, 50, 5))
+        sim.simulate()
+        output = io.StringIO()
+        with patch.object(output, "write", wraps=output.write) as write:
+            write_report(sim.cars, output, chunk_size=20)
+        assert write.call_count == 3
+        assert output.getvalue().count("\n") == 51
+
+    def test_empty_report(self):
+        """Test that a report without cars still has its header"""
+        output = io.StringIO()
+        write_report([], output, "csv")
+        assert output.getvalue() == "name,x,y,direction,collided_with,collision_step\n"
+
+    def test_unknown_format(self):
+        """Test that an unknown format is refused before running"""
+        sim = build_simulation(10, 10, self.SPECS)
+        with pytest.raises(ValueError):
+            sim.run_simulation(report_format="xml")
+        assert not sim.cars[0].collided
+
+    def test_output_file_from_command_line(self, tmp_path, capsys):
+        """Test writing the results of a headless run to a file"""
+        scenario = tmp_path / "scenario.txt"
+        scenario.write_text("10 10\nA 1 2 N FFRFFFFRRL\nB 7 8 W FFLFFFFFFF\n")
+        output = tmp_path / "results.csv"
+        assert carsimulation.main([str(scenario), "--format", "csv", "--output", str(output)]) == 0
+        assert capsys.readouterr().out == ""
+        assert output.read_text().splitlines()[1] == "A,5,4,E,B,7"
+
+
+def results_as_json(scenario, engine="loop"):
+    """The results of a scenario as the service sends them"""
+    return json.loads(json.dumps([result._asdict() for result in run_scenario(scenario, engine)]))
+
+
+class TestSimulationService:
+    def serve(self, service, **listen):
+        """Runs the service on an event loop in a background thread"""
+        loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        asyncio.run_coroutine_threadsafe(service.start(**listen), loop).result(timeout=60)
+        return loop, thread
+
+    def stop(self, service, loop, thread):
+        asyncio.run_coroutine_threadsafe(service.close(), loop).result(timeout=60)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    def test_pipelined_requests(self):
+        """Test that many requests sent at once are all answered, tagged with their ids"""
+        scenarios = [random_scenario_text(seed) for seed in range(30)]
+
+        async def exchange():
+            service = SimulationService(workers=2, max_pending=4)
+            await service.start()
+            host, port = service.address[:2]
+            reader, writer = await asyncio.open_connection(host, port)
+            for index, scenario in enumerate(scenarios):
+                engine = "trajectory" if index % 2 else "loop"
+                writer.write(json.dumps({"id": index, "scenario": scenario, "engine": engine}).encode() + b"\n")
+            await writer.drain()
+            responses = [json.loads(await reader.readline()) for _ in scenarios]
+            writer.close()
+            await service.close()
+            return service, responses
+
+        service, responses = asyncio.run(exchange())
+        assert sorted(response["id"] for response in responses) == list(range(30))
+        for response in responses:
+            assert response["results"] == results_as_json(scenarios[response["id"]])
+        assert service.completed == 30
+        assert 0 < service.peak_pending <= 4
+        assert service.pending == 0
+
+    def test_errors_are_answered(self):
+        """Test that bad requests get an error response and the connection keeps working"""
+
+        async def exchange():
+            service = SimulationService(workers=1)
+            await service.start()
+            reader, writer = await asyncio.open_connection(*service.address[:2])
+            for request in (b"not json", b'{"id": 1, "scenario": "0 0"}', b'{"id": 2, "scenario": "5 5", "engine": "abacus"}', b'{"id": 4}', b"[4]"):
+                writer.write(request + b"\n")
+            writer.write(json.dumps({"id": 3, "scenario": "5 5\nA 1 1 N F"}).encode() + b"\n")
+            responses = {}
+            for _ in range(6):
+                response = json.loads(await reader.readline())
+                responses[response["id"]] = response
+            writer.close()
+            await service.close()
+            return service, responses
+
+        service, responses = asyncio.run(exchange())
+        assert "error" in responses[None] and "error" in responses[1] and "abacus" in responses[2]["error"]
+        assert responses[3]["results"] == [{"name": "A", "x": 1, "y": 2, "direction": "N", "collided_with": [], "collision_step": None}]
+        assert responses[4]["error"].startswith('Please send the scenario text as "scenario"')
+        assert (service.completed, service.failed) == (1, 5)
+
+    def test_idle_connections_hold_no_slot(self):
+        """Test that connections waiting to send a request leave the slots to the ones that do"""
+
+        async def exchange():
+            service = SimulationService(workers=1, max_pending=2)
+            await service.start()
+            idle = [await asyncio.open_connection(*service.address[:2]) for _ in range(2)]
+            reader, writer = await asyncio.open_connection(*service.address[:2])
+            writer.write(b'{"id": 1, "stats": true}\n')
+            writer.write(json.dumps({"id": 2, "scenario": "5 5\nA 1 1 N F"}).encode() + b"\n")
+            responses = [json.loads(await asyncio.wait_for(reader.readline(), 30)) for _ in range(2)]
+            for _, idle_writer in idle:
+                idle_writer.close()
+            writer.close()
+            await service.close()
+            return responses
+
+        responses = {response["id"]: response for response in asyncio.run(exchange())}
+        assert responses[1]["stats"]["pending"] == 0
+        assert responses[2]["results"][0]["y"] == 2
+
+    def test_worker_failures_are_answered(self):
+        """Test that an unexpected error while running a scenario still gets an error response"""
+
+        async def exchange():
+            service = SimulationService(workers=1)
+            await service.start()
+            # a thread pool shares the patched worker function
+            service.executor.shutdown()
+            service.executor = ThreadPoolExecutor(max_workers=1)
+            reader, writer = await asyncio.open_connection(*service.address[:2])
+            with patch("service._run_request", side_effect=OverflowError("too far")):
+                writer.write(json.dumps({"id": 1, "scenario": "5 5\nA 1 1 N F"}).encode() + b"\n")
+                response = json.loads(await asyncio.wait_for(reader.readline(), 30))
+            writer.write(json.dumps({"id": 2, "scenario": "5 5\nA 1 1 N F"}).encode() + b"\n")
+            after = json.loads(await asyncio.wait_for(reader.readline(), 30))
+            writer.close()
+            await service.close()
+            return service, response, after
+
+        service, response, after = asyncio.run(exchange())
+        assert response == {"id": 1, "error": "too far"}
+        assert after["results"][0]["y"] == 2
+        assert (service.completed, service.failed, service.pending) == (1, 1, 0)
+
+    def test_dead_worker_is_replaced(self):
+        """Test that the service replaces its pool once a worker has been killed"""
+        service = SimulationService(workers=2)
+        loop, thread = self.serve(service)
+        try:
+            with ServiceClient(*service.address[:2]) as client:
+                scenario = random_scenario_text(3)
+                assert client.run(scenario) == results_as_json(scenario)
+                os.kill(next(iter(service.executor._processes)), signal.SIGKILL)
+                # the pool notices the death in its own thread
+                deadline = time.monotonic() + 30
+                while not service.executor._broken and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                assert client.run(scenario) == results_as_json(scenario)
+                assert client.run(scenario) == results_as_json(scenario)
+                stats = client.stats()
+        finally:
+            self.stop(service, loop, thread)
+        assert (stats["completed"], stats["failed"], stats["pool_restarts"]) == (3, 0, 1)
+
+    def test_client_and_stats(self):
+        """Test the blocking client against a running service, with its latency percentiles"""
+        service = SimulationService(workers=2)
+        loop, thread = self.serve(service)
+        try:
+            with ServiceClient(*service.address[:2]) as client:
+                assert client.stats()["completed"] == 0
+                for seed in range(5):
+                    assert client.run(random_scenario_text(seed), "numpy" if seed % 2 else "loop") == results_as_json(random_scenario_text(seed))
+                stats = client.stats()
+                with pytest.raises(ValueError):
+                    client.run("5 5\nA 9 9 N F")
+        finally:
+            self.stop(service, loop, thread)
+        assert (stats["completed"], stats["pending"], stats["workers"]) == (5, 0, 2)
+        assert 0 < stats["p50_ms"] <= stats["p90_ms"] <= stats["p99_ms"]
+
+    def test_unix_socket(self, tmp_path):
+        """Test serving on a Unix socket"""
+        path = str(tmp_path / "service.sock")
+        service = SimulationService(workers=1)
+        loop, thread = self.serve(service, path=path)
+        try:
+            with ServiceClient(path=path) as client:
+                assert client.run(random_scenario_text(7)) == results_as_json(random_scenario_text(7))
+        finally:
+            self.stop(service, loop, thread)
+
+    def test_localhost_only(self):
+        """Test that the service refuses to listen beyond the loopback interface"""
+        check_local("127.0.0.1")
+        check_local("::1")
+        check_local("localhost")
+        for host in ("0.0.0.0", "192.168.1.4", "example.com"):
+            with pytest.raises(ValueError):
+                check_local(host)
+
+
+def watch_fleet(name, steps):
+    """Reads consistent snapshots of a shared fleet from another process until its run is done"""
+    with FleetObserver(name) as observer:
+        while True:
+            snapshot = observer.snapshot()
+            steps.put((snapshot.step, snapshot.done))
+            if snapshot.done:
+                steps.put(tuple(snapshot))
+                return
+
+
+class TestSharedFleetState:
+    def fleet_state(self, sim):
+        return (
+            [car.x for car in sim.cars],
+            [car.y for car in sim.cars],
+            bytes(car.heading for car in sim.cars),
+            bytes(car.collided for car in sim.cars),
+        )
+
+    @pytest.mark.parametrize("engine", ["loop", "trajectory"])
+    def test_final_state(self, engine):
+        """Test that observers see the final fleet of random runs, whatever the engine"""
+        for seed in range(30):
+            sim = build_simulation(7, 7, random_specs(seed, 7, 7, 10, 20))
+            with SharedFleetState(sim.cars, 7, 7) as state, FleetObserver(state.name) as observer:
+                sim.shared_state = state
+                assert (observer.car_count, observer.width, observer.height) == (10, 7, 7)
+                sim.simulate(engine)
+                snapshot = observer.snapshot()
+                assert snapshot.done
+                assert (snapshot.x, snapshot.y, snapshot.heading, snapshot.collided) == self.fleet_state(sim)
+
+    def test_every_step(self):
+        """Test that the block matches the fleet after every step of the loop engine"""
+        sim = build_simulation(10, 10, [("A", 2, 2, "N", "FFRFF"), ("B", 2, 4, "S", "F"), ("C", 6, 6, "W", "FFFFFFFF")])
+        with SharedFleetState(sim.cars, 10, 10) as state, FleetObserver(state.name) as observer:
+            sim.shared_state = state
+            assert observer.snapshot().x == [2, 2, 6]
+            steps = []
+            for event in sim.iter_events(moves=True):
+                if isinstance(event, MoveEvent) and event.index == 2:
+                    # the last car moves last, so every other car has finished the step before
+                    steps.append((observer.step, observer.snapshot()[2:]))
+            assert [step for step, _ in steps] == list(range(8))
+            assert steps[2][1] == ([2, 2, 4], [3, 3, 6], bytes([0, 2, 3]), bytes([1, 1, 0]))
+            assert observer.snapshot()[2:] == self.fleet_state(sim)
+            assert observer.step == 8 and observer.done
+
+    def test_concurrent_attaches(self):
+        """Test observers attaching from many threads at once, the resource tracker is left as it was"""
+        register = resource_tracker.register
+        sim = build_simulation(5, 5, [("A", 1, 1, "N", "F"), ("B", 3, 3, "E", "")])
+        with SharedFleetState(sim.cars, 5, 5) as state:
+            snapshots = []
+
+            def observe():
+                for _ in range(20):
+                    with FleetObserver(state.name) as observer:
+                        snapshots.append(observer.snapshot().x)
+
+            threads = [threading.Thread(target=observe) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        assert snapshots == [[1, 3]] * 160
+        assert resource_tracker.register is register
+
+    def test_observer_is_read_only(self):
+        """Test that observers cannot write to the block"""
+        sim = build_simulation(5, 5, [("A", 1, 1, "N", "F")])
+        with SharedFleetState(sim.cars, 5, 5) as state, FleetObserver(state.name) as observer:
+            assert observer.x[0] == 1
+            with pytest.raises(TypeError):
+                observer.x[0] = 3
+
+    def test_torn_reads_are_retried(self):
+        """Test that a read never returns while the writer is in the middle of a publish"""
+        sim = build_simulation(5, 5, [("A", 1, 1, "N", "F")])
+        with SharedFleetState(sim.cars, 5, 5) as state, FleetObserver(state.name) as observer:
+            before = observer.sequence
+            state.sequence += 1
+            SEQUENCE.pack_into(state.buffer, SEQUENCE_OFFSET, state.sequence)
+            with pytest.raises(RuntimeError):
+                observer.snapshot(retries=5)
+            state.sequence += 1
+            SEQUENCE.pack_into(state.buffer, SEQUENCE_OFFSET, state.sequence)
+            state.publish(sim.cars, [0], 1)
+            assert observer.sequence == before + 4
+            assert observer.snapshot().step == 1
+
+    def test_observer_process(self):
+        """Test an observer in another process following a run to the end"""
+        sim = build_simulation(50, 50, random_specs(3, 50, 50, 200, 400))
+        with SharedFleetState(sim.cars, 50, 50) as state:
+            sim.shared_state = state
+            steps = multiprocessing.Queue()
+            watcher = multiprocessing.Process(target=watch_fleet, args=(state.name, steps))
+            watcher.start()
+            sim.simulate()
+            seen = []
+            while not seen or not isinstance(seen[-1], tuple) or len(seen[-1]) != 6:
+                seen.append(steps.get(timeout=60))
+            watcher.join(timeout=60)
+        final = seen.pop()
+        assert [step for step, _ in seen] == sorted(step for step, _ in seen)
+        assert final[1] and final[2:] == self.fleet_state(sim)
+
+    def test_not_a_fleet(self):
+        """Test that attaching to a block of something else is refused"""
+        from multiprocessing import shared_memory
+
+        other = shared_memory.SharedMemory(create=True, size=64)
+        try:
+            with pytest.raises(ValueError):
+                FleetObserver(other.name)
+        finally:
+            other.close()
+            other.unlink()
+
+    def test_command_line(self, tmp_path, capsys):
+        """Test publishing a headless run, the block is removed once the run is over"""
+        scenario = tmp_path / "scenario.txt"
+        scenario.write_text("10 10\nA 1 2 N FFRFFFFRRL\nB 7 8 W FFLFFFFFFF\n")
+        name = f"fleet_test_{random.getrandbits(32)}"
+        assert carsimulation.main([str(scenario), "--share", name]) == 0
+        assert "- A, collides with B at (5,4) at step 7" in capsys.readouterr().out
+        with pytest.raises(FileNotFoundError):
+            FleetObserver(name)
+
+
+class TestMonteCarlo:
+    @pytest.fixture(autouse=True)
+    def numpy(self):
+        pytest.importorskip("numpy")
+
+    def test_fleets_are_seeded(self):
+        """Test that a seed always gives the same fleet, on distinct cells inside the grid"""
+        from montecarlo import random_fleet_arrays
+
+        fleet = random_fleet_arrays(5, 30, 20, 600, 3, 12, "FFLR")
+        again = random_fleet_arrays(5, 30, 20, 600, 3, 12, "FFLR")
+        other = random_fleet_arrays(6, 30, 20, 600, 3, 12, "FFLR")
+        assert all((a == b).all() for a, b in zip(fleet[:6], again[:6]))
+        assert not (fleet.x == other.x).all()
+        assert len(set(zip(fleet.x.tolist(), fleet.y.tolist()))) == 600
+        assert fleet.x.min() >= 0 and fleet.x.max() < 30 and fleet.y.max() < 20
+        assert 3 <= fleet.lengths.min() and fleet.lengths.max() <= 12
+        assert set(fleet.codes.tobytes()) <= set(b"FLR")
+
+    @pytest.mark.parametrize("seed", range(10))
+    def test_statistics_match_object_engine(self, seed):
+        """Test the statistics of a fleet against its collisions in the loop engine"""
+        from montecarlo import fleet_simulation, fleet_statistics, random_fleet_arrays
+
+        fleet = random_fleet_arrays(seed, 12, 12, 60, 0, 25)
+        stats = fleet_statistics(fleet, step_bin=5)
+        sim = fleet_simulation(fleet)
+        events = list(sim.iter_events())
+
+        assert stats["cars"] == 60
+        assert stats["collisions"] == len(events)
+        assert stats["collided"] == sum(car.collided for car in sim.cars)
+        sizes = [len(event.cars) for event in events]
+        assert stats["pileups"] == [sizes.count(size) for size in range(len(stats["pileups"]))]
+        steps = [event.step // 5 for event in events]
+        assert stats["steps"] == [steps.count(bucket) for bucket in range(len(stats["steps"]))]
+        # the fleet is left as generated
+        assert fleet_simulation(fleet).cars[0].x == int(fleet.x[0])
+
+    def test_sweep_is_reproducible(self):
+        """Test that a sweep gives the same statistics with any number of workers"""
+        from montecarlo import collision_sweep
+
+        serial = collision_sweep(range(20), 15, 15, 80, 5, 30, workers=1)
+        parallel = collision_sweep(range(20), 15, 15, 80, 5, 30, workers=3, chunk_size=4)
+        assert serial == parallel
+        assert [stats["seed"] for stats in serial["per_seed"]] == list(range(20))
+        assert serial["cars"] == 1600
+        assert serial["collisions"] == sum(serial["pileups"]) == sum(serial["steps"])
+        assert serial["collided"] == sum(stats["collided"] for stats in serial["per_seed"])
+        per_fleet = serial["collisions_per_fleet"]
+        assert per_fleet["min"] <= per_fleet["mean"] <= per_fleet["max"]
+
+    def test_bad_fleets(self):
+        """Test that impossible fleets are refused before anything runs"""
+        from montecarlo import collision_sweep, random_fleet_arrays
+
+        with pytest.raises(ValueError):
+            random_fleet_arrays(0, 3, 3, 10, 1, 5)
+        with pytest.raises(ValueError):
+            random_fleet_arrays(0, 10, 10, 10, 5, 1)
+        with pytest.raises(ValueError):
+            collision_sweep(range(3), 10, 10, 10, 1, 5, alphabet="FX")
+        with pytest.raises(ValueError):
+            collision_sweep(range(3), 10, 10, 10, 1, 5, step_bin=0)
+
+    def test_command_line(self, tmp_path, capsys):
+        """Test a sweep from the command line with the statistics written as JSON"""
+        import montecarlo
+
+        output = tmp_path / "sweep.json"
+        args = ["--seeds", "6", "--width", "10", "--height", "10", "--cars", "40", "--workers", "1"]
+        assert montecarlo.main([*args, "--json", str(output)]) == 0
+        assert capsys.readouterr().out.startswith("6 fleets of 40 cars")
+        assert json.loads(output.read_text())["fleets"] == 6
+        assert montecarlo.main(["--cars", "0", "--min-length", "9", "--max-length", "1"]) == 1
+
+
+def ansi_screen(text, screen=None):
+    """Plays back the cursor moves and text of a renderer on a dict of (row, column) -> character"""
+    screen = {} if screen is None else screen
+    for clear, row, column, chars in re.findall(r"(\x1b\[2J)|\x1b\[(\d+);(\d+)H([^\x1b]*)", text):
+        if clear:
+            screen.clear()
+            continue
+        for offset, char in enumerate(chars):
+            screen[int(row), int(column) + offset] = char
+    return screen
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 0.01
+        return self.now
+
+
+class TestViewportRenderer:
+    SPECS = [("A", 1, 1, "N", "FFRFF"), ("B", 1, 4, "S", "FF"), ("C", 6, 0, "W", "FFFFFFLF")]
+
+    def rows(self, screen, renderer):
+        return ["".join(screen.get((row, column), "?") for column in range(1, renderer.columns + 1)) for row in range(2, renderer.rows + 2)]
+
+    def test_final_frame(self):
+        """Test that the screen ends up showing the final field, top row first"""
+        sim = build_simulation(8, 5, self.SPECS)
+        output = io.StringIO()
+        sim.renderer = ViewportRenderer(output, columns=8, rows=5, fps=0)
+        sim.simulate()
+        screen = ansi_screen(output.getvalue())
+        assert self.rows(screen, sim.renderer) == ["........", "...>....", ".v......", "........", "v......."]
+        assert output.getvalue().endswith("\x1b[7;1H")
+
+    def test_only_changes_are_redrawn(self):
+        """Test that a frame only writes the cells that changed since the one before"""
+        sim = build_simulation(40, 40, [("A", 0, 0, "E", "F" * 30)])
+        output = io.StringIO()
+        renderer = ViewportRenderer(output, columns=40, rows=40, fps=0)
+        renderer.draw(sim, 0, OccupancyIndex(sim.cars).cells)
+        first = output.getvalue()
+        output.seek(0)
+        output.truncate()
+        sim.cars[0].x = 1
+        renderer.draw(sim, 1, OccupancyIndex(sim.cars).cells)
+        assert first.startswith("\x1b[2J") and first.count(".") == 40 * 40 - 1
+        # the car left one cell for the next, one run of two characters
+        assert output.getvalue().startswith("\x1b[41;1H.>\x1b[1;1Hstep 1")
+
+    def test_frames_are_throttled(self):
+        """Test that steps within the frame interval are not drawn"""
+        sim = build_simulation(20, 20, [("A", 0, 0, "N", "F" * 19), ("B", 5, 5, "E", "F" * 14)])
+        output = io.StringIO()
+        # every clock read takes 10ms, a frame is due every 50ms
+        sim.renderer = ViewportRenderer(output, columns=20, rows=20, fps=20, clock=FakeClock())
+        sim.simulate()
+        # steps 1, 6, 11 and 16, then the last frame
+        assert sim.renderer.frames == 5
+        screen = ansi_screen(output.getvalue())
+        assert screen[2, 1] == "^" and screen[16, 20] == ">"
+
+    def test_scrolling(self):
+        """Test a viewport that moves, and cells outside the grid left blank"""
+        sim = build_simulation(10, 10, [("A", 2, 2, "E", "F"), ("B", 9, 9, "S", "F")])
+        output = io.StringIO()
+        renderer = ViewportRenderer(output, x=-2, y=-1, columns=5, rows=4, fps=0)
+        cells = OccupancyIndex(sim.cars).cells
+        renderer.draw(sim, 0, cells)
+        screen = ansi_screen(output.getvalue())
+        assert self.rows(screen, renderer) == ["  ..>", "  ...", "  ...", "     "]
+        renderer.scroll(9, 8)
+        renderer.draw(sim, 0, cells)
+        screen = ansi_screen(output.getvalue())
+        assert self.rows(screen, renderer) == ["     ", "..v  ", "...  ", "...  "]
+
+    def test_large_fleet_lookup(self):
+        """Test that looking up the viewport cells gives the same frame as scanning every car"""
+        specs = random_specs(2, 30, 30, 600, 0)
+        sim = build_simulation(30, 30, specs)
+        cells = OccupancyIndex(sim.cars).cells
+        small = ViewportRenderer(io.StringIO(), x=3, y=4, columns=10, rows=10)
+        large = ViewportRenderer(io.StringIO(), x=3, y=4, columns=30, rows=30)
+        # 600 cars are more than the 100 cells of the small viewport, fewer than the 900 of the large one
+        assert small.frame(sim, cells) == [row[:10] for row in large.frame(sim, cells)[-10:]]
+
+    def test_other_engines_draw_the_end(self):
+        """Test that engines without steps draw the final frame"""
+        pytest.importorskip("numpy")
+        for engine in ("loop", "numpy"):
+            sim = build_simulation(8, 5, self.SPECS)
+            output = io.StringIO()
+            sim.renderer = ViewportRenderer(output, columns=8, rows=5, fps=1)
+            sim.simulate(engine)
+            screens = ansi_screen(output.getvalue())
+            assert "step 8 " in output.getvalue()
+            assert self.rows(screens, sim.renderer)[1:3] == ["...>....", ".v......"]
+
+    def test_command_line(self, tmp_path, capsys):
+        """Test rendering a headless run, with the results printed below the viewport"""
+        scenario = tmp_path / "scenario.txt"
+        scenario.write_text("10 10\nA 1 2 N FFRFFFFRRL\nB 7 8 W FFLFFFFFFF\n")
+        with patch("shutil.get_terminal_size", return_value=os.terminal_size((10, 12))):
+            assert carsimulation.main([str(scenario), "--render", "--view", "0,0"]) == 0
+        out = capsys.readouterr().out
+        assert out.index("\x1b[12;1H") < out.index("After simulation, the result is:")
+        with pytest.raises(SystemExit):
+            carsimulation.main([str(scenario), "--render", "--view", "here"])
+
+
+class TestMenuListing:
+    def fleet(self, count):
+        sim = Simulation(100, 100)
+        for index in range(count):
+            sim.insert_car(f"C{index}", index % 10 + 5, index // 10 + 2, "N", "F")
+        return sim
+
+    def test_summary_is_constant_size(self, capsys):
+        """Test that the summary shows the count, the box around the cars and the last three cars"""
+        sim = self.fleet(95)
+        sim.display_summary()
+        out = capsys.readouterr().out.splitlines()
+        assert out == [
+            "You have 95 cars placed within (5,2) to (14,11). Most recently added:",
+            "- C92, (7,11), N , F",
+            "- C93, (8,11), N , F",
+            "- C94, (9,11), N , F",
+        ]
+        sim.insert_car("Far", 60, 1, "S", "")
+        assert sim.bounding_box() == (5, 1, 60, 11)
+        sim.cars = [Car(3, 4, "N", "Only", "")]
+        sim.display_summary()
+        assert capsys.readouterr().out.startswith("You have 1 car placed within (3,4) to (3,4).")
+        Simulation(5, 5).display_summary()
+        assert capsys.readouterr().out == "You have no cars yet.\n"
+
+    def test_pages(self, capsys):
+        """Test listing the cars a page at a time"""
+        sim = self.fleet(45)
+        assert sim.display_cars_page(0)
+        assert sim.display_cars_page(1)
+        assert not sim.display_cars_page(2)
+        out = capsys.readouterr().out.splitlines()
+        assert out[0] == "Cars 1 to 20 of 45:"
+        assert out[21:23] == ["Cars 21 to 40 of 45:", "- C20, (5,4), N , F"]
+        assert out[42:] == ["Cars 41 to 45 of 45:"] + [str(car) for car in sim.cars[40:]]
+
+    @patch("builtins.input")
+    def test_list_no_cars(self, mock_input, capsys):
+        """Test that listing an empty field says so instead of showing an empty page"""
+        carsimulation.list_cars(Simulation(10, 10))
+        assert capsys.readouterr().out == "No cars in the field. Please add at least 1 car to list.\n"
+        mock_input.assert_not_called()
+
+    @patch("builtins.input", side_effect=["", "q"])
+    def test_list_cars_until_quit(self, mock_input, capsys):
+        """Test that the listing waits between pages and stops on q"""
+        carsimulation.list_cars(self.fleet(70), page_size=20)
+        out = capsys.readouterr().out
+        assert out.count("Press Enter for the next page") == 2
+        assert "Cars 21 to 40 of 70:" in out and "Cars 41 to 60" not in out
+
+    @patch("builtins.input", side_effect=["A 1 2 N FFR", "B 1 2 E", "C 3 x N", "C 3 3 w LF", "  D 0 0 S  ", "", "E 5 5 N"])
+    def test_add_many_cars(self, mock_input, capsys):
+        """Test adding a pasted block of cars up to the empty line, skipping invalid lines"""
+        sim = Simulation(10, 10)
+        assert carsimulation.add_many_cars(sim) == 3
+        out = capsys.readouterr().out
+        assert "Line 2 skipped: The location (1,2) is already occupied by another car." in out
+        assert "Line 3 skipped: x and y must both be integers" in out
+        assert out.endswith("Added 3 cars.\n")
+        assert [str(car) for car in sim.cars] == ["- A, (1,2), N , FFR", "- C, (3,3), W , LF", "- D, (0,0), S , "]
+
+    def test_menu_shows_summary(self, capsys):
+        """Test the menu loop with bulk added cars, a listing and a run"""
+        block = [f"C{index} {index} 0 N F" for index in range(30)]
+        answers = ["40 40", "3", *block, "", "4", "", "2", "2"]
+        with patch("builtins.input", side_effect=answers):
+            carsimulation.main([])
+        out = capsys.readouterr().out
+        assert "Added 30 cars." in out
+        assert "You have 30 cars placed within (0,0) to (29,0). Most recently added:" in out
+        assert "Your current list of cars are:" not in out
+        assert "Cars 21 to 30 of 30:" in out
+        assert "- C29, (29,1) N" in out
@@ -0,0 +1,209 @@
+import heapq
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+from car import DELTAS, TURNS
+
+NEVER = float("inf")
+
+
+def car_trajectory(
+    x: int, y: int, heading: int, commands: bytes, width: int, height: int
+) -> tuple[array, array, bytes]:
+    """
+    Positions and headings of a car after every one of its commands, ignoring other cars
+
+    Args:
+            x: Initial x-coordinate
+            y: Initial y-coordinate
+            heading: Initial heading (index into car.HEADINGS)
+            commands: Commands (F, L, R) as bytes
+            width: Width of Simulation Grid
+            height: Height of Simulation Grid
+
+    Returns:
+            x-coordinates, y-coordinates and headings, index 0 being the start
+    """
+    xs = array("q", [x])
+    ys = array("q", [y])
+    headings = bytearray([heading])
+
+    for command in commands:
+        turn = TURNS.get(command, 3)
+        if turn:
+            heading = (heading + turn) & 3
+        else:
+            dx, dy = DELTAS[heading]
+            if 0 <= x + dx < width:
+                x += dx
+            if 0 <= y + dy < height:
+                y += dy
+        xs.append(x)
+        ys.append(y)
+        headings.append(heading)
+
+    return xs, ys, bytes(headings)
+
+
+def _chunk_trajectories(chunk: tuple[list, int, int]) -> list[tuple[array, array, bytes]]:
+    """
+    Computes the trajectories of a chunk of cars in a worker process
+
+    Args:
+            chunk: (x, y, heading, commands) of each car, width and height of the grid
+    """
+    specs, width, height = chunk
+    return [car_trajectory(*spec, width, height) for spec in specs]
+
+
+def compute_trajectories(
+    specs: list[tuple[int, int, int, bytes]],
+    width: int,
+    height: int,
+    workers: int | None = None,
+    chunk_size: int = 256,
+) -> list[tuple[array, array, bytes]]:
+    """
+    Computes the trajectory of every car, in parallel when more than one worker is asked for
+
+    Args:
+            specs: (x, y, heading, commands) of each car
+            width: Width of Simulation Grid
+            height: Height of Simulation Grid
+            workers: Number of worker processes, None or 1 computes them in this process
+            chunk_size: Number of cars sent to a worker at a time
+    """
+    if not workers or workers <= 1 or len(specs) <= chunk_size:
+        return [car_trajectory(*spec, width, height) for spec in specs]
+
+    chunks = [
+        (specs[start : start + chunk_size], width, height)
+        for start in range(0, len(specs), chunk_size)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [
+            trajectory
+            for chunk in executor.map(_chunk_trajectories, chunks)
+            for trajectory in chunk
+        ]
+
+
+def run_trajectories(simulation, workers: int | None = None) -> None:
+    """
+    Runs the simulation by joining precomputed trajectories on (x, y, step) instead of stepping
+
+    Every car's path is computed on its own first. Cars only meet when two of them are on the same
+    cell at the same step, so collisions are found by grouping path points on (x, y, step) and
+    resolving them in step order. A collided car is frozen on its cell from then on, so any later
+    visit to that cell is checked again.
+
+    Args:
+            simulation: Simulation whose cars are moved
+            workers: Number of worker processes used to compute the trajectories
+    """
+    cars = simulation.cars
+    # cars that collided in an earlier run do not move again
+    trajectories = compute_trajectories(
+        [
+            (car.x, car.y, car.heading, b"" if car.collided else car.command_codes)
+            for car in cars
+        ],
+        simulation.width,
+        simulation.height,
+        workers,
+    )
+    lengths = [len(headings) - 1 for _, _, headings in trajectories]
+    max_moves = max(lengths)
+
+    # (x, y, step) -> cars on that cell at that step, while they still have commands
+    at = {}
+    # (x, y) -> sorted steps at which some car with commands is on it
+    visits = {}
+    for index, (xs, ys, _) in enumerate(trajectories):
+        for move in range(1, lengths[index] + 1):
+            cell = (xs[move], ys[move])
+            at.setdefault((*cell, move), []).append(index)
+            visits.setdefault(cell, []).append(move)
+    for steps in visits.values():
+        steps.sort()
+
+    # (x, y) -> cars that have run out of commands and stay on that cell
+    parked = {}
+    for index, (xs, ys, _) in enumerate(trajectories):
+        parked.setdefault((xs[-1], ys[-1]), []).append(index)
+
+    # step at which each car collided, and cars frozen on each cell
+    frozen_at = [0 if car.collided else NEVER for car in cars]
+    frozen = {}
+    for index, car in enumerate(cars):
+        if car.collided:
+            frozen.setdefault((car.x, car.y), []).append(index)
+
+    queue = []
+    queued = set()
+    # (x, y) -> step after which every visit to the cell is already queued
+    queued_after = {}
+
+    def push(move, cell):
+        if (move, cell) not in queued:
+            queued.add((move, cell))
+            heapq.heappush(queue, (move, cell))
+
+    def push_visits_after(move, cell):
+        limit = queued_after.get(cell, NEVER)
+        if move >= limit:
+            return
+        queued_after[cell] = move
+        steps = visits.get(cell, [])
+        for visit in steps[bisect_right(steps, move) :]:
+            if visit > limit:
+                break
+            push(visit, cell)
+
+    # two cars on the same cell at the same step
+    for (x, y, move), indexes in at.items():
+        if len(indexes) > 1:
+            push(move, (x, y))
+    # cars driving onto a parked or frozen car
+    for cell, indexes in parked.items():
+        push_visits_after(min(lengths[index] for index in indexes), cell)
+        # cars placed on the same cell without commands meet on the first step
+        if sum(1 for index in indexes if lengths[index] == 0) > 1 and max_moves:
+            push(1, cell)
+    for cell in frozen:
+        push_visits_after(0, cell)
+        if max_moves:
+            push(1, cell)
+
+    while queue:
+        move, cell = heapq.heappop(queue)
+
+        occupants = [
+            index for index in at.get((*cell, move), []) if frozen_at[index] >= move
+        ]
+        occupants += [
+            index
+            for index in parked.get(cell, [])
+            if lengths[index] < move and frozen_at[index] == NEVER
+        ]
+        occupants += frozen.get(cell, [])
+        if len(occupants) < 2:
+            continue
+
+        occupants.sort()
+        newly = [index for index in occupants if frozen_at[index] == NEVER]
+        if not newly:
+            continue
+
+        for index in newly:
+            frozen_at[index] = move
+            frozen.setdefault(cell, []).append(index)
+        simulation.mark_collision(occupants, cell, move)
+        push_visits_after(move, cell)
+
+    for index, (car, (xs, ys, headings)) in enumerate(zip(cars, trajectories)):
+        last = min(frozen_at[index], lengths[index])
+        car.x = xs[last]
+        car.y = ys[last]
+        car.heading = headings[last]
@@ -0,0 +1,159 @@
+import numpy as np
+
+from car import DELTAS
+
+# Per-heading steps, headings are the same 0-3 clockwise index Car uses
+DX = np.array([dx for dx, _ in DELTAS], dtype=np.int64)
+DY = np.array([dy for _, dy in DELTAS], dtype=np.int64)
+
+# Rotation applied by each command byte, 0 means move forward.
+# Anything that is not F or R rotates left, the same as Car.move
+TURN = np.full(256, 3, dtype=np.uint8)
+TURN[ord("F")] = 0
+TURN[ord("R")] = 1
+
+
+def simulate_arrays(
+    x: np.ndarray,
+    y: np.ndarray,
+    heading: np.ndarray,
+    codes: np.ndarray,
+    offsets: np.ndarray,
+    lengths: np.ndarray,
+    width: int,
+    height: int,
+    collided: np.ndarray | None = None,
+) -> list[tuple[int, tuple[int, int], np.ndarray, np.ndarray]]:
+    """
+    Steps a whole fleet held as arrays, updating x, y and heading in place.
+
+    Args:
+            x: int64 x-coordinate of every car
+            y: int64 y-coordinate of every car
+            heading: int64 heading of every car (index into car.HEADINGS)
+            codes: uint8 command bytes of every car, concatenated
+            offsets: Start of each car's commands inside codes
+            lengths: Number of commands of each car
+            width: Width of Simulation Grid
+            height: Height of Simulation Grid
+            collided: Cars that had already collided before the run, updated in place
+
+    Returns:
+            One (step, (x, y), occupants, newly collided) entry per collision, in step order.
+            Both arrays hold car indices in ascending order.
+    """
+    n = len(x)
+    if collided is None:
+        collided = np.zeros(n, dtype=bool)
+    collisions = []
+
+    if n == 0:
+        return collisions
+
+    max_moves = int(lengths.max())
+    active = np.arange(n)
+
+    # Flatten cells to one integer key, cars never leave the grid or their start cell
+    min_x = min(0, int(x.min()))
+    min_y = min(0, int(y.min()))
+    span_y = max(height, int(y.max()) + 1) - min_y
+
+    # Start at 1 to match the step numbers of the object engine
+    for move in range(1, max_moves + 1):
+
+        # Drop cars that have run out of commands or collided
+        active = active[(lengths[active] >= move) & ~collided[active]]
+        if not active.size:
+            break
+
+        turns = TURN[codes[offsets[active] + move - 1]]
+
+        forward = active[turns == 0]
+        fwd_heading = heading[forward]
+        new_x = x[forward] + DX[fwd_heading]
+        new_y = y[forward] + DY[fwd_heading]
+        # Each axis is clamped on its own, the same as Car.move
+        inside_x = (new_x >= 0) & (new_x < width)
+        inside_y = (new_y >= 0) & (new_y < height)
+        x[forward[inside_x]] = new_x[inside_x]
+        y[forward[inside_y]] = new_y[inside_y]
+        along_x = DX[fwd_heading] != 0
+        moved = forward[np.where(along_x, inside_x, inside_y)]
+
+        rotating = turns != 0
+        rotate = active[rotating]
+        heading[rotate] = (heading[rotate] + turns[rotating]) & 3
+
+        # Only cells that were moved into can hold a new collision,
+        # apart from the first step where cars may have started on the same cell
+        if move == 1:
+            candidates = np.arange(n)
+        elif moved.size:
+            keys = (x - min_x) * span_y + (y - min_y)
+            moved_cells = np.unique(keys[moved])
+            candidates = np.flatnonzero(np.isin(keys, moved_cells))
+            # every moved-into cell holds a single car
+            if candidates.size == moved_cells.size:
+                continue
+        else:
+            continue
+
+        cells = (x[candidates] - min_x) * span_y + (y[candidates] - min_y)
+        order = np.argsort(cells, kind="stable")
+        cells = cells[order]
+        candidates = candidates[order]
+
+        # Runs of equal cells with more than one car are collisions
+        starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+        ends = np.r_[starts[1:], cells.size]
+        for start, end in zip(starts[ends - starts > 1], ends[ends - starts > 1]):
+            occupants = candidates[start:end]
+            newly = occupants[~collided[occupants]]
+            if newly.size:
+                collided[newly] = True
+                pos = (int(x[occupants[0]]), int(y[occupants[0]]))
+                collisions.append((move, pos, occupants, newly))
+
+    return collisions
+
+
+def run_vectorized(simulation) -> None:
+    """
+    Runs the simulation with the NumPy engine and writes the results back to the cars
+
+    Args:
+            simulation: Simulation whose cars are stepped
+    """
+    cars = simulation.cars
+
+    x = np.array([car.x for car in cars], dtype=np.int64)
+    y = np.array([car.y for car in cars], dtype=np.int64)
+    heading = np.array([car.heading for car in cars], dtype=np.int64)
+    lengths = np.array([len(car.command_codes) for car in cars], dtype=np.int64)
+    offsets = np.zeros(len(cars), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    codes = np.frombuffer(b"".join(car.command_codes for car in cars), dtype=np.uint8)
+
+    collided = np.array([car.collided for car in cars], dtype=bool)
+    collisions = simulate_arrays(
+        x,
+        y,
+        heading,
+        codes,
+        offsets,
+        lengths,
+        simulation.width,
+        simulation.height,
+        collided,
+    )
+
+    for car, car_x, car_y, car_heading in zip(
+        cars, x.tolist(), y.tolist(), heading.tolist()
+    ):
+        car.x = car_x
+        car.y = car_y
+        car.heading = car_heading
+
+    # collisions are in step order so the same cars are still uncollided when marked
+    for move, pos, occupants, newly in collisions:
+        simulation.mark_collision(occupants.tolist(), pos, move)
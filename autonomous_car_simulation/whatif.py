@@ -0,0 +1,216 @@
+import os
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+
+from car import DELTAS, TURNS, Car
+from incremental import OccupancyTimeline
+from simulation import MoveEvent, Simulation
+from trajectory import NEVER
+
+# cell -> (starts, running max of ends) of the background stays on the cell, set in each worker
+_worker_stays = None
+
+
+def index_stays(timeline: OccupancyTimeline) -> dict:
+    """
+    Indexes the stays of a timeline for overlap queries.
+
+    The stays of each cell are sorted by start, alongside the largest end of the stays up to each
+    one. That running max only grows, so the first stay still on the cell at a step is found by
+    bisecting it.
+
+    Args:
+            timeline: Stays of every car of a finished run
+
+    Returns:
+            cell -> (starts, running max of ends)
+    """
+    stays = {}
+    for cell, cell_stays in timeline.cells.items():
+        cell_stays = sorted(cell_stays)
+        stays[cell] = (
+            [start for start, _, _ in cell_stays],
+            list(accumulate((end for _, end, _ in cell_stays), max)),
+        )
+    return stays
+
+
+def first_overlap(stays: dict, cell: tuple[int, int], start: int, end: float) -> float:
+    """
+    Returns the first step at which another car is on a cell during [start, end)
+
+    Args:
+            stays: Index from index_stays
+            cell: (x, y) of the cell
+            start: First step the car is on the cell
+            end: Step the car leaves the cell, NEVER if it stays
+    """
+    if cell not in stays:
+        return NEVER
+    starts, ends = stays[cell]
+    # the first stay, in start order, that has not ended by start
+    first = bisect_right(ends, start)
+    if first < len(starts) and starts[first] <= start:
+        return start
+    # otherwise nobody is on the cell at start, the first one to arrive after it decides
+    later = bisect_right(starts, start)
+    if later < len(starts) and starts[later] < end:
+        return starts[later]
+    return NEVER
+
+
+def first_collision(
+    stays: dict, x: int, y: int, heading: int, commands: bytes, width: int, height: int
+) -> float:
+    """
+    Returns the step at which a car running some commands would first collide with the background.
+    Until then the background runs as if the car were not there, so this is the exact step.
+
+    Args:
+            stays: Index from index_stays
+            x: Initial x-coordinate
+            y: Initial y-coordinate
+            heading: Initial heading (index into car.HEADINGS)
+            commands: Commands (F, L, R) as bytes
+            width: Width of Simulation Grid
+            height: Height of Simulation Grid
+
+    Returns:
+            The step, NEVER if the car never collides
+    """
+    cell = (x, y)
+    since = 0
+    for step, command in enumerate(commands, 1):
+        turn = TURNS.get(command, 3)
+        if turn:
+            heading = (heading + turn) & 3
+            continue
+        dx, dy = DELTAS[heading]
+        if 0 <= x + dx < width:
+            x += dx
+        if 0 <= y + dy < height:
+            y += dy
+        if (x, y) != cell:
+            # the stay on the last cell is over, every later stay starts after it
+            hit = first_overlap(stays, cell, since, step)
+            if hit != NEVER:
+                return max(hit, 1)
+            cell = (x, y)
+            since = step
+    hit = first_overlap(stays, cell, since, NEVER)
+    return hit if hit == NEVER else max(hit, 1)
+
+
+def _start_worker(stays: dict) -> None:
+    """
+    Keeps the background index in a worker process, so it is sent once per worker
+
+    Args:
+            stays: Index from index_stays
+    """
+    global _worker_stays
+    _worker_stays = stays
+
+
+def _score_chunk(chunk: tuple[list[bytes], tuple[int, int, int, int, int]]) -> list[float]:
+    """
+    Scores a chunk of candidates in a worker process
+
+    Args:
+            chunk: Candidate commands, and (x, y, heading, width, height) of the car
+    """
+    candidates, (x, y, heading, width, height) = chunk
+    return [
+        first_collision(_worker_stays, x, y, heading, commands, width, height)
+        for commands in candidates
+    ]
+
+
+class WhatIfEvaluator:
+    def __init__(self, simulation: Simulation, car_name: str) -> None:
+        """
+        Runs every car but one once, then checks candidate commands for that car against the
+        recorded traffic in time proportional to each candidate's length.
+
+        Args:
+                simulation: Simulation holding the car and the background traffic, it is not run
+                car_name: Name of the car to try commands for
+        """
+        names = [car.name for car in simulation.cars]
+        if car_name not in names:
+            raise ValueError(f"There is no car named {car_name}")
+        car = simulation.cars[names.index(car_name)]
+        self.width = simulation.width
+        self.height = simulation.height
+        self.start = (car.x, car.y, car.heading)
+
+        background = Simulation(simulation.width, simulation.height)
+        background.cars = [
+            Car(other.x, other.y, other.direction, other.name, other.commands)
+            for other in simulation.cars
+            if other is not car
+        ]
+        timeline = OccupancyTimeline(background.cars)
+        for event in background.iter_events(moves=True):
+            if isinstance(event, MoveEvent):
+                timeline.moved(event.index, (event.x, event.y), event.step)
+        self.stays = index_stays(timeline)
+
+    def first_collision(self, commands: str) -> float:
+        """
+        Returns the step at which the car would first collide running some commands
+
+        Args:
+                commands: Candidate commands (F, L, R)
+
+        Returns:
+                The step, NEVER if the car never collides
+        """
+        codes = Simulation.validate_commands(commands).encode("ascii")
+        return first_collision(self.stays, *self.start, codes, self.width, self.height)
+
+    def evaluate(
+        self, candidates: list[str], workers: int | None = None, chunk_size: int = 512
+    ) -> list[float]:
+        """
+        Scores many candidates, in parallel when more than one worker is asked for
+
+        Args:
+                candidates: Candidate commands (F, L, R)
+                workers: Number of worker processes, None uses every CPU and 1 scores them here
+                chunk_size: Number of candidates sent to a worker at a time
+
+        Returns:
+                Step of the first collision of each candidate, NEVER if it never collides
+        """
+        codes = [
+            Simulation.validate_commands(commands).encode("ascii") for commands in candidates
+        ]
+        workers = workers or os.cpu_count() or 1
+        if workers == 1 or len(codes) <= chunk_size:
+            return [
+                first_collision(self.stays, *self.start, commands, self.width, self.height)
+                for commands in codes
+            ]
+
+        car = (*self.start, self.width, self.height)
+        chunks = [
+            (codes[start : start + chunk_size], car)
+            for start in range(0, len(codes), chunk_size)
+        ]
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_start_worker, initargs=(self.stays,)
+        ) as executor:
+            return [score for chunk in executor.map(_score_chunk, chunks) for score in chunk]
+
+    def safe(self, candidates: list[str], workers: int | None = None) -> list[str]:
+        """
+        Returns the candidates with which the car never collides
+
+        Args:
+                candidates: Candidate commands (F, L, R)
+                workers: Number of worker processes, None uses every CPU
+        """
+        scores = self.evaluate(candidates, workers)
+        return [commands for commands, score in zip(candidates, scores) if score == NEVER]